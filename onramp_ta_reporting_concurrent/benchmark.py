@@ -0,0 +1,191 @@
+# benchmark module
+# Module holds the functions => run_scenario - manages a single benchmark run of the report pipeline
+# Functions responsible for driving TargetingAccuracyManager.process_manager end to end against the local fake Jira and
+# Qubole services of the fake_services module, one scenario per ticket count, and reporting the wall clock time, API
+# call counts, peak thread count and peak RSS of each run so concurrency and caching changes can be checked against
+# the container budget (300 MB, 1 CPU) before they ship
+#
+# Usage => python benchmark.py --tickets 10 100 1000 --pixels 2 --query-median 2 --qubole-failure-rate 0.02
+#
+import multiprocessing
+import argparse
+import tempfile
+import resource
+import threading
+import logging
+import queue
+import json
+import time
+import os
+
+
+# Builds the run configuration pointing the pipeline at the fake services, mirrors config_params of main.py
+#
+def scenario_config(options, jira_url, qubole_url, work_dir):
+    return {
+        "jira_url":            jira_url,
+        "jira_token":          ('benchmark', 'benchmark'),
+        "jql_agencies":        "('Transunion', 'Merkle')",
+        "jql_status":          "('Campaign Live')",
+        "jql_issuetype":       "('Media Partner')",
+        "qubole_token":        'benchmark',
+        "qubole_api_url":      qubole_url + '/api/',
+        "cluster_label":       'Hadoop2',
+        "engine_labels":       {'hive': 'Hadoop2', 'presto': 'presto', 'spark': 'spark'},
+        "engine_routing":      (options.default_engine, options.small_engine, options.small_max_impressions),
+        "max_qubole_commands": options.max_qubole_commands,
+        "max_jira_calls":      options.max_jira_calls,
+        "comment_posters":     options.comment_posters,
+        "jira_rate":           (options.jira_client_rate, options.jira_client_burst),
+        "qubole_retry":        (3, 10, options.poll_min, options.poll_max),
+        "poll_intervals":      (options.poll_min, options.poll_max, 1.5),
+        "ta_pct":              80.0,
+        "query_mode":          options.query_mode,
+        "query_variant":       options.query_variant,
+        "cache_file":          os.path.join(work_dir, 'benchmark_results.db'),
+        "history_file":        os.path.join(work_dir, 'benchmark_history.db'),
+        "trend_alert":         (4, 10),
+        "cache_mode":          options.cache,
+        "post_comments":       True,
+        "report_dates":        None,
+        "backfill":            False,
+        "plan":                False,
+        "readiness":           None,
+        "sharding":            None,
+        "master_files":        None,
+        "backfill_output":     None,
+        "preview":             (options.preview_rate, 1000) if options.query_mode == 'preview' else None,
+        "resume":              False,
+        "journal_file":        os.path.join(work_dir, 'benchmark_journal.jsonl'),
+        "metrics_path":        os.path.join(work_dir, 'benchmark_metrics'),
+        "results_file":        os.path.join(work_dir, 'benchmark_results.jsonl')
+    }
+
+
+# Runs the pipeline once in this (child) process while sampling its thread count, puts the measurements on the queue
+#
+def run_scenario(config_params, log_file, results):
+    from targeting_accuracy_manager import TargetingAccuracyManager
+
+    logging.basicConfig(filename=log_file, level=logging.INFO, format='%(asctime)s: %(levelname)s: %(message)s')
+    peak_threads = [threading.active_count()]
+    done = threading.Event()
+
+    def thread_sampler():
+        while not done.wait(0.05):
+            peak_threads[0] = max(peak_threads[0], threading.active_count())
+    threading.Thread(target=thread_sampler, name="ThreadSampler", daemon=True).start()
+
+    start = time.time()
+    manager = TargetingAccuracyManager(config_params)
+    manager.process_manager()
+    wall_clock = time.time() - start
+    done.set()
+    results.put({'wall_clock_seconds': round(wall_clock, 2),
+                 # The sampler thread itself is not part of the pipeline
+                 'peak_threads': peak_threads[0] - 1,
+                 # ru_maxrss is in kilobytes on Linux
+                 'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0, 1),
+                 'status_polls': manager.poller.api_calls})
+
+
+# Starts fresh fake services for a scenario, runs the pipeline in a spawned child process so its RSS and threads are
+# measured apart from the fakes and from earlier scenarios, returns the scenario report
+#
+def benchmark(tickets, options):
+    from fake_services import FakeJiraServer, FakeQuboleServer
+
+    jira = FakeJiraServer(tickets, options.pixels, options.jira_latency, options.jira_failure_rate,
+                          options.jira_rate_limit, options.seed)
+    qubole = FakeQuboleServer(options.query_median, options.query_sigma, options.queue_wait,
+                              options.qubole_failure_rate, options.qubole_rate_limit, options.seed)
+    jira_url = jira.start()
+    qubole_url = qubole.start()
+    work_dir = tempfile.mkdtemp(prefix='ta_benchmark_')
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    child = context.Process(target=run_scenario, args=(scenario_config(options, jira_url, qubole_url, work_dir),
+                                                       os.path.join(work_dir, 'benchmark.log'), results))
+    child.start()
+    report = wait_report(child, results, options.timeout)
+    child.join()
+    jira.server.shutdown()
+    qubole.server.shutdown()
+    report.update({'tickets': tickets, 'pixels_per_ticket': options.pixels, 'comments_posted': len(jira.comments),
+                   'jira_calls': jira.stats(), 'qubole_calls': qubole.stats(), 'work_dir': work_dir})
+    return report
+
+
+# Waits on the report of a scenario's child process, polling so a child that crashed or was killed before putting its
+# report is noticed at once rather than at the timeout, a child still running at the timeout is terminated
+#
+def wait_report(child, results, timeout):
+    deadline = time.time() + timeout
+    while True:
+        try:
+            return results.get(timeout=max(0.0, min(1.0, deadline - time.time())))
+        except queue.Empty:
+            if not child.is_alive():
+                try:
+                    # The report may have reached the queue just as the child exited
+                    return results.get(timeout=1.0)
+                except queue.Empty:
+                    return {'error': 'scenario process exited with code ' + str(child.exitcode) +
+                                     ' before reporting'}
+            if time.time() >= deadline:
+                child.terminate()
+                return {'error': 'scenario did not finish within ' + str(timeout) + ' seconds'}
+
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks the report pipeline against local fake Jira and Qubole "
+                                                 "services.")
+    parser.add_argument('--tickets', type=int, nargs='+', default=[10, 100, 1000], help="ticket count per scenario")
+    parser.add_argument('--pixels', type=int, default=2, help="pixels per ticket")
+    parser.add_argument('--query-mode', default='per_pixel', choices=['per_pixel', 'batched', 'preview'])
+    parser.add_argument('--preview-rate', type=float, default=0.05, help="sample rate of the preview query mode")
+    parser.add_argument('--query-variant', default='standard', choices=['standard', 'single_pass'])
+    parser.add_argument('--cache', default='bypass', choices=['use', 'refresh', 'bypass'])
+    parser.add_argument('--default-engine', default='hive', choices=['hive', 'presto', 'spark'])
+    parser.add_argument('--small-engine', default='', choices=['', 'hive', 'presto', 'spark'],
+                        help="engine of work units at most --small-max-impressions in size")
+    parser.add_argument('--small-max-impressions', type=int, default=5000000)
+    parser.add_argument('--query-median', type=float, default=2.0, help="median query run time in seconds")
+    parser.add_argument('--query-sigma', type=float, default=0.5, help="lognormal spread of the query run time")
+    parser.add_argument('--queue-wait', type=float, default=0.5, help="mean Qubole queue wait in seconds")
+    parser.add_argument('--qubole-failure-rate', type=float, default=0.0, help="fraction of queries ending in error")
+    parser.add_argument('--qubole-rate-limit', type=int, default=None, help="Qubole API calls per second")
+    parser.add_argument('--jira-latency', type=float, default=0.05, help="mean Jira response time in seconds")
+    parser.add_argument('--jira-failure-rate', type=float, default=0.0, help="fraction of Jira calls answered 503")
+    parser.add_argument('--jira-rate-limit', type=int, default=None, help="Jira API calls per second")
+    parser.add_argument('--max-qubole-commands', type=int, default=20)
+    parser.add_argument('--max-jira-calls', type=int, default=4)
+    parser.add_argument('--comment-posters', type=int, default=2)
+    parser.add_argument('--jira-client-rate', type=float, default=5, help="client side Jira requests per second")
+    parser.add_argument('--jira-client-burst', type=int, default=10)
+    parser.add_argument('--poll-min', type=float, default=0.5, help="seconds before the first status poll")
+    parser.add_argument('--poll-max', type=float, default=10, help="ceiling of the status poll interval")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=3600, help="seconds allowed per scenario")
+    parser.add_argument('--output', help="also write the scenario reports to this JSON file")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    arguments = parse_arguments()
+    reports = []
+    print("{:>8} {:>10} {:>10} {:>12} {:>8} {:>10} {:>9}".format('tickets', 'wall (s)', 'jira calls', 'qubole calls',
+                                                                'threads', 'RSS (MB)', 'comments'))
+    for ticket_count in arguments.tickets:
+        scenario = benchmark(ticket_count, arguments)
+        reports.append(scenario)
+        if 'error' in scenario:
+            print("{:>8} {}".format(ticket_count, scenario['error']))
+        else:
+            print("{:>8} {:>10} {:>10} {:>12} {:>8} {:>10} {:>9}".format(
+                ticket_count, scenario['wall_clock_seconds'], sum(scenario['jira_calls'].values()),
+                sum(scenario['qubole_calls'].values()), scenario['peak_threads'], scenario['peak_rss_mb'],
+                scenario['comments_posted']))
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            json.dump(reports, output_file, indent=2)
@@ -0,0 +1,176 @@
+# command_poller module
+# Module holds the class => CommandPoller - manages the status polling of in-flight Qubole commands
+# Class responsible for tracking every submitted command id from a single thread, polling each on an adaptive schedule
+# and resolving a future per command once it has finished
+#
+from qds_sdk.commands import HiveCommand
+from concurrent.futures import Future
+import threading
+import heapq
+import itertools
+import logging
+import time
+
+
+class CommandPoller(object):
+    def __init__(self, min_interval=5, max_interval=120, backoff=1.5, metrics=None):
+        self.min_interval = float(min_interval)
+        self.max_interval = float(max_interval)
+        self.backoff = float(backoff)
+        self.schedule = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.api_calls = 0
+        # Every command not yet seen finished, polled or not, so an aborted run can cancel them on Qubole
+        self.tracked = {}
+        self.cancelled = False
+        # Future of the command the polling thread is checking, out of the schedule while its status is fetched
+        self.polling = None
+        # Optional RunMetrics receiving the queue wait and run time of every command
+        self.metrics = metrics
+        self.logger = logging.log
+
+    # Registers a command id for polling, returns a future that resolves to the finished command object
+    #
+    def watch(self, command_id, command_class=HiveCommand, unit=None):
+        future = Future()
+        timing = {'unit': unit or command_id, 'submitted': time.time(), 'running': None}
+        with self.condition:
+            aborted = self.cancelled
+            if not aborted:
+                self.tracked[command_id] = command_class
+        if aborted:
+            # Launched while the run was being aborted
+            self.cancel_command(command_id, command_class)
+            future.cancel()
+            return future
+        with self.condition:
+            self.start()
+            heapq.heappush(self.schedule, (time.time() + self.min_interval, next(self.sequence), command_id,
+                                           command_class, self.min_interval, future, timing))
+            self.condition.notify()
+        return future
+
+    # Number of commands currently being tracked
+    #
+    def in_flight(self):
+        with self.condition:
+            return len(self.schedule)
+
+    # Launches the polling thread if it is not already running
+    #
+    def start(self):
+        with self.condition:
+            if not self.running:
+                self.running = True
+                self.thread = threading.Thread(target=self.poll_loop, name="CommandPoller", daemon=True)
+                self.thread.start()
+
+    # Stops the polling thread, any command still being tracked has its future cancelled, the one being checked too
+    #
+    def stop(self):
+        with self.condition:
+            self.running = False
+            pending = self.unscheduled()
+            self.condition.notify()
+        for future in pending:
+            future.cancel()
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    # Cancels every tracked command on Qubole along with its future, commands registered afterwards are cancelled as
+    # soon as they are watched, returns the number of commands cancelled
+    #
+    def cancel_all(self):
+        with self.condition:
+            self.cancelled = True
+            tracked = list(self.tracked.items())
+            self.tracked = {}
+            pending = self.unscheduled()
+            self.condition.notify()
+        cancelled = sum(1 for command_id, command_class in tracked if self.cancel_command(command_id, command_class))
+        for future in pending:
+            future.cancel()
+        return cancelled
+
+    # Empties the schedule, returns the futures of every scheduled command and of the one being checked, called with
+    # the condition held
+    #
+    def unscheduled(self):
+        pending = [entry[5] for entry in self.schedule]
+        if self.polling is not None:
+            pending.append(self.polling)
+        self.schedule = []
+        return pending
+
+    # Cancels a single command on Qubole, returns False if the cancel request failed
+    #
+    def cancel_command(self, command_id, command_class):
+        try:
+            command_class.cancel_id(command_id)
+            return True
+        except Exception as e:
+            self.logger(40, "Command " + str(command_id) + " could not be cancelled => {}".format(e))
+            return False
+
+    # Sleeps until the next command is due, polls it and either resolves its future or reschedules it with a longer
+    # interval, so short jobs are picked up quickly while long-running jobs cost few API calls
+    #
+    def poll_loop(self):
+        while True:
+            with self.condition:
+                while self.running and (not self.schedule or self.schedule[0][0] > time.time()):
+                    self.condition.wait(self.schedule[0][0] - time.time() if self.schedule else None)
+                if not self.running:
+                    return
+                due_time, seq, command_id, command_class, interval, future, timing = heapq.heappop(self.schedule)
+                if future.cancelled():
+                    continue
+                self.polling = future
+            try:
+                self.api_calls += 1
+                cmd = command_class.find(command_id)
+            except Exception as e:
+                self.logger(30, "Status poll failed for command " + str(command_id) + " => {}".format(e))
+                cmd = None
+            if cmd is not None:
+                self.record_timing(command_class, cmd.status, timing)
+            if cmd is not None and command_class.is_done(cmd.status):
+                with self.condition:
+                    self.tracked.pop(command_id, None)
+                    self.polling = None
+                self.resolve(future, cmd)
+            else:
+                interval = min(interval * self.backoff, self.max_interval)
+                with self.condition:
+                    self.polling = None
+                    # A command stopped or cancelled while it was being checked is not polled again
+                    if self.running and not future.done():
+                        heapq.heappush(self.schedule, (time.time() + interval, next(self.sequence), command_id,
+                                                       command_class, interval, future, timing))
+
+    # Resolves the future of a finished command, unless stop or cancel_all cancelled it while it was being checked
+    #
+    @staticmethod
+    def resolve(future, cmd):
+        if not future.done():
+            try:
+                future.set_result(cmd)
+            except Exception:
+                # Cancelled between the check and the result
+                pass
+
+    # Records the time a command waited in the Qubole queue once it is first seen running, and its run time once done
+    #
+    def record_timing(self, command_class, status, timing):
+        if self.metrics is None:
+            return
+        now = time.time()
+        if timing['running'] is None and (status == 'running' or command_class.is_done(status)):
+            timing['running'] = now
+            self.metrics.observe('qubole_queue_wait', now - timing['submitted'], timing['unit'])
+        if command_class.is_done(status):
+            self.metrics.observe('hive_run', now - timing['running'], timing['unit'],
+                                 error=not command_class.is_success(status))
@@ -0,0 +1,71 @@
+# comment_pipeline module
+# Module holds the class => CommentPipeline - manages the posting of query results to Jira
+# Class responsible for collecting the finished (ticket, pixel) results off the query workers, coalescing them per CAM
+# ticket and handing each complete ticket to a small pool of poster threads, so query workers never wait on Jira
+#
+import threading
+import queue
+import logging
+
+
+class CommentPipeline(object):
+    def __init__(self, post_function, posters=2):
+        self.post_function = post_function
+        self.posters = max(1, int(posters))
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.expected = {}
+        self.pending = {}
+        self.threads = []
+        self.logger = logging.log
+        for n in range(self.posters):
+            thread = threading.Thread(target=self.poster_loop, name="Poster-" + str(n + 1), daemon=True)
+            self.threads.append(thread)
+            thread.start()
+
+    # Registers the number of pixel results a ticket is waiting on before its comment can be posted
+    #
+    def expect(self, ticket_key, count):
+        with self.lock:
+            self.expected[ticket_key] = self.expected.get(ticket_key, 0) + count
+
+    # Adds a finished pixel result, queues the ticket for posting once all of its pixel results have arrived
+    #
+    def add(self, ticket, result):
+        with self.lock:
+            entries = self.pending.setdefault(ticket.key, [])
+            entries.append((ticket, result))
+            if len(entries) < self.expected.get(ticket.key, 1):
+                return
+            del self.pending[ticket.key]
+            self.expected.pop(ticket.key, None)
+        self.queue.put((ticket.key, entries))
+
+    # Queues every ticket still missing results, e.g. after a failed or cancelled work unit, then waits for the posters
+    # to drain the queue and stops them
+    #
+    def close(self):
+        with self.lock:
+            incomplete = list(self.pending.items())
+            self.pending = {}
+            self.expected = {}
+        for ticket_key, entries in incomplete:
+            self.logger(30, "Posting partial results for ticket " + ticket_key)
+            self.queue.put((ticket_key, entries))
+        for thread in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+    # Posts queued tickets until told to stop
+    #
+    def poster_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            ticket_key, entries = item
+            try:
+                self.post_function(ticket_key, entries)
+            except Exception as e:
+                self.logger(40, "Posting the comment for ticket " + ticket_key + " failed => {}".format(e))
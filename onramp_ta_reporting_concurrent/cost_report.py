@@ -0,0 +1,85 @@
+# cost_report module
+# Module holds the class => CostReport - manages the cost report of a planning run
+# Class responsible for reading the table scan statistics out of the Hive EXPLAIN plan of every query a run would
+# issue, and ranking the queries by the bytes and rows they would scan, with the run total and the queries scanning
+# far more than the others flagged as likely mis-entered pixel lists or dates
+#
+import logging
+import re
+
+
+class CostReport(object):
+    # A query scanning this many times the median query is flagged
+    outlier_factor = 5
+
+    def __init__(self, max_in_flight, top=5):
+        self.max_in_flight = max_in_flight
+        self.top = top
+        self.entries = []
+        self.logger = logging.log
+
+    # Returns the table scans of a Hive EXPLAIN plan => a list of (table alias, rows, bytes, complete statistics)
+    #
+    @staticmethod
+    def table_scans(plan):
+        scans = []
+        alias = None
+        for line in plan.splitlines():
+            line = line.strip()
+            if line.startswith('TableScan'):
+                alias = ''
+            elif alias == '' and line.startswith('alias:'):
+                alias = line.split(':', 1)[1].strip()
+            elif alias and line.startswith('Statistics:'):
+                stats = re.search(r'Num rows: (\d+) Data size: (\d+)', line)
+                if stats:
+                    scans.append((alias, int(stats.group(1)), int(stats.group(2)), 'Basic stats: COMPLETE' in line))
+                alias = None
+        return scans
+
+    # Adds a planned query with its EXPLAIN plan, None when the plan could not be produced, or a query the run would
+    # skip because its results are cached, a plan without any table scan read from it, e.g. the plan of a query routed
+    # to Presto or Spark, is reported as no plan rather than as a query scanning nothing
+    #
+    def add(self, label, tickets, plan=None, cached=False):
+        scans = self.table_scans(plan) if plan else []
+        self.entries.append({'label': label, 'tickets': sorted(set(tickets)), 'cached': cached,
+                             'explained': bool(scans) or cached,
+                             'rows': sum(scan[1] for scan in scans), 'bytes': sum(scan[2] for scan in scans),
+                             'complete': bool(scans) and all(scan[3] for scan in scans),
+                             'tables': sorted(set(scan[0] for scan in scans))})
+
+    # Returns the report lines => the queries ranked by bytes scanned, the run total and the flagged queries
+    #
+    def lines(self):
+        ranked = sorted((entry for entry in self.entries if not entry['cached']), key=lambda entry: -entry['bytes'])
+        sizes = sorted(entry['bytes'] for entry in ranked if entry['explained'])
+        median = sizes[len(sizes) // 2] if sizes else 0
+        lines = ["{:>4}  {:>14}  {:>16}  {}".format('rank', 'scan (GB)', 'rows scanned', 'query => tickets')]
+        for rank, entry in enumerate(ranked, 1):
+            flags = []
+            if not entry['explained']:
+                flags.append('no plan')
+            elif not entry['complete']:
+                flags.append('stats incomplete')
+            if median and entry['bytes'] > self.outlier_factor * median:
+                flags.append('OUTLIER ' + str(round(entry['bytes'] / float(median), 1)) + 'x median')
+            lines.append("{:>4}  {:>14,.2f}  {:>16,d}  {} => {}{}".format(
+                rank, entry['bytes'] / 1e9, entry['rows'], entry['label'], ", ".join(entry['tickets']),
+                " [" + "; ".join(flags) + "]" if flags else ""))
+        cached = len(self.entries) - len(ranked)
+        lines.append("Total => " + str(len(ranked)) + " queries scanning " +
+                     "{:,.2f}".format(sum(entry['bytes'] for entry in ranked) / 1e9) + " GB and " +
+                     "{:,d}".format(sum(entry['rows'] for entry in ranked)) + " rows, " + str(cached) +
+                     " served from the result cache, at most " + str(min(len(ranked), self.max_in_flight)) +
+                     " running at once (max in-flight commands = " + str(self.max_in_flight) + ")")
+        lines.append("Top offenders => " + (", ".join(entry['label'] for entry in ranked[:self.top]
+                                                      if entry['bytes']) or "none"))
+        return lines
+
+    # Prints the report and enters it in the log file
+    #
+    def write(self):
+        for line in self.lines():
+            print(line)
+            self.logger(20, line)
@@ -0,0 +1,99 @@
+# daily_aggregate_store module
+# Module holds the class => DailyAggregateStore - manages the materialized per-day partial counts
+# Class responsible for storing the additive TOTAL_IMPRESSIONS, ELIGIBLE_INDIVIDUALS and MATCHED_INDIVIDUALS counts per
+# day, pixel and profile set in a local SQLite file, so any reporting window can be summed locally and only the days not
+# yet materialized need to be queried
+#
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+import sqlite3
+import threading
+import time
+
+
+class DailyAggregateStore(object):
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("""create table if not exists daily_aggregates (
+                                       pixel text,
+                                       profile_ids text,
+                                       data_date text,
+                                       total_impressions integer,
+                                       eligible_individuals integer,
+                                       matched_individuals integer,
+                                       command_id text,
+                                       run_time real,
+                                       primary key (pixel, profile_ids, data_date))""")
+
+    # Lists the days of a reporting window in the format of %Y%m%d
+    #
+    @staticmethod
+    def window_days(report_start_date, report_end_date):
+        start = datetime.strptime(str(report_start_date), "%Y%m%d")
+        end = datetime.strptime(str(report_end_date), "%Y%m%d")
+        return [(start + timedelta(days=n)).strftime("%Y%m%d") for n in range((end - start).days + 1)]
+
+    # Derives the five weekly report columns from the summed counts, rounding the percentages the way Hive does
+    #
+    @staticmethod
+    def report_columns(total_impressions, eligible_individuals, matched_individuals):
+        def percent(count):
+            if not total_impressions:
+                return 0.0
+            ratio = Decimal(repr(count / total_impressions)).quantize(Decimal('0.0001'), rounding=ROUND_HALF_UP)
+            return float(ratio) * 100
+        return [str(total_impressions), str(eligible_individuals), repr(percent(eligible_individuals)),
+                str(matched_individuals), repr(percent(matched_individuals))]
+
+    # Returns the days of the window that have not been materialized for the pixel and profile set
+    #
+    def missing_days(self, unit_key, report_start_date, report_end_date):
+        pixel, profile_ids = unit_key
+        days = self.window_days(report_start_date, report_end_date)
+        with self.lock:
+            stored = set(row[0] for row in self.connection.execute(
+                "select data_date from daily_aggregates where pixel = ? and profile_ids = ? and data_date between ? "
+                "and ?", (pixel, ",".join(profile_ids), days[0], days[-1])))
+        return [day for day in days if day not in stored]
+
+    # Stores the partial counts of the queried days, a day without a returned row only stores zeros when its partition
+    # is confirmed complete, otherwise it may not have landed yet and is left missing to be queried again
+    #
+    def put_days(self, unit_key, data_dates, rows, command_id=None, confirmed_days=()):
+        pixel, profile_ids = unit_key
+        counts = dict((str(row[0]), row[1:4]) for row in rows)
+        with self.lock, self.connection:
+            for day in data_dates:
+                if day not in counts and day not in confirmed_days:
+                    continue
+                total, eligible, matched = counts.get(day, (0, 0, 0))
+                self.connection.execute("insert or replace into daily_aggregates values (?, ?, ?, ?, ?, ?, ?, ?)",
+                                        (pixel, ",".join(profile_ids), day, int(total), int(eligible), int(matched),
+                                         None if command_id is None else str(command_id), time.time()))
+
+    # Sums the stored days of a reporting window, returns the five weekly report columns
+    #
+    def window_result(self, unit_key, report_start_date, report_end_date):
+        pixel, profile_ids = unit_key
+        with self.lock:
+            total, eligible, matched = self.connection.execute(
+                "select sum(total_impressions), sum(eligible_individuals), sum(matched_individuals) from "
+                "daily_aggregates where pixel = ? and profile_ids = ? and data_date between ? and ?",
+                (pixel, ",".join(profile_ids), str(report_start_date), str(report_end_date))).fetchone()
+        return self.report_columns(total or 0, eligible or 0, matched or 0)
+
+    # Removes days materialized more than the retention period ago
+    #
+    def purge(self, retention_days):
+        with self.lock, self.connection:
+            self.connection.execute("delete from daily_aggregates where run_time < ?",
+                                    (time.time() - int(retention_days) * 86400,))
+
+    # Closes the store file
+    #
+    def close(self):
+        with self.lock:
+            self.connection.close()
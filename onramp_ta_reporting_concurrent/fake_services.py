@@ -0,0 +1,238 @@
+# fake_services module
+# Module holds the classes => FakeJiraServer - stands in for the Jira REST API
+#                            FakeQuboleServer - stands in for the Qubole command API
+# Classes responsible for serving the handful of Jira and Qubole endpoints the report uses from local HTTP servers, with
+# configurable ticket counts, pixels per ticket, query latencies, failure rates and rate limits, so the pipeline can be
+# benchmarked offline => used by the benchmark module only
+#
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+from datetime import datetime, timedelta
+import threading
+import random
+import json
+import time
+import re
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeService(object):
+    def __init__(self, rate_limit=None, seed=1):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.rate_limit = rate_limit
+        self.window = (0, 0)
+        self.random = random.Random(seed)
+        self.server = None
+
+    # Starts serving on a free local port, returns the base url
+    #
+    def start(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def handle_method(self, method):
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length).decode('utf-8') or 'null') if length else None
+                status, payload, headers = service.dispatch(method, url.path, parse_qs(url.query), body)
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self.handle_method('GET')
+
+            def do_POST(self):
+                self.handle_method('POST')
+
+            def do_PUT(self):
+                self.handle_method('PUT')
+
+            def do_DELETE(self):
+                self.handle_method('DELETE')
+
+        self.server = ThreadingServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return 'http://127.0.0.1:' + str(self.server.server_address[1])
+
+    # Counts the call and applies the per second rate limit, returns True if the call is throttled
+    #
+    def throttled(self, name):
+        with self.lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if not self.rate_limit:
+                return False
+            second = int(time.time())
+            count = self.window[1] + 1 if self.window[0] == second else 1
+            self.window = (second, count)
+            if count > self.rate_limit:
+                self.calls['throttled'] = self.calls.get('throttled', 0) + 1
+                return True
+            return False
+
+    # Returns the number of calls received per endpoint
+    #
+    def stats(self):
+        with self.lock:
+            return dict(self.calls)
+
+    def dispatch(self, method, path, query, body):
+        raise NotImplementedError
+
+
+class FakeJiraServer(FakeService):
+    def __init__(self, tickets=10, pixels_per_ticket=2, latency=0.05, failure_rate=0.0, rate_limit=None, seed=1):
+        FakeService.__init__(self, rate_limit, seed)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        start_date = (datetime.now() - timedelta(days=60)).strftime("%Y-%m-%d")
+        end_date = (datetime.now() + timedelta(days=60)).strftime("%Y-%m-%d")
+        self.issues = []
+        for n in range(tickets):
+            pixels = [str(100000 + self.random.randrange(tickets * pixels_per_ticket))
+                      for p in range(pixels_per_ticket)]
+            profile_ids = [",".join(str(500 + self.random.randrange(50)) for s in range(self.random.randint(1, 3)))
+                           for p in range(pixels_per_ticket)]
+            self.issues.append({'id': str(10000 + n), 'key': 'CAM-' + str(n + 1),
+                                'fields': {'customfield_10431': start_date, 'customfield_10418': end_date,
+                                           'customfield_11447': ", ".join(pixels),
+                                           'customfield_12413': " | ".join(profile_ids),
+                                           'customfield_11486': 'Campaign Manager',
+                                           'reporter': {'key': 'reporter', 'name': 'reporter'}}})
+        self.comments = []
+
+    # Serves the search, issue, comment and session endpoints, anything else gets an empty object
+    #
+    def dispatch(self, method, path, query, body):
+        endpoint = re.sub(r'CAM-\d+', '{key}', path)
+        if self.throttled(endpoint):
+            return 429, {'errorMessages': ['Rate limit exceeded']}, {'Retry-After': '1'}
+        time.sleep(self.random.expovariate(1.0 / self.latency) if self.latency else 0)
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            return 503, {'errorMessages': ['Service unavailable']}, {}
+        if path.endswith('/serverInfo'):
+            return 200, {'versionNumbers': [7, 0, 0], 'version': '7.0.0', 'deploymentType': 'Server'}, {}
+        if path.endswith('/field'):
+            return 200, [], {}
+        if path.endswith('/search'):
+            start = int(query.get('startAt', ['0'])[0])
+            size = int(query.get('maxResults', ['50'])[0])
+            return 200, {'startAt': start, 'maxResults': size, 'total': len(self.issues),
+                         'issues': self.issues[start:start + size]}, {}
+        match = re.search(r'/issue/(CAM-\d+)(/comment)?$', path)
+        if match and method == 'POST' and match.group(2):
+            with self.lock:
+                self.comments.append((match.group(1), body))
+            return 201, {'id': str(len(self.comments)), 'body': (body or {}).get('body')}, {}
+        if match:
+            issue = [issue for issue in self.issues if issue['key'] == match.group(1)]
+            return (200, issue[0], {}) if issue else (404, {'errorMessages': ['Issue does not exist']}, {})
+        return 200, {}, {}
+
+
+class FakeQuboleServer(FakeService):
+    def __init__(self, latency_median=2.0, latency_sigma=0.5, queue_wait=0.5, failure_rate=0.0, rate_limit=None,
+                 seed=1):
+        FakeService.__init__(self, rate_limit, seed)
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.queue_wait = queue_wait
+        self.failure_rate = failure_rate
+        self.commands = {}
+
+    # Serves command create, status, results, logs and cancel, commands run for a lognormal time after a queue wait
+    #
+    def dispatch(self, method, path, query, body):
+        match = re.search(r'/commands(?:/(\d+))?(/results|/logs)?$', path)
+        endpoint = 'commands' + (match.group(2) if match and match.group(2) else '/{id}' if match and match.group(1)
+                                 else '')
+        if self.throttled(method + ' ' + endpoint):
+            return 429, {'error': {'error_message': 'Rate limit exceeded'}}, {'Retry-After': '1'}
+        if not match:
+            return 404, {'error': {'error_message': 'Not found'}}, {}
+        if method == 'POST':
+            with self.lock:
+                command_id = len(self.commands) + 1
+                started = time.time() + self.random.expovariate(1.0 / self.queue_wait) if self.queue_wait else \
+                    time.time()
+                self.commands[command_id] = {
+                    'query': (body or {}).get('query', ''), 'started': started,
+                    'finished': started + self.random.lognormvariate(0, self.latency_sigma) * self.latency_median,
+                    'failed': self.random.random() < self.failure_rate, 'cancelled': False}
+            return 200, self.command_json(command_id), {}
+        command_id = int(match.group(1))
+        if command_id not in self.commands:
+            return 404, {'error': {'error_message': 'Command not found'}}, {}
+        if method == 'PUT':
+            self.commands[command_id]['cancelled'] = True
+            return 200, self.command_json(command_id), {}
+        if match.group(2) == '/logs':
+            return 200, "Container killed on request. Exit code is 143" if self.commands[command_id]['failed'] \
+                else "OK", {}
+        if match.group(2):
+            return 200, {'inline': True, 'results': self.results(self.commands[command_id]['query'])}, {}
+        return 200, self.command_json(command_id), {}
+
+    # Returns the command resource with its current status
+    #
+    def command_json(self, command_id):
+        command = self.commands[command_id]
+        now = time.time()
+        if command['cancelled']:
+            status = 'cancelled'
+        elif now < command['started']:
+            status = 'waiting'
+        elif now < command['finished']:
+            status = 'running'
+        else:
+            status = 'error' if command['failed'] else 'done'
+        return {'id': command_id, 'status': status, 'command_type': 'HiveCommand',
+                'meta_data': {'results_resource': 'commands/' + str(command_id) + '/results'}}
+
+    # Makes up plausible result rows in the shape the query asks for => one per backfill unit and week, one per
+    # preview bucket, one per batched unit, one per day or a single row
+    #
+    def results(self, query):
+        def counts():
+            total = self.random.randint(1000, 100000)
+            eligible = int(total * self.random.uniform(0.3, 0.9))
+            return total, eligible, int(eligible * self.random.uniform(0.5, 1.0))
+
+        def row(total, eligible, matched):
+            return [str(total), str(eligible), str(round(eligible * 100.0 / total, 2)), str(matched),
+                    str(round(matched * 100.0 / total, 2))]
+        buckets = re.search(r'\) < (\d+)\s', query)
+        units = re.search(r'stack\(\d+, (.*?)\) as \(unit_id', query, re.S)
+        weeks = re.search(r'stack\(\d+, ([^)]*)\) as \(data_date, week_id', query, re.S)
+        days = re.search(r'data_date in \(([\d,]+)\)', query)
+        if units and weeks:
+            values = [value.strip() for value in units.group(1).split(',')]
+            unit_ids = sorted(set(values[n] for n in range(0, len(values), 3)), key=int)
+            values = [value.strip() for value in weeks.group(1).split(',')]
+            week_ids = sorted(set(values[n] for n in range(1, len(values), 2)), key=int)
+            return "".join("\t".join([unit_id, week_id] + row(*counts())) + "\n"
+                           for unit_id in unit_ids for week_id in week_ids)
+        if buckets:
+            return "".join("\t".join([str(bucket)] + [str(int(count * 0.001)) for count in counts()]) + "\n"
+                           for bucket in range(int(buckets.group(1))))
+        if units:
+            values = [value.strip() for value in units.group(1).split(',')]
+            unit_ids = sorted(set(values[n] for n in range(0, len(values), 3)), key=int)
+            return "".join("\t".join([unit_id] + row(*counts())) + "\n" for unit_id in unit_ids)
+        if days:
+            return "".join("\t".join([day] + [str(count) for count in counts()]) + "\n"
+                           for day in days.group(1).split(','))
+        return "\t".join(row(*counts())) + "\n"
@@ -0,0 +1,120 @@
+# jira_client_pool module
+# Module holds the class => JiraClientPool - manages a bounded pool of JIRA connections
+# Class responsible for handing each worker its own keep-alive JIRA connection, pacing the requests of all threads
+# through one token bucket and retrying throttled, failed or dropped requests with jittered backoff, writes are only
+# retried when Jira cannot have applied them, so a comment is never posted twice
+#
+from jira import JIRA, JIRAError
+from contextlib import contextmanager
+from urllib3.exceptions import NewConnectionError
+from token_bucket import TokenBucket
+import requests
+import threading
+import queue
+import random
+import logging
+import time
+
+
+class JiraClientPool(object):
+    # Responses worth retrying => throttled and server side failures
+    retry_status_codes = (429, 500, 502, 503, 504)
+    # Transport failures worth retrying => refused or dropped connections and timeouts
+    retry_exceptions = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+    # Calls that change a ticket, which a retry could apply twice
+    write_methods = ('add_comment',)
+
+    def __init__(self, url, jira_token, size=4, rate=5, burst=10, max_retries=4, backoff=1.0):
+        self.url = url
+        self.jira_token = jira_token
+        self.size = max(1, int(size))
+        self.bucket = TokenBucket(rate, burst)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.clients = queue.Queue()
+        self.created = []
+        self.lock = threading.Lock()
+        self.logger = logging.log
+        # The first connection is opened up front so a bad url or token fails the run immediately
+        self.clients.put(self.new_client())
+
+    # Opens a new JIRA connection, each holds its own keep-alive requests session, whose own retries are turned off so
+    # every retry is made and counted here
+    #
+    def new_client(self):
+        client = JIRA(self.url, basic_auth=self.jira_token, max_retries=0)
+        self.created.append(client)
+        return client
+
+    # Lends a connection to the calling thread, opening a new one while the pool is below its size
+    #
+    @contextmanager
+    def client(self):
+        try:
+            client = self.clients.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                client = self.new_client() if len(self.created) < self.size else None
+            if client is None:
+                client = self.clients.get()
+        try:
+            yield client
+        finally:
+            self.clients.put(client)
+
+    # Calls a JIRA method on a pooled connection within the shared rate limit, retries throttled and server side
+    # failures, connection errors and timeouts with jittered exponential backoff, honouring the Retry-After header
+    # when Jira sends one, a write is only retried when it was throttled or never sent, since Jira may have applied a
+    # write whose response was lost
+    #
+    def call(self, method, *args, **kwargs):
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                with self.client() as client:
+                    return getattr(client, method)(*args, **kwargs)
+            except JIRAError as e:
+                if not self.is_retryable(method, e) or attempt >= self.max_retries:
+                    raise
+                retry_after = e.response.headers.get('Retry-After') if e.response is not None else None
+                delay = float(retry_after) if retry_after and retry_after.isdigit() else self.backoff_delay(attempt)
+                self.logger(30, "Jira " + method + " returned " + str(e.status_code) + ", retrying in " +
+                            str(round(delay, 1)) + " seconds")
+            except self.retry_exceptions as e:
+                if not self.is_retryable(method, e) or attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt)
+                self.logger(30, "Jira " + method + " failed => " + type(e).__name__ + ", retrying in " +
+                            str(round(delay, 1)) + " seconds")
+            time.sleep(delay)
+            attempt += 1
+
+    # Checks whether a failed call may be retried => reads on any retryable failure, writes only when throttled or when
+    # the connection failed before the request was sent
+    #
+    def is_retryable(self, method, e):
+        if isinstance(e, JIRAError):
+            return e.status_code == 429 if method in self.write_methods else e.status_code in self.retry_status_codes
+        return method not in self.write_methods or self.is_unsent(e)
+
+    # Checks whether a transport failure happened before the request was sent => the connection was refused or could
+    # not be made in time
+    #
+    @staticmethod
+    def is_unsent(e):
+        if isinstance(e, requests.exceptions.ConnectTimeout):
+            return True
+        reason = e.args[0] if e.args else None
+        return isinstance(getattr(reason, 'reason', reason), NewConnectionError)
+
+    # Returns the jittered exponential backoff delay of a retry
+    #
+    def backoff_delay(self, attempt):
+        return self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+    # Ends the session of every pooled connection
+    #
+    def close(self):
+        for client in self.created:
+            client.kill_session()
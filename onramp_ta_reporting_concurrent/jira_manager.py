@@ -2,15 +2,21 @@
 # Module holds the class => JiraManager - manages JIRA ticket interface
 # Class responsible for all JIRA related interactions including ticket searching, data pull and comment posting
 #
-from jira import JIRA
+from jira_client_pool import JiraClientPool
 import logging
 from datetime import datetime, timedelta
 
 
 class JiraManager(object):
-    def __init__(self, url, jira_token):
-        self.tickets = []
-        self.jira = JIRA(url, basic_auth=jira_token)
+    # Only the ticket fields the report needs are requested from Jira
+    report_fields = ['customfield_10431', 'customfield_10418', 'customfield_11447', 'customfield_12413',
+                     'customfield_11486', 'reporter']
+
+    def __init__(self, url, jira_token, page_size=100, pool_size=4, rate=5, burst=10):
+        self.issue_cache = {}
+        self.page_size = page_size
+        # Every Jira request goes through the pooled, rate limited clients
+        self.jira = JiraClientPool(url, jira_token, size=pool_size, rate=rate, burst=burst)
         self.campaign_start_date = 0
         self.campaign_end_date = 0
         self.pixels = []
@@ -19,23 +25,47 @@ class JiraManager(object):
         self.logger = logging.log
         self.today_date = (datetime.now() - timedelta(hours=6)).strftime('%m/%d/%Y')
         self.ta_alert = "The Targeting Accuracy has fallen below - "
+        self.trend_alert = "The Targeting Accuracy has fallen well below its {0}-week moving average"
         self.ticket_data_alert = "There may be a problem with the ticket data, please check that both the " \
                                  "'Pixels' and 'Profile ID/s' fields have been populated and are proportionate."
 
-    # Searches Jira for all tickets that match the query criteria
+    # Searches Jira for all tickets that match the query criteria, yields the result pages lazily as they are read,
+    # requesting only the report fields, each issue is kept in the issue cache for the rest of the run
     #
-    def find_issues(self, issue_types, status_types, agency_names):
+    def issue_pages(self, issue_types, status_types, agency_names):
         # Query to find qualified Jira Tickets
         jql_query = "project IN (CAM) AND issuetype IN " + issue_types + " AND status IN " + status_types + \
                     " AND agency IN " + agency_names + " AND labels in ('Individually_Fulfilled') " + \
                     " ORDER BY 'End Date' ASC"
-        self.tickets = self.jira.search_issues(jql_query)
-        return self.tickets
+        read = 0
+        while True:
+            page = self.jira.call('search_issues', jql_query, startAt=read, maxResults=self.page_size,
+                                  fields=",".join(self.report_fields))
+            for issue in page:
+                self.issue_cache[issue.key] = issue
+            read += len(page)
+            total = getattr(page, 'total', None)
+            if page:
+                yield list(page)
+            # Jira may cap a page below the requested size, so the reported total decides when the search is done
+            if total is None and len(page) < self.page_size or total is not None and read >= total:
+                break
+            if not page:
+                self.logger(30, "The Jira search ended after " + str(read) + " of " + str(total) + " tickets, the "
+                                "matching tickets changed while it was paged.")
+                break
+
+    # Returns the issue from the issue cache, fetching only the report fields on a miss
+    #
+    def cached_issue(self, cam_id):
+        if cam_id not in self.issue_cache:
+            self.issue_cache[cam_id] = self.jira.call('issue', cam_id, fields=",".join(self.report_fields))
+        return self.issue_cache[cam_id]
 
     # Retrieves the required data from ticket to run query
     #
     def report_information_pull(self, cam_id):
-        ticket = self.jira.issue(cam_id)
+        ticket = self.cached_issue(cam_id)
         self.campaign_start_date = datetime.strptime(ticket.fields.customfield_10431, "%Y-%m-%d").strftime("%Y%m%d")
         self.campaign_end_date = datetime.strptime(ticket.fields.customfield_10418, "%Y-%m-%d").strftime("%Y%m%d")
         self.pixels = ticket.fields.customfield_11447.replace(' ', '').split(',')
@@ -46,7 +76,7 @@ class JiraManager(object):
     # Add report results to ticket in the form of a comment
     #
     def add_report_comment(self, cam_id, pixel, query_results, report_start_date, report_end_date):
-        ticket = self.jira.issue(cam_id)
+        ticket = self.cached_issue(cam_id)
         reporter = ticket.fields.reporter.key
         message = """|Reporting Dates|{start_date}  thru  {end_date}| 
                      |Pixel|{pixel_no}|
@@ -63,24 +93,145 @@ class JiraManager(object):
                                                                   ind_match_pct=str(round(float(query_results[2]), 2)),
                                                                   z_match_ind="{0:,d}".format(int(query_results[3])),
                                                                   target_acc=str(round(float(query_results[4]), 2)))
-        self.jira.add_comment(issue=ticket, body=message)
+        self.jira.call('add_comment', issue=cam_id, body=message)
+
+    # Add the report results of all pixels on a ticket as a single table comment, pixels whose 'target accuracy' falls
+    # short are flagged in the table and called out to the campaign manager at the end of the comment, given the trend
+    # of each pixel result in the same order => (change from the previous week, moving average, trend alert), the table
+    # shows the week over week change and moving average and the pixels that dropped well below their moving average
+    # are called out as well
+    #
+    def add_ticket_report_comment(self, cam_id, pixel_results, report_start_date, report_end_date, ta_pct, trends=None,
+                                  trend_weeks=4):
+        ticket = self.cached_issue(cam_id)
+        campaign_manager = str(ticket.fields.customfield_11486).lower().split(' ')
+        rows = []
+        alert_pixels = []
+        trend_alert_pixels = []
+        for n, (pixel, query_results) in enumerate(pixel_results):
+            if query_results:
+                low_ta = float(query_results[4]) < float(ta_pct)
+                if low_ta:
+                    alert_pixels.append("".join(pixel))
+                row = "|{pixel_no}|{x_tot_imp}|{y_elig_ind}|{ind_match_pct}%|{z_match_ind}|{target_acc}%{flag}|"\
+                    .format(pixel_no="".join(pixel),
+                            x_tot_imp="{0:,d}".format(int(query_results[0])),
+                            y_elig_ind="{0:,d}".format(int(query_results[1])),
+                            ind_match_pct=str(round(float(query_results[2]), 2)),
+                            z_match_ind="{0:,d}".format(int(query_results[3])),
+                            target_acc=str(round(float(query_results[4]), 2)),
+                            flag=" (!)" if low_ta else "")
+                if trends is not None:
+                    change, moving_average, trend_alert = trends[n] or (None, None, False)
+                    if trend_alert:
+                        trend_alert_pixels.append("".join(pixel))
+                    row += "{change}|{average}{flag}|".format(
+                        change="n/a" if change is None else "{:+.2f} pts".format(change),
+                        average="n/a" if moving_average is None else str(moving_average) + "%",
+                        flag=" (!)" if trend_alert else "")
+                rows.append(row)
+            else:
+                rows.append("|{pixel_no}|No results were returned| | | | |".format(pixel_no="".join(pixel)) +
+                            (" | |" if trends is not None else ""))
+        header = "||Pixel||x.TOTAL_IMPRESSIONS||y.ELIGIBLE_INDIVIDUALS||IND_MATCH_PERCENT||z.MATCHED_INDIVIDUALS||" \
+                 "Targeting Accuracy||" + ("Week over Week||" + str(trend_weeks) + "-Week Average||"
+                                           if trends is not None else "")
+        message = """|Reporting Dates|{start_date}  thru  {end_date}|
+                     {header}
+                     {rows}""".format(start_date=report_start_date, end_date=report_end_date, header=header,
+                                      rows="\n                     ".join(rows))
+        if alert_pixels:
+            message += """
+                     [~{attention}]
+                     Pixel: {pixel_no},
+                     {ta_alert} {ta_pct}%""".format(attention=".".join(campaign_manager),
+                                                   pixel_no=", ".join(alert_pixels),
+                                                   ta_alert=self.ta_alert,
+                                                   ta_pct=str(ta_pct))
+        if trend_alert_pixels:
+            message += """
+                     [~{attention}]
+                     Pixel: {pixel_no},
+                     {trend_alert}""".format(attention=".".join(campaign_manager),
+                                             pixel_no=", ".join(trend_alert_pixels),
+                                             trend_alert=self.trend_alert.format(str(trend_weeks)))
+        self.jira.call('add_comment', issue=cam_id, body=message)
+        return alert_pixels
+
+    # Add the preview estimates of all pixels on a ticket as a single table comment, labeled as estimates from a sample
+    # of the impressions, each column with its 95% margin of error
+    #
+    def add_preview_comment(self, cam_id, pixel_results, report_start_date, report_end_date, sampling_fraction):
+        rows = []
+        for pixel, query_results in pixel_results:
+            if query_results:
+                rows.append("|{pixel_no}|~{x_tot_imp} +/- {x_moe}|~{y_elig_ind} +/- {y_moe}|"
+                            "~{ind_match_pct}% +/- {i_moe}%|~{z_match_ind} +/- {z_moe}|~{target_acc}% +/- {t_moe}%|"
+                            .format(pixel_no="".join(pixel),
+                                    x_tot_imp="{0:,d}".format(int(query_results[0])),
+                                    y_elig_ind="{0:,d}".format(int(query_results[1])),
+                                    ind_match_pct=str(round(float(query_results[2]), 2)),
+                                    z_match_ind="{0:,d}".format(int(query_results[3])),
+                                    target_acc=str(round(float(query_results[4]), 2)),
+                                    x_moe="{0:,d}".format(int(query_results[5])),
+                                    y_moe="{0:,d}".format(int(query_results[6])),
+                                    i_moe=str(round(float(query_results[7]), 2)),
+                                    z_moe="{0:,d}".format(int(query_results[8])),
+                                    t_moe=str(round(float(query_results[9]), 2))))
+            else:
+                rows.append("|{pixel_no}|No impressions were sampled| | | | |".format(pixel_no="".join(pixel)))
+        header = "||Pixel||x.TOTAL_IMPRESSIONS||y.ELIGIBLE_INDIVIDUALS||IND_MATCH_PERCENT||z.MATCHED_INDIVIDUALS||" \
+                 "Targeting Accuracy||"
+        message = """*PREVIEW - ESTIMATES ONLY* from a {sample_pct}% sample, +/- is the 95% margin of error
+                     |Reporting Dates|{start_date}  thru  {end_date}|
+                     {header}
+                     {rows}""".format(sample_pct=str(round(sampling_fraction * 100, 2)), start_date=report_start_date,
+                                      end_date=report_end_date, header=header,
+                                      rows="\n                     ".join(rows))
+        self.jira.call('add_comment', issue=cam_id, body=message)
+
+    # Add the backfill results of all pixels on a ticket as a single table comment, one row per pixel and week
+    #
+    def add_backfill_comment(self, cam_id, week_results, backfill_start_date, backfill_end_date):
+        rows = []
+        week_results = sorted(week_results, key=lambda entry: (entry[0], entry[1]))
+        for pixel, (week_start, week_end), query_results in week_results:
+            if query_results:
+                rows.append("|{week_start} thru {week_end}|{pixel_no}|{x_tot_imp}|{y_elig_ind}|{ind_match_pct}%|"
+                            "{z_match_ind}|{target_acc}%|"
+                            .format(week_start=week_start, week_end=week_end, pixel_no="".join(pixel),
+                                    x_tot_imp="{0:,d}".format(int(query_results[0])),
+                                    y_elig_ind="{0:,d}".format(int(query_results[1])),
+                                    ind_match_pct=str(round(float(query_results[2]), 2)),
+                                    z_match_ind="{0:,d}".format(int(query_results[3])),
+                                    target_acc=str(round(float(query_results[4]), 2))))
+            else:
+                rows.append("|{week_start} thru {week_end}|{pixel_no}|No results were returned| | | | |"
+                            .format(week_start=week_start, week_end=week_end, pixel_no="".join(pixel)))
+        header = "||Week||Pixel||x.TOTAL_IMPRESSIONS||y.ELIGIBLE_INDIVIDUALS||IND_MATCH_PERCENT||" \
+                 "z.MATCHED_INDIVIDUALS||Targeting Accuracy||"
+        message = """|Backfill Dates|{start_date}  thru  {end_date}|
+                     {header}
+                     {rows}""".format(start_date=backfill_start_date, end_date=backfill_end_date, header=header,
+                                      rows="\n                     ".join(rows))
+        self.jira.call('add_comment', issue=cam_id, body=message)
 
     # Add an alert to ticket in the form of a comment
     #
     def add_ticket_data_alert_comment(self, cam_id):
-        campaign_manager = self.campaign_manager.lower().split(' ')
-        ticket = self.jira.issue(cam_id)
+        ticket = self.cached_issue(cam_id)
+        campaign_manager = str(ticket.fields.customfield_11486).lower().split(' ')
         reporter = ticket.fields.reporter.key
         message = """[~{attention}]
                      {ticket_data_alert}""".format(reporter, attention=".".join(campaign_manager),
                                                              ticket_data_alert=self.ticket_data_alert)
-        self.jira.add_comment(issue=ticket, body=message)
+        self.jira.call('add_comment', issue=cam_id, body=message)
 
     # Add an alert to ticket for 'target accuracy' shortfall in the form of a comment
     #
     def add_ta_alert_comment(self, cam_id, pixel, ta_pct):
-        campaign_manager = self.campaign_manager.lower().split(' ')
-        ticket = self.jira.issue(cam_id)
+        ticket = self.cached_issue(cam_id)
+        campaign_manager = str(ticket.fields.customfield_11486).lower().split(' ')
         reporter = ticket.fields.reporter.key
         message = """[~{attention}]
                      Pixel: {pixel_no},
@@ -88,9 +239,9 @@ class JiraManager(object):
                                                               pixel_no="".join(pixel),
                                                               ta_alert=self.ta_alert,
                                                               ta_pct=str(ta_pct))
-        self.jira.add_comment(issue=ticket, body=message)
+        self.jira.call('add_comment', issue=cam_id, body=message)
 
-    # Ends the current JIRA session
+    # Ends the current JIRA sessions
     #
     def kill_session(self):
-        self.jira.kill_session()
+        self.jira.close()
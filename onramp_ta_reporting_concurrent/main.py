@@ -37,9 +37,14 @@
 from datetime import datetime, timedelta
 import os
 import sys
+import socket
 import logging
 import configparser
+import argparse
+import signal
 from targeting_accuracy_manager import TargetingAccuracyManager
+from result_history import ResultHistory
+from targeting_accuracy_query import TargetingAccuracyQuery
 
 
 # Sets the log file's name date to ‘Sunday’ of the run weekend in the format of %Y%m%d, this to enable multiple run
@@ -59,6 +64,28 @@ def logfile_name_date_set():
     return run_date
 
 
+# Sets the daily materialization window to the seven days ending yesterday in the format of %Y%m%d
+#
+def daily_report_dates():
+    return (datetime.strftime(datetime.now() - timedelta(days=7), "%Y%m%d"),
+            datetime.strftime(datetime.now() - timedelta(days=1), "%Y%m%d"))
+
+
+# Sets the planning window to the reporting window of this week's weekend run => the Friday through Thursday before the
+# weekend's Friday, in the format of %Y%m%d, so the run can be planned on any day ahead of it
+#
+def plan_report_dates():
+    run_friday = datetime.now() + timedelta(days=4 - datetime.now().weekday())
+    return (datetime.strftime(run_friday - timedelta(days=7), "%Y%m%d"),
+            datetime.strftime(run_friday - timedelta(days=1), "%Y%m%d"))
+
+
+# Raises SystemExit in the main thread when the run is terminated
+#
+def terminate(signum, frame):
+    raise SystemExit("Terminated by signal " + str(signum))
+
+
 # Define a console logger for development purposes
 #
 def console_logger():
@@ -72,7 +99,66 @@ def console_logger():
     logging.getLogger('').addHandler(console)
 
 
-def main(con_opt='n'):
+# Parses the command line options of the run
+#
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Targeting Accuracy Reporting, Campaign Management")
+    parser.add_argument('--cache', choices=['use', 'refresh', 'bypass'], default='use',
+                        help="use => read and write cached query results, refresh => rerun queries and overwrite "
+                             "cached results, bypass => neither read nor write the cache")
+    parser.add_argument('--invalidate-cache', action='store_true',
+                        help="remove the cached query results of this reporting window before the run")
+    parser.add_argument('--resume', action='store_true',
+                        help="resume this reporting window's interrupted run from its journal, re-attaching to running "
+                             "queries, reusing finished results and skipping comments already posted")
+    parser.add_argument('--daily', action='store_true',
+                        help="materialize the per-day partial counts of the past seven days without posting comments")
+    parser.add_argument('--backfill', nargs=2, type=backfill_date, metavar=('START', 'END'),
+                        help="report every week from START through END (YYYYMMDD) in seven-day buckets starting on "
+                             "START, with a single query, instead of last week")
+    parser.add_argument('--preview', action='store_true',
+                        help="estimate the report of the seven days ending yesterday from a sample of the impressions, "
+                             "with 95%% margins of error, see 'preview sample rate' in config.ini")
+    parser.add_argument('--plan', action='store_true',
+                        help="dry run => take in and validate the tickets, EXPLAIN every query the run would issue "
+                             "without running any, and print the queries ranked by the data they would scan")
+    parser.add_argument('--shard', action='store_true',
+                        help="run as one of several identical workers sharing the run's work units through lease "
+                             "files next to the log file, the last worker to finish merges the results into the master "
+                             "log and posts the comments, see [Sharding] in config.ini")
+    parser.add_argument('--trend', metavar='PIXEL',
+                        help="print the reported weekly results of the pixel from the result history, with the week "
+                             "over week change and moving average of its targeting accuracy, then exit")
+    parser.add_argument('--output', help="write the backfill results to this CSV file")
+    parser.add_argument('--post', action='store_true',
+                        help="post the backfill results, or the preview estimates labeled as such, to the Jira tickets")
+    args = parser.parse_args(argv)
+    if args.backfill and args.backfill[0] > args.backfill[1]:
+        parser.error("the backfill START date must not be after its END date")
+    if args.preview and (args.daily or args.backfill):
+        parser.error("--preview cannot be combined with --daily or --backfill")
+    if args.plan and (args.backfill or args.post):
+        parser.error("--plan cannot be combined with --backfill or --post")
+    if args.shard and (args.backfill or args.plan):
+        parser.error("--shard cannot be combined with --backfill or --plan")
+    if args.output and not args.backfill:
+        parser.error("--output applies to --backfill runs only")
+    if args.post and not (args.backfill or args.preview):
+        parser.error("--post applies to --backfill and --preview runs only")
+    return args
+
+
+# Validates a backfill date in the format of %Y%m%d
+#
+def backfill_date(value):
+    try:
+        return datetime.strptime(value, "%Y%m%d").strftime("%Y%m%d")
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid date '" + value + "', expected YYYYMMDD")
+
+
+def main(con_opt='n', args=None):
+    args = args or parse_arguments([])
     today_date = (datetime.now() - timedelta(hours=6)).strftime('%Y%m%d')
 
     # Get config files
@@ -81,25 +167,118 @@ def main(con_opt='n'):
 
     # Create a dictionary of configuration parameters
     config_params = {
-        "jira_url":         config.get('Jira', 'url'),
-        "jira_token":       tuple(config.get('Jira', 'authorization').split(',')),
-        "jql_agencies":     config.get('Jira', 'agency'),
-        "jql_status":       config.get('Jira', 'status'),
-        "jql_issuetype":    config.get('Jira', 'issuetype'),
-        "qubole_token":     config.get('Qubole', 'bradruck-prod-operations-consumer'),
-        "cluster_label":    config.get('Qubole', 'cluster-label'),
-        "ta_pct":           float(config.get('Project Details', 'targeting accuracy pct'))
+        "jira_url":            config.get('Jira', 'url'),
+        "jira_token":          tuple(config.get('Jira', 'authorization').split(',')),
+        "jql_agencies":        config.get('Jira', 'agency'),
+        "jql_status":          config.get('Jira', 'status'),
+        "jql_issuetype":       config.get('Jira', 'issuetype'),
+        "qubole_token":        config.get('Qubole', 'bradruck-prod-operations-consumer'),
+        "qubole_api_url":      config.get('Qubole', 'api url', fallback='https://api.qubole.com/api/'),
+        "cluster_label":       config.get('Qubole', 'cluster-label'),
+        "engine_labels":       {'hive': config.get('Qubole', 'cluster-label'),
+                                'presto': config.get('Qubole', 'presto cluster-label', fallback='presto'),
+                                'spark': config.get('Qubole', 'spark cluster-label', fallback='spark')},
+        "engine_routing":      (config.get('Qubole', 'default engine', fallback='hive'),
+                                config.get('Qubole', 'small query engine', fallback=''),
+                                config.getint('Qubole', 'small query max impressions', fallback=0)),
+        "max_qubole_commands": config.getint('Qubole', 'max in-flight commands', fallback=20),
+        "max_jira_calls":      config.getint('Jira', 'max concurrent calls', fallback=4),
+        "comment_posters":     config.getint('Jira', 'comment posters', fallback=2),
+        "jira_rate":           (config.getfloat('Jira', 'requests per second', fallback=5),
+                                config.getint('Jira', 'request burst', fallback=10)),
+        "qubole_retry":        (config.getint('Qubole', 'query attempts', fallback=3),
+                                config.getint('Qubole', 'retry budget', fallback=10),
+                                config.getfloat('Qubole', 'retry delay', fallback=30),
+                                config.getfloat('Qubole', 'retry delay max', fallback=600)),
+        "poll_intervals":      (config.getfloat('Qubole', 'poll interval min', fallback=5),
+                                config.getfloat('Qubole', 'poll interval max', fallback=120),
+                                config.getfloat('Qubole', 'poll backoff', fallback=1.5)),
+        "ta_pct":              float(config.get('Project Details', 'targeting accuracy pct')),
+        "query_mode":          'incremental' if args.daily else 'preview' if args.preview else
+                               config.get('Project Details', 'query mode', fallback='per_pixel'),
+        "query_variant":       config.get('Project Details', 'query variant', fallback='standard'),
+        "cache_file":          config.get('LogFile', 'cache file', fallback=config.get('LogFile', 'path') +
+                                          config.get('Project Details', 'app_name') + '_results.db'),
+        "cache_mode":          args.cache,
+        "history_file":        config.get('LogFile', 'history file', fallback=config.get('LogFile', 'path') +
+                                          config.get('Project Details', 'app_name') + '_history.db'),
+        "trend_alert":         (config.getint('Project Details', 'trend weeks', fallback=4),
+                                config.getfloat('Project Details', 'trend alert points', fallback=10)),
+        "post_comments":       not (args.daily or args.plan) and (args.post or not (args.backfill or args.preview)),
+        "report_dates":        daily_report_dates() if args.daily or args.preview else
+                               tuple(args.backfill) if args.backfill else plan_report_dates() if args.plan else None,
+        "preview":             (config.getfloat('Project Details', 'preview sample rate', fallback=0.05),
+                                config.getint('Project Details', 'preview buckets', fallback=1000)) if args.preview
+                               else None,
+        "readiness":           (config.getfloat('Readiness', 'min row ratio', fallback=0.5),
+                                config.getint('Readiness', 'baseline days', fallback=7),
+                                config.getint('Readiness', 'cookie snapshot lag days', fallback=1),
+                                config.getfloat('Readiness', 'recheck delay', fallback=900),
+                                config.getfloat('Readiness', 'recheck delay max', fallback=3600),
+                                config.getfloat('Readiness', 'max wait', fallback=21600))
+                               if config.getboolean('Readiness', 'enabled', fallback=True) and not args.plan else None,
+        "backfill":            bool(args.backfill),
+        "plan":                args.plan,
+        "sharding":            None,
+        "master_files":        None,
+        "backfill_output":     args.output,
+        "resume":              args.resume
     }
 
+    # An unknown query variant stops the run before any ticket is taken in
+    try:
+        TargetingAccuracyQuery.weekly_query_variant(config_params['query_variant'])
+    except ValueError as e:
+        sys.stderr.write("\nThe 'query variant' in config.ini is invalid: {}".format(e))
+        exit(1)
+
+    # Trend lookups only read the result history
+    if args.trend:
+        for line in ResultHistory(config_params['history_file'], *config_params['trend_alert']).trend_lines(args.trend):
+            print(line)
+        return
+
     # Logfile path to point to the Operations_mounted drive on zfs1
     purge_days = config.get('LogFile', 'retention_days')
     log_file_path = config.get('LogFile', 'path')
 
     # Creates a log file name
-    logfile_name = log_file_path + config.get('Project Details', 'app_name') + '_' + logfile_name_date_set() + '.log'
+    if args.plan:
+        # Planning runs may be repeated and never block the real run of the week
+        logfile_name = (log_file_path + config.get('Project Details', 'app_name') + '_plan_' +
+                        datetime.now().strftime('%Y%m%d%H%M%S') + '.log')
+    elif args.daily:
+        logfile_name = log_file_path + config.get('Project Details', 'app_name') + '_daily_' + today_date + '.log'
+    elif args.preview:
+        # Previews may be run any number of times a day
+        logfile_name = (log_file_path + config.get('Project Details', 'app_name') + '_preview_' +
+                        datetime.now().strftime('%Y%m%d%H%M%S') + '.log')
+    elif args.backfill:
+        logfile_name = (log_file_path + config.get('Project Details', 'app_name') + '_backfill_' +
+                        "_".join(args.backfill) + '.log')
+    else:
+        logfile_name = (log_file_path + config.get('Project Details', 'app_name') + '_' + logfile_name_date_set() +
+                        '.log')
+
+    # A sharded run's workers each write their own log, the master log is written by the worker coordinating the merge
+    master_logfile_name = logfile_name
+    if args.shard:
+        run_name = logfile_name[:-len('.log')]
+        worker_id = socket.gethostname() + '-' + str(os.getpid())
+        logfile_name = run_name + '_worker_' + worker_id + '.log'
+        config_params["sharding"] = (run_name + '_shards', worker_id, config.getint('Sharding', 'shards', fallback=8),
+                                     config.getfloat('Sharding', 'lease seconds', fallback=300))
+        config_params["master_files"] = (master_logfile_name, run_name + '_results.jsonl', run_name + '_journal.jsonl')
+
+    # The run journal sits next to the log file
+    config_params["journal_file"] = logfile_name[:-len('.log')] + '_journal.jsonl'
+    # Run metrics are written next to the log file as <name>_metrics.json and <name>_metrics.prom
+    config_params["metrics_path"] = logfile_name[:-len('.log')] + '_metrics'
+    # Work unit results are streamed to a JSONL file next to the log file as they finish
+    config_params["results_file"] = logfile_name[:-len('.log')] + '_results.jsonl'
 
-    # Check to see if log file already exits for the day to avoid duplicate execution
-    if not os.path.isfile(logfile_name):
+    # Check to see if log file already exits for the day to avoid duplicate execution, unless resuming that run
+    if not os.path.isfile(master_logfile_name) or args.resume:
         try:
             # Creates a log file on the ZFS1 Operations_mounted drive
             logging.basicConfig(filename=logfile_name,
@@ -119,6 +298,11 @@ def main(con_opt='n'):
                         today_date + "\n")
             # Create TAM Object and launch Report Generator
             cm_onramp_campaign = TargetingAccuracyManager(config_params)
+            # A terminated run unwinds through process_manager, which cancels its in-flight Qubole commands
+            signal.signal(signal.SIGTERM, terminate)
+            if args.invalidate_cache:
+                cm_onramp_campaign.result_cache.invalidate(cm_onramp_campaign.report_start_date,
+                                                           cm_onramp_campaign.report_end_date)
             cm_onramp_campaign.process_manager()
 
             # Search logfile directory for old log files to purge
@@ -129,7 +313,8 @@ def main(con_opt='n'):
 
 
 if __name__ == '__main__':
+    arguments = parse_arguments()
     # prompt user for use of console logging -> for use in development not production
     ans = input("\nWould you like to enable a console logger for this run?\n Please enter y or n:\t")
     print()
-    main(ans)
+    main(ans, arguments)
@@ -0,0 +1,152 @@
+# partition_readiness module
+# Module holds the class => PartitionReadiness - manages the readiness check of the report's input partitions
+# Class responsible for confirming through cheap metastore commands, before any report query is launched, that every
+# data_date partition of the reporting window has landed in core_digital.unified_impression with a plausible row count
+# and that the best_matched_cookies_history_ind snapshot is recent enough, a window that is not ready is rechecked with
+# exponential backoff until the maximum wait, the outcome is shared by every work unit of the window
+#
+from datetime import datetime, timedelta
+import threading
+import logging
+import time
+import re
+import qubole_manager
+
+
+class PartitionReadiness(object):
+    impression_table = 'core_digital.unified_impression'
+    impression_partition = 'data_source_id_part=6'
+    cookie_table = 'core_digital.best_matched_cookies_history_ind'
+
+    def __init__(self, qubole_token, cluster_label, poller=None, retry_policy=None, min_row_ratio=0.5,
+                 baseline_days=7, cookie_lag_days=1, recheck_delay=900, recheck_delay_max=3600, max_wait=21600):
+        self.qubole_token = qubole_token
+        self.cluster_label = cluster_label
+        self.poller = poller
+        self.retry_policy = retry_policy
+        # A day holding fewer rows than this share of the median day before the window is still loading
+        self.min_row_ratio = float(min_row_ratio)
+        self.baseline_days = int(baseline_days)
+        self.cookie_lag_days = int(cookie_lag_days)
+        self.recheck_delay = float(recheck_delay)
+        self.recheck_delay_max = float(recheck_delay_max)
+        self.max_wait = float(max_wait)
+        # Outcome of the last check of each window => (status, reason, time of the next check, checks made, first hold)
+        self.windows = {}
+        # Days of each window whose partitions were found present with plausible row counts
+        self.confirmed = {}
+        self.lock = threading.Lock()
+        self.logger = logging.log
+
+    # Returns the readiness of a reporting window => 'ready', 'waiting' while it is held back or 'expired' once the
+    # maximum wait has passed, the metastore is only asked again once the backoff delay of the last check has passed
+    #
+    def status(self, start_date, end_date):
+        with self.lock:
+            window = self.windows.get((start_date, end_date))
+            if window and (window[0] != 'waiting' or time.time() < window[2]):
+                return window[0]
+            checks, first_hold = (window[3], window[4]) if window else (0, None)
+            reason = self.check(start_date, end_date)
+            if reason is None:
+                status = 'ready'
+                self.logger(20, "The input partitions of " + start_date + " through " + end_date + " are ready.")
+            elif first_hold is not None and time.time() - first_hold >= self.max_wait:
+                status = 'expired'
+                self.logger(40, "The input partitions of " + start_date + " through " + end_date + " were not ready "
+                                "after " + str(round(self.max_wait / 3600.0, 1)) + " hours => " + reason)
+            else:
+                status = 'waiting'
+                self.logger(30, "The input partitions of " + start_date + " through " + end_date + " are not ready, "
+                                "holding back its queries for " + str(round(self.delay(checks) / 60.0, 1)) +
+                                " minutes => " + reason)
+            self.windows[(start_date, end_date)] = (status, reason, time.time() + self.delay(checks), checks + 1,
+                                                    time.time() if first_hold is None else first_hold)
+            return status
+
+    # Returns the seconds until a held back window is checked again
+    #
+    def retry_in(self, start_date, end_date):
+        with self.lock:
+            window = self.windows.get((start_date, end_date))
+            return max(0.0, window[2] - time.time()) if window else 0.0
+
+    # Returns the days of a window confirmed complete by its last check, empty when the check failed open
+    #
+    def confirmed_days(self, start_date, end_date):
+        with self.lock:
+            return set(self.confirmed.get((start_date, end_date), ()))
+
+    # Backoff delay after the given number of earlier checks
+    #
+    def delay(self, checks):
+        return min(self.recheck_delay_max, self.recheck_delay * 2 ** checks)
+
+    # Checks the partitions of the window, returns None when they are ready or the reason they are not, a check that
+    # cannot be made is logged and does not hold the run back
+    #
+    def check(self, start_date, end_date):
+        start = datetime.strptime(start_date, "%Y%m%d")
+        days = [(start + timedelta(days=n)).strftime("%Y%m%d")
+                for n in range((datetime.strptime(end_date, "%Y%m%d") - start).days + 1)]
+        baseline = [(start - timedelta(days=n)).strftime("%Y%m%d") for n in range(self.baseline_days, 0, -1)]
+        partitions = self.partition_dates(self.impression_table, self.impression_partition)
+        if partitions is None:
+            return None
+        missing = [day for day in days if day not in partitions]
+        if missing:
+            return "missing " + self.impression_table + " partition(s) " + ", ".join(missing)
+        row_counts = self.row_counts([day for day in baseline if day in partitions] + days)
+        if row_counts:
+            baseline_counts = sorted(row_counts[day] for day in baseline if row_counts.get(day, 0) > 0)
+            if baseline_counts:
+                floor = self.min_row_ratio * baseline_counts[len(baseline_counts) // 2]
+                short = [day + " (" + str(row_counts[day]) + " rows)" for day in days
+                         if 0 <= row_counts.get(day, -1) < floor]
+                if short:
+                    return self.impression_table + " partition(s) " + ", ".join(short) + " below " + \
+                        str(int(floor)) + " rows, still loading"
+                if all(row_counts.get(day, -1) >= 0 for day in days):
+                    self.confirmed[(start_date, end_date)] = set(days)
+        snapshots = self.partition_dates(self.cookie_table)
+        if snapshots:
+            latest = max(snapshots)
+            if latest < (datetime.strptime(end_date, "%Y%m%d") -
+                         timedelta(days=self.cookie_lag_days)).strftime("%Y%m%d"):
+                return "latest " + self.cookie_table + " snapshot is " + latest
+        return None
+
+    # Returns the set of data dates of a table's partitions within the partial partition spec, None if the metastore
+    # could not be asked
+    #
+    def partition_dates(self, table, partition=None):
+        rows = self.metastore("show partitions " + table + (" partition(" + partition + ")" if partition else ""))
+        if rows is None:
+            return None
+        return set(date for row in rows for date in re.findall(r'=(\d{8})(?:/|$)', "\t".join(row)))
+
+    # Returns the numRows statistic of each data_date partition, -1 where the statistic is not kept, None if the
+    # statistics could not be read
+    #
+    def row_counts(self, days):
+        rows = self.metastore("".join("describe formatted " + self.impression_table + " partition(" +
+                                      self.impression_partition + ", data_date=" + day + ");\n" for day in days))
+        if rows is None:
+            return None
+        counts = [int(row[-1].strip()) for row in rows
+                  if len(row) > 1 and row[-2].strip() == 'numRows' and row[-1].strip().lstrip('-').isdigit()]
+        # Partitions without statistics print no numRows line, so the counts can only be matched up when all have one
+        if len(counts) != len(days):
+            self.logger(30, "Row count statistics are missing for some partitions, row counts are not checked.")
+            return {}
+        return dict(zip(days, counts))
+
+    # Runs a metastore-only Hive command, returns its result rows or None if it failed
+    #
+    def metastore(self, statements):
+        qubole = qubole_manager.QuboleManager(("Readiness",), self.qubole_token, self.cluster_label, statements,
+                                              poller=self.poller, retry_policy=self.retry_policy)
+        rows = qubole.get_result_rows()
+        if rows is None:
+            self.logger(30, "The readiness check could not be made => " + qubole.message)
+        return rows
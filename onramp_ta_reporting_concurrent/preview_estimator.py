@@ -0,0 +1,67 @@
+# preview_estimator module
+# Module holds the class => PreviewEstimator - manages the estimates of a preview run
+# Class responsible for turning the per-bucket counts of the sampled preview query into estimated weekly report
+# columns with 95% confidence intervals, each sampled bucket of cookies is treated as one cluster of a simple random
+# sample of the buckets => the counts are scaled up by the sampling fraction and the two percentages are ratio
+# estimates, whose margins come from the spread of the counts between the sampled buckets
+#
+import math
+
+
+class PreviewEstimator(object):
+    # Two-sided 95% normal quantile
+    z_score = 1.96
+
+    def __init__(self, sample_rate, buckets=1000):
+        self.buckets = max(1, int(buckets))
+        self.sampled_buckets = min(self.buckets, max(1, int(round(float(sample_rate) * self.buckets))))
+
+    # The fraction of the impressions the preview query reads
+    #
+    def sampling_fraction(self):
+        return self.sampled_buckets / float(self.buckets)
+
+    # Estimates the weekly report columns from the preview query rows => BUCKET, TOTAL_IMPRESSIONS,
+    # ELIGIBLE_INDIVIDUALS and MATCHED_INDIVIDUALS per sampled bucket, returns the five report columns followed by the
+    # margin of error of each, or None if no impressions were sampled
+    #
+    def estimate(self, rows):
+        counts = dict((int(row[0]), [float(value) for value in row[1:4]]) for row in rows or [])
+        if not counts:
+            return None
+        # Sampled buckets without impressions are part of the sample too
+        samples = [counts.get(bucket, [0.0, 0.0, 0.0]) for bucket in range(self.sampled_buckets)]
+        imps, elig, matched = ([sample[n] for sample in samples] for n in range(3))
+        ind_match_ratio = sum(elig) / sum(imps)
+        target_acc_ratio = sum(matched) / sum(imps)
+        return [int(round(self.total(imps))), int(round(self.total(elig))), round(ind_match_ratio * 100, 2),
+                int(round(self.total(matched))), round(target_acc_ratio * 100, 2),
+                int(round(self.total_margin(imps))), int(round(self.total_margin(elig))),
+                round(self.ratio_margin(elig, imps, ind_match_ratio) * 100, 2),
+                int(round(self.total_margin(matched))),
+                round(self.ratio_margin(matched, imps, target_acc_ratio) * 100, 2)]
+
+    # Scales the sampled bucket counts up to the estimated count of all buckets
+    #
+    def total(self, values):
+        return sum(values) / self.sampling_fraction()
+
+    # Returns the margin of error of an estimated count
+    #
+    def total_margin(self, values):
+        return self.z_score * math.sqrt(self.buckets ** 2 * self.variance(values) / len(values))
+
+    # Returns the margin of error of a ratio estimate, from the linearized residuals of the sampled buckets
+    #
+    def ratio_margin(self, numerators, denominators, ratio):
+        residuals = [numerator - ratio * denominator for numerator, denominator in zip(numerators, denominators)]
+        mean_denominator = sum(denominators) / len(denominators)
+        return self.z_score * math.sqrt(self.variance(residuals) / len(residuals)) / mean_denominator
+
+    # Returns the sample variance of the bucket values with the finite population correction, zero for a full sample
+    #
+    def variance(self, values):
+        if len(values) < 2:
+            return 0.0
+        mean = sum(values) / len(values)
+        return (1 - self.sampling_fraction()) * sum((value - mean) ** 2 for value in values) / (len(values) - 1)
@@ -4,58 +4,157 @@
 #
 from qds_sdk.commands import *
 import logging
-import io
-from contextlib import redirect_stdout
+import threading
+import time
+from concurrent.futures import Future
+from command_poller import CommandPoller
+from result_reader import ResultReader
+from query_retry_policy import QueryRetryPolicy
+from query_engine import HiveEngine
 
 
 class QuboleManager(object):
-    def __init__(self, name, qubole_token, cluster_label, query):
+    shared_poller = None
+    shared_poller_lock = threading.Lock()
+    # Qubole API endpoint, overridden from config.ini e.g. to point at a local stand-in
+    api_url = 'https://api.qubole.com/api/'
+
+    def __init__(self, name, qubole_token, cluster_label, query, poller=None, on_submit=None, metrics=None,
+                 retry_policy=None, engine=None):
         self.name = name
         self.qubole_token = qubole_token
         self.cluster_label = cluster_label
         self.query = query
+        # The engine the query runs on, Hive on the given cluster unless routed elsewhere
+        self.engine = engine or HiveEngine(cluster_label)
+        self.poller = poller or self.default_poller()
+        # Shared by the queries of a run so they draw on a single retry budget
+        self.retry_policy = retry_policy or QueryRetryPolicy()
+        self.command_id = None
+        self.reader = ResultReader()
+        # Called with the id of every command created, e.g. to journal it
+        self.on_submit = on_submit
+        # Optional RunMetrics receiving the result fetch time
+        self.metrics = metrics
         self.message = ""
         self.logger = logging.log
 
+    # Returns the process wide command poller used when no poller is handed in
+    #
+    @classmethod
+    def default_poller(cls):
+        with cls.shared_poller_lock:
+            if cls.shared_poller is None:
+                cls.shared_poller = CommandPoller()
+            return cls.shared_poller
+
     # Launches query, collects,converts and returns results
     #
-    def get_results(self):
-        Qubole.configure(api_token=self.qubole_token)
+    def get_results(self, command_id=None):
+        rows = self.stream_results(command_id=command_id)
+        try:
+            for row in rows:
+                return row
+        finally:
+            rows.close()
+        return None if self.command_id is None else []
+
+    # Launches query, collects and returns a multi-row result set as a list of rows, each row a list of column values
+    #
+    def get_result_rows(self):
+        rows = list(self.stream_results())
+        return None if self.command_id is None else rows
+
+    # Launches query, or re-attaches to an already running command when its id is given, and yields its result rows as
+    # they are read, typed by column_types when given, yields nothing if the query failed
+    #
+    def stream_results(self, column_types=None, command_id=None):
         try:
-            # Launches the qubole query
-            resp = self.launch_query()
+            # Launches the qubole query and waits for the poller to report it finished
+            resp = (self.reattach(command_id) if command_id else self.submit()).result()
+            self.command_id = resp.id
 
         except Exception as e:
             self.message = ("Query run failed => {}".format(e))
             self.logger(40, self.message)
 
         else:
-            output = io.BytesIO()
-            with redirect_stdout(output):
-                resp.get_results(fp=output, inline=True)
-                output.seek(0)
-                results = (output.read()).decode("utf-8").strip().split('\t')
-            return results
-
-    # Launches query and checks periodically for completion
-    #
-    def launch_query(self):
-        done = False
-        attempt = 1
-        while not done and attempt <= 3:
-            resp = HiveCommand.create(query=self.query, retry=3, label=self.cluster_label, name=", ".join(self.name))
-            final_status = self.watch_status(resp.id)
-            done = HiveCommand.is_success(final_status)
-            attempt += 1
-            if done:
-                return resp
-
-    # Monitors the Hive query status, returns when finished
-    #
-    @ staticmethod
-    def watch_status(job_id):
-        cmd = HiveCommand.find(job_id)
-        while not HiveCommand.is_done(cmd.status):
-            time.sleep(Qubole.poll_interval)
-            cmd = HiveCommand.find(job_id)
-        return cmd.status
+            start = time.time()
+            failed = False
+            try:
+                yield from self.reader.rows(resp, column_types)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                if self.metrics:
+                    self.metrics.observe('result_fetch', time.time() - start, ", ".join(self.name), error=failed)
+
+    # Launches query without blocking, returns a future that resolves to the successful command once the poller has
+    # seen it finish, failed attempts are relaunched as the retry policy allows
+    #
+    def submit(self):
+        Qubole.configure(api_token=self.qubole_token, api_url=self.api_url)
+        future = Future()
+        self.launch_attempt(future, 1)
+        return future
+
+    # Re-attaches to a command launched by an earlier run, returns a future like submit, the query is relaunched if the
+    # command did not succeed
+    #
+    def reattach(self, command_id):
+        Qubole.configure(api_token=self.qubole_token, api_url=self.api_url)
+        future = Future()
+        self.poller.watch(command_id, self.engine.command_class, unit=", ".join(self.name)).add_done_callback(
+            lambda status_future: self.attempt_done(future, status_future, 1))
+        return future
+
+    # Creates the command on the query's engine and hands its id to the poller, Qubole's own retries are left off so
+    # every relaunch goes through the retry policy
+    #
+    def launch_attempt(self, future, attempt):
+        # The query was cancelled while waiting for its retry
+        if future.done():
+            return
+        try:
+            resp = self.engine.create(self.query, ", ".join(self.name))
+        except Exception as e:
+            self.attempt_failed(future, attempt, self.retry_policy.classify_exception(e), "{}".format(e))
+        else:
+            if self.on_submit:
+                self.on_submit(resp.id)
+            self.poller.watch(resp.id, self.engine.command_class, unit=", ".join(self.name)).add_done_callback(
+                lambda status_future: self.attempt_done(future, status_future, attempt))
+
+    # Resolves the query future with the finished command on success, otherwise classifies the failure, runs on the
+    # polling thread so a relaunch is always handed to a timer thread rather than creating the command here
+    #
+    def attempt_done(self, future, status_future, attempt):
+        if status_future.cancelled():
+            future.cancel()
+        elif status_future.exception() is not None:
+            self.attempt_failed(future, attempt, self.retry_policy.classify_exception(status_future.exception()),
+                                "{}".format(status_future.exception()))
+        elif self.engine.command_class.is_success(status_future.result().status):
+            future.set_result(status_future.result())
+        else:
+            cmd = status_future.result()
+            self.attempt_failed(future, attempt, self.retry_policy.classify_command(self.engine.command_class, cmd),
+                                "command " + str(cmd.id) + " ended with status " + str(cmd.status))
+
+    # Relaunches a failed query after the backoff delay when the retry policy allows it, otherwise fails the query
+    #
+    def attempt_failed(self, future, attempt, failure_class, reason):
+        delay = self.retry_policy.retry_delay(failure_class, attempt)
+        if future.done():
+            return
+        if delay is None:
+            future.set_exception(RuntimeError("Query " + ", ".join(self.name) + " failed (" + failure_class +
+                                              ") after " + str(attempt) + " attempt(s) => " + reason))
+        else:
+            self.logger(30, "Query " + ", ".join(self.name) + " attempt " + str(attempt) + " failed (" + failure_class +
+                        ") => " + reason + ", retrying in " + str(round(delay, 1)) + " seconds")
+            # The command is created on the timer's thread, never on the polling thread running this callback
+            retry = threading.Timer(delay, self.launch_attempt, (future, attempt + 1))
+            retry.daemon = True
+            retry.start()
@@ -0,0 +1,126 @@
+# query_engine module
+# Module holds the classes => QueryEngine - manages the dialect and command type of a Qubole query engine
+#                            HiveEngine, PrestoEngine, SparkEngine - the Hive on Tez, Presto and Spark SQL engines
+#                            EngineRouter - manages the choice of engine per work unit
+# Classes responsible for everything engine specific => the statement settings, SQL dialect fragments used by the
+# query templates, the Qubole command type and cluster label a query runs on, and routing small work units to a low
+# latency engine by their estimated size
+#
+from qds_sdk.commands import HiveCommand, PrestoCommand, SparkCommand
+
+
+class QueryEngine(object):
+    name = None
+    command_class = None
+    # Statements run ahead of the query
+    settings = []
+    # Function returning its first non-null argument
+    null_function = 'nvl'
+
+    def __init__(self, cluster_label):
+        self.cluster_label = cluster_label
+
+    # Creates the Qubole command running the query on the engine's cluster
+    #
+    def create(self, query, name):
+        return self.command_class.create(query=query, label=self.cluster_label, name=name)
+
+    # Returns the EXPLAIN statement of a query generated for the engine, its settings are kept ahead of it
+    #
+    def explain(self, query):
+        position = query.index(self.header()) + len(self.header())
+        return query[:position] + "explain " + query[position:]
+
+    # Returns the settings block that heads every query
+    #
+    def header(self):
+        return "".join(setting + "\n        " for setting in self.settings)
+
+    # Returns the floating point ratio of two count expressions
+    #
+    @staticmethod
+    def ratio(numerator, denominator):
+        return "(" + numerator + " / " + denominator + ")"
+
+    # Returns the sampling bucket of a column's value, spread uniformly over the given number of buckets
+    #
+    @staticmethod
+    def bucket(column, buckets):
+        return "pmod(hash(" + column + "), " + str(buckets) + ")"
+
+    # Returns a select producing the given literal rows under the given column names
+    #
+    @staticmethod
+    def inline_table(rows, columns):
+        return "select stack({0}, {1}) as ({2})".format(len(rows), ", ".join(", ".join(str(value) for value in row)
+                                                                            for row in rows), ", ".join(columns))
+
+
+class HiveEngine(QueryEngine):
+    name = 'hive'
+    command_class = HiveCommand
+    settings = ["set hive.execution.engine = tez;",
+                "set fs.s3n.block.size=128000000;",
+                "set fs.s3a.block.size=128000000;",
+                "set hive.exec.reducers.max = 60;\n"]
+
+
+class PrestoEngine(QueryEngine):
+    name = 'presto'
+    command_class = PrestoCommand
+    null_function = 'coalesce'
+
+    # Presto divides integers as integers
+    #
+    @staticmethod
+    def ratio(numerator, denominator):
+        return "(cast(" + numerator + " as double) / " + denominator + ")"
+
+    # Presto has no hash function over arbitrary values
+    #
+    @staticmethod
+    def bucket(column, buckets):
+        return "mod(abs(from_big_endian_64(xxhash64(to_utf8(cast(" + column + " as varchar))))), " + str(buckets) + \
+               ")"
+
+    @staticmethod
+    def inline_table(rows, columns):
+        return "select * from (values {0}) as t ({1})".format(
+            ", ".join("(" + ", ".join(str(value) for value in row) + ")" for row in rows), ", ".join(columns))
+
+
+class SparkEngine(QueryEngine):
+    name = 'spark'
+    command_class = SparkCommand
+
+    # Spark commands take their SQL as sql rather than query
+    #
+    def create(self, query, name):
+        return self.command_class.create(sql=query, label=self.cluster_label, name=name)
+
+
+class EngineRouter(object):
+    engine_classes = {'hive': HiveEngine, 'presto': PrestoEngine, 'spark': SparkEngine}
+
+    def __init__(self, cluster_labels, default_engine='hive', small_engine=None, small_impressions=0):
+        self.engines = dict((name, self.engine_classes[name](label)) for name, label in cluster_labels.items()
+                            if name in self.engine_classes)
+        self.default = self.engines[default_engine]
+        self.small = self.engines.get(small_engine) if small_engine else None
+        self.small_impressions = int(small_impressions)
+
+    # Picks the engine of a work unit from its estimated TOTAL_IMPRESSIONS, units of unknown size run on the default
+    # engine
+    #
+    def route(self, estimated_impressions):
+        if self.small is not None and estimated_impressions is not None and \
+                estimated_impressions <= self.small_impressions:
+            return self.small
+        return self.default
+
+    # Returns the engines to try a work unit on in order => the routed engine, then the default engine should a small
+    # query fail on the low latency engine
+    #
+    def route_with_fallback(self, estimated_impressions):
+        engine = self.route(estimated_impressions)
+        return [engine] if engine is self.default else [engine, self.default]
@@ -0,0 +1,65 @@
+# query_retry_policy module
+# Module holds the class => QueryRetryPolicy - manages the retrying of failed Qubole queries
+# Class responsible for classifying query failures as retryable (transient cluster or API trouble) or fatal (syntax,
+# permission and missing object errors), spacing the retries of a query with jittered exponential backoff and holding
+# the retry budget shared by every query of the run
+#
+from qds_sdk.exception import ServerError, RetryWithDelay, AlwaysRetryWithDelay, ClientError
+import threading
+import logging
+import random
+import re
+
+
+class QueryRetryPolicy(object):
+    # Failures a relaunch of the same query cannot fix
+    fatal_patterns = re.compile(r"ParseException|SemanticException|semantic analysis|AccessControlException|"
+                                r"AuthorizationException|Permission denied|Table not found|Invalid table alias|"
+                                r"Invalid column reference|cannot recognize input|OutOfMemoryError|"
+                                r"Java heap space", re.I)
+
+    def __init__(self, max_attempts=3, retry_budget=10, base_delay=30, max_delay=600):
+        self.max_attempts = max(1, int(max_attempts))
+        self.retry_budget = int(retry_budget)
+        self.base_delay = float(base_delay)
+        self.max_delay = float(max_delay)
+        self.retries_used = 0
+        self.lock = threading.Lock()
+        self.logger = logging.log
+
+    # Classifies a finished, unsuccessful command from its status and log, returns 'fatal' or 'retryable'
+    #
+    def classify_command(self, command_class, command):
+        if command.status == 'cancelled':
+            return 'fatal'
+        try:
+            log = command_class.get_log_id(command.id) or ""
+        except Exception as e:
+            self.logger(30, "The log of command " + str(command.id) + " could not be read => {}".format(e))
+            log = ""
+        return 'fatal' if self.fatal_patterns.search(log) else 'retryable'
+
+    # Classifies an exception raised by the Qubole API, returns 'fatal' or 'retryable'
+    #
+    @staticmethod
+    def classify_exception(e):
+        if isinstance(e, (ServerError, RetryWithDelay, AlwaysRetryWithDelay)):
+            return 'retryable'
+        if isinstance(e, ClientError):
+            # Bad requests, authorization and missing resources
+            return 'fatal'
+        return 'retryable'
+
+    # Decides whether a failed attempt is retried, taking a retry from the run's budget if it is, returns the delay in
+    # seconds before the next attempt or None when the query is given up on
+    #
+    def retry_delay(self, failure_class, attempt):
+        if failure_class == 'fatal' or attempt >= self.max_attempts:
+            return None
+        with self.lock:
+            if self.retries_used >= self.retry_budget:
+                self.logger(30, "The retry budget of " + str(self.retry_budget) + " retries for the run is spent.")
+                return None
+            self.retries_used += 1
+        # Full jitter keeps relaunched queries from hitting the cluster at once
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
@@ -0,0 +1,105 @@
+# result_cache module
+# Module holds the class => ResultCache - manages the durable cache of query results
+# Class responsible for storing and retrieving the parsed query results in a local SQLite file, keyed by the normalized
+# pixels, profile ids, reporting window and query variant, so reruns skip queries that already completed
+#
+import sqlite3
+import threading
+import logging
+import json
+import time
+
+
+class ResultCache(object):
+    def __init__(self, path, mode='use'):
+        self.path = path
+        # use => read and write, refresh => write only, bypass => neither
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.logger = logging.log
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("""create table if not exists query_results (
+                                       cache_key text primary key,
+                                       report_start_date text,
+                                       report_end_date text,
+                                       result text,
+                                       command_id text,
+                                       run_time real)""")
+
+    # Builds the normalized cache key => sorted unique pixels and profile ids, reporting window and query variant
+    #
+    @staticmethod
+    def cache_key(pixels, profile_ids, report_start_date, report_end_date, variant):
+        pixels = sorted(set("".join(pixels).replace(' ', '').split(',')))
+        segments = ResultCache.normalized_profiles(profile_ids).split(',')
+        return json.dumps([pixels, [segment for segment in segments if segment], str(report_start_date),
+                           str(report_end_date), variant])
+
+    # Normalizes the profile ids of a work unit, given as a string or a list of strings => sorted unique ids with the
+    # whitespace stripped, joined by commas, so the same profile set written differently keys the same
+    #
+    @staticmethod
+    def normalized_profiles(profile_ids):
+        if isinstance(profile_ids, str):
+            profile_ids = [profile_ids]
+        return ",".join(sorted(set(segment.strip() for segment in ",".join(profile_ids).split(',') if segment.strip())))
+
+    # Returns the cached result for the key or None on a miss or when the cache is not being read
+    #
+    def get(self, key):
+        if self.mode != 'use':
+            return None
+        with self.lock:
+            row = self.connection.execute("select result from query_results where cache_key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    # Stores a result along with the Qubole command id that produced it and the time it was stored
+    #
+    def put(self, key, result, command_id=None):
+        if self.mode == 'bypass' or not result or not all(result):
+            return
+        report_start_date, report_end_date = json.loads(key)[2:4]
+        with self.lock, self.connection:
+            self.connection.execute("insert or replace into query_results values (?, ?, ?, ?, ?, ?)",
+                                    (key, report_start_date, report_end_date, json.dumps(result),
+                                     None if command_id is None else str(command_id), time.time()))
+
+    # Returns the TOTAL_IMPRESSIONS of the most recent reporting window cached for a single pixel, None if none is
+    # cached, read whatever the cache mode as it only sizes the work unit
+    #
+    def latest_total_impressions(self, pixel):
+        with self.lock:
+            row = self.connection.execute("select result from query_results where cache_key like ? order by "
+                                          "report_end_date desc limit 1",
+                                          (json.dumps([[str(pixel)]])[:-1] + ", %",)).fetchone()
+        try:
+            return int(json.loads(row[0])[0]) if row else None
+        except (TypeError, ValueError, IndexError):
+            return None
+
+    # Removes every entry, or only those of a reporting window when dates are given
+    #
+    def invalidate(self, report_start_date=None, report_end_date=None):
+        with self.lock, self.connection:
+            if report_start_date is None:
+                count = self.connection.execute("delete from query_results").rowcount
+            else:
+                count = self.connection.execute("delete from query_results where report_start_date = ? and "
+                                                "report_end_date = ?", (report_start_date, report_end_date)).rowcount
+        self.logger(20, "Invalidated " + str(count) + " cached query result(s).")
+
+    # Removes entries stored more than the retention period ago
+    #
+    def purge(self, retention_days):
+        with self.lock, self.connection:
+            count = self.connection.execute("delete from query_results where run_time < ?",
+                                            (time.time() - int(retention_days) * 86400,)).rowcount
+        self.logger(20, "Purged " + str(count) + " cached query result(s) older than " + str(retention_days) +
+                    " days.")
+
+    # Closes the cache file
+    #
+    def close(self):
+        with self.lock:
+            self.connection.close()
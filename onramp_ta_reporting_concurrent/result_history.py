@@ -0,0 +1,119 @@
+# result_history module
+# Module holds the class => ResultHistory - manages the history of the weekly report results
+# Class responsible for keeping every reported (ticket, pixel, profile ids, reporting window) result in a local SQLite
+# file indexed by pixel and reporting window, it is never purged, so the week over week change and the moving average
+# of a pixel's targeting accuracy are local lookups rather than Jira scrapes or cluster scans, and a drop well below the
+# moving average can be alerted on within the run
+#
+from result_cache import ResultCache
+import sqlite3
+import threading
+import time
+
+
+class ResultHistory(object):
+    # Earlier reporting windows needed before a moving average is alerted on
+    min_windows = 2
+
+    def __init__(self, path, average_weeks=4, drop_points=10.0):
+        self.path = path
+        self.average_weeks = max(1, int(average_weeks))
+        # Percentage points below the moving average that raise a trend alert
+        self.drop_points = float(drop_points)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("""create table if not exists weekly_results (
+                                       ticket_key text,
+                                       pixel text,
+                                       profile_ids text,
+                                       report_start_date text,
+                                       report_end_date text,
+                                       total_impressions integer,
+                                       eligible_individuals integer,
+                                       ind_match_pct real,
+                                       matched_individuals integer,
+                                       targeting_accuracy real,
+                                       run_time real,
+                                       primary key (ticket_key, pixel, profile_ids, report_end_date))""")
+            self.connection.execute("""create index if not exists weekly_results_pixel
+                                       on weekly_results (pixel, report_end_date)""")
+
+    # Records the result of a reporting window, a rerun of the window replaces it, the profile ids are kept normalized
+    # so the same profile set written differently on a ticket shares its trend
+    #
+    def record(self, ticket_key, pixel, profile_ids, report_start_date, report_end_date, result):
+        if not result:
+            return
+        with self.lock, self.connection:
+            self.connection.execute("insert or replace into weekly_results values (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (ticket_key, pixel, ResultCache.normalized_profiles(profile_ids),
+                                     str(report_start_date), str(report_end_date),
+                                     int(result[0]), int(result[1]), float(result[2]), int(result[3]),
+                                     float(result[4]), time.time()))
+
+    # Returns the recorded windows of a pixel, newest first => (report_start_date, report_end_date, ticket_key,
+    # profile_ids, TOTAL_IMPRESSIONS, ELIGIBLE_INDIVIDUALS, IND_MATCH_PERCENT, MATCHED_INDIVIDUALS, TARGETING_ACCURACY),
+    # optionally only those of a profile set, ending before a date or the latest few
+    #
+    def history(self, pixel, profile_ids=None, before=None, limit=None):
+        statement = "select report_start_date, report_end_date, ticket_key, profile_ids, total_impressions, " \
+                    "eligible_individuals, ind_match_pct, matched_individuals, targeting_accuracy " \
+                    "from weekly_results where pixel = ?"
+        parameters = [pixel]
+        if profile_ids is not None:
+            statement += " and profile_ids = ?"
+            parameters.append(ResultCache.normalized_profiles(profile_ids))
+        if before is not None:
+            statement += " and report_end_date < ?"
+            parameters.append(str(before))
+        statement += " order by report_end_date desc"
+        if limit is not None:
+            statement += " limit ?"
+            parameters.append(int(limit))
+        with self.lock:
+            return self.connection.execute(statement, parameters).fetchall()
+
+    # Returns the latest reporting windows of a pixel and profile set ending before a date, newest first =>
+    # (report_end_date, TARGETING_ACCURACY), tickets sharing the pixel and profile set count once per window
+    #
+    def windows(self, pixel, profile_ids, before, limit):
+        with self.lock:
+            return self.connection.execute("select report_end_date, avg(targeting_accuracy) from weekly_results "
+                                           "where pixel = ? and profile_ids = ? and report_end_date < ? "
+                                           "group by report_end_date order by report_end_date desc limit ?",
+                                           (pixel, ResultCache.normalized_profiles(profile_ids), str(before),
+                                            int(limit))).fetchall()
+
+    # Compares a window's targeting accuracy with the earlier windows of the same pixel and profile set, returns the
+    # change from the previous window and the moving average of the earlier windows, None where there are none, and
+    # whether the targeting accuracy fell far enough below the moving average to alert on
+    #
+    def assess(self, pixel, profile_ids, report_end_date, targeting_accuracy):
+        earlier = [row[1] for row in self.windows(pixel, profile_ids, report_end_date, self.average_weeks)]
+        if not earlier:
+            return None, None, False
+        change = round(float(targeting_accuracy) - earlier[0], 2)
+        moving_average = round(sum(earlier) / len(earlier), 2)
+        return change, moving_average, len(earlier) >= self.min_windows and \
+            float(targeting_accuracy) < moving_average - self.drop_points
+
+    # Returns the trend lines of a pixel, oldest first => each window with its change from the previous window of the
+    # same profile set and the moving average of the windows before it
+    #
+    def trend_lines(self, pixel):
+        lines = ["{:<19}  {:<16}  {:>14}  {:>6}  {:>8}  {:>9}  {}".format(
+            'window', 'ticket', 'impressions', 'TA %', 'change', 'average', 'profile ids')]
+        for row in reversed(self.history(pixel)):
+            change, moving_average, alert = self.assess(pixel, row[3], row[1], row[8])
+            lines.append("{:<19}  {:<16}  {:>14,d}  {:>6.2f}  {:>8}  {:>9}  {}{}".format(
+                row[0] + "-" + row[1], row[2], row[4], row[8], "n/a" if change is None else "{:+.2f}".format(change),
+                "n/a" if moving_average is None else "{:.2f}".format(moving_average), row[3],
+                " [TREND ALERT]" if alert else ""))
+        return lines
+
+    # Closes the history file
+    #
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,98 @@
+# result_reader module
+# Module holds the class => ResultReader - manages the retrieval of Qubole command results
+# Class responsible for fetching a finished command's result set directly, inline from the API or streamed from its S3
+# result location, and parsing it row by row into typed records without buffering the whole result or touching stdout
+#
+from qds_sdk.qubole import Qubole
+from qds_sdk.account import Account
+import tempfile
+import codecs
+import logging
+
+
+class ResultReader(object):
+    def __init__(self, delimiter='\t', chunk_size=1024 * 1024):
+        self.delimiter = delimiter
+        self.chunk_size = chunk_size
+        self.logger = logging.log
+
+    # Yields the result rows of a finished command, each converted by column_types when given, otherwise as strings
+    #
+    def rows(self, command, column_types=None):
+        response = Qubole.agent().get(command.meta_data['results_resource'], {'inline': True})
+        if response.get('inline'):
+            lines = self.split_lines([response.get('results') or ''])
+        else:
+            lines = self.location_lines(command, response.get('result_location') or [])
+        for line in lines:
+            if line:
+                yield self.parse(line, column_types)
+
+    # Splits a line into its columns and applies the column types
+    #
+    def parse(self, line, column_types):
+        values = line.replace('\x01', self.delimiter).split(self.delimiter)
+        if column_types:
+            return [column_type(value) for column_type, value in zip(column_types, values)] + \
+                   values[len(column_types):]
+        return values
+
+    # Joins a stream of text chunks and yields it back one line at a time
+    #
+    @staticmethod
+    def split_lines(chunks):
+        remainder = ''
+        for chunk in chunks:
+            lines = (remainder + chunk).split('\n')
+            remainder = lines.pop()
+            for line in lines:
+                yield line.rstrip('\r')
+        if remainder:
+            yield remainder.rstrip('\r')
+
+    # Yields the lines of the result files under the S3 result locations, read through boto3 when it is installed,
+    # otherwise through the command's own result download spooled to a temporary file
+    #
+    def location_lines(self, command, locations):
+        try:
+            import boto3
+        except ImportError:
+            self.logger(30, "boto3 is not installed, downloading the results of command " + str(command.id) +
+                        " through Qubole.")
+            yield from self.downloaded_lines(command)
+            return
+        account = Account.find()
+        client = boto3.client('s3', aws_access_key_id=account.storage_access_key,
+                              aws_secret_access_key=account.storage_secret_key)
+        for location in locations:
+            yield from self.s3_lines(client, location)
+
+    # Streams the result files under an S3 result location in chunks
+    #
+    def s3_lines(self, client, location):
+        bucket_name, _, prefix = location.replace('s3://', '').replace('s3n://', '').partition('/')
+        keys = [result_object for page in client.get_paginator('list_objects_v2').paginate(Bucket=bucket_name,
+                                                                                            Prefix=prefix)
+                for result_object in page.get('Contents', [])]
+        for result_object in sorted(keys, key=lambda result_key: result_key['Key']):
+            if result_object['Key'].endswith('/') or result_object['Size'] == 0:
+                continue
+            body = client.get_object(Bucket=bucket_name, Key=result_object['Key'])['Body']
+            yield from self.split_lines(self.decoded_chunks(body.iter_chunks(self.chunk_size)))
+
+    # Yields the lines of the command's results downloaded by qds_sdk to a temporary file
+    #
+    def downloaded_lines(self, command):
+        with tempfile.TemporaryFile() as result_file:
+            command.get_results(result_file, inline=False, delim=self.delimiter)
+            result_file.seek(0)
+            yield from self.split_lines(self.decoded_chunks(iter(lambda: result_file.read(self.chunk_size), b'')))
+
+    # Decodes a stream of byte chunks, characters that straddle two chunks are decoded correctly
+    #
+    @staticmethod
+    def decoded_chunks(chunks):
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        for chunk in chunks:
+            yield decoder.decode(chunk)
+        yield decoder.decode(b'', final=True)
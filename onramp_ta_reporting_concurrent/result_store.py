@@ -0,0 +1,138 @@
+# result_store module
+# Module holds the classes => UnitResult - holds the typed result of a single (ticket, pixel) work unit, exact or
+#                                          estimated by a preview run
+#                            ResultStore - manages the collection of the work unit results of a run
+# Classes responsible for collecting every work unit result as it finishes, along with the comments posted for it,
+# and streaming each one to the log file and a JSONL results file straight away, the collected results can be read
+# safely while the run is still going
+#
+import threading
+import logging
+import json
+
+
+class UnitResult(object):
+    __slots__ = ('ticket_key', 'pixel', 'profile_ids', 'total_impressions', 'eligible_individuals', 'ind_match_pct',
+                 'matched_individuals', 'targeting_accuracy', 'margins', 'comments')
+
+    def __init__(self, ticket_key, pixel, profile_ids, query_result=None):
+        self.ticket_key = ticket_key
+        self.pixel = pixel
+        self.profile_ids = profile_ids
+        if query_result:
+            self.total_impressions = int(query_result[0])
+            self.eligible_individuals = int(query_result[1])
+            self.ind_match_pct = float(query_result[2])
+            self.matched_individuals = int(query_result[3])
+            self.targeting_accuracy = float(query_result[4])
+        else:
+            self.total_impressions = self.eligible_individuals = self.matched_individuals = None
+            self.ind_match_pct = self.targeting_accuracy = None
+        # The 95% margins of error of the five columns when they are preview estimates, None for exact results
+        self.margins = [float(value) for value in query_result[5:10]] if query_result and len(query_result) > 5 \
+            else None
+        self.comments = []
+
+    # Checks whether the work unit returned results
+    #
+    def has_result(self):
+        return self.total_impressions is not None
+
+    # Returns the query result columns of the record followed by the margins of estimates, None without results
+    #
+    def query_result(self):
+        if not self.has_result():
+            return None
+        return [self.total_impressions, self.eligible_individuals, self.ind_match_pct, self.matched_individuals,
+                self.targeting_accuracy] + (self.margins or [])
+
+    # Returns the record as a dictionary for the JSONL results file
+    #
+    def as_dict(self):
+        return dict((field, getattr(self, field)) for field in self.__slots__)
+
+
+class ResultStore(object):
+    def __init__(self, path=None):
+        self.path = path
+        # Appending to a list and a dictionary is atomic, readers take a snapshot instead of holding a lock
+        self.records = []
+        self.index = {}
+        # Serializes the writes to the results file only
+        self.write_lock = threading.Lock()
+        self.results_file = open(path, 'w') if path else None
+        # Own logger level, so results still reach the log file while the root level hides the Qubole messages
+        self.result_logger = logging.getLogger('results')
+        self.result_logger.setLevel(logging.INFO)
+
+    # Adds the result of a finished work unit, streams it to the log and the results file, returns the record
+    #
+    def record(self, ticket_key, pixel, profile_ids, query_result):
+        unit_result = UnitResult(ticket_key, pixel, profile_ids, query_result)
+        self.records.append(unit_result)
+        self.index[(ticket_key, pixel, profile_ids)] = unit_result
+        self.result_logger.log(20, '\n\t\t\t\t\tTicket Number => ' + ticket_key)
+        self.result_logger.log(20, '     => Pixel: ' + pixel)
+        self.result_logger.log(20, '     => Profile IDs: ' + profile_ids)
+        if unit_result.margins is not None:
+            self.result_logger.log(20, '     => Estimated Results: ' + ", ".join(
+                str(value) + ' +/- ' + str(margin) for value, margin in zip(query_result, unit_result.margins)))
+        else:
+            self.result_logger.log(20, '     => Query Results: ' + (", ".join(str(value) for value in query_result)
+                                                                   if query_result else 'none'))
+        self.write({'event': 'result', 'result': unit_result.as_dict()})
+        return unit_result
+
+    # Adds a note on a comment posted for a work unit, streamed like the results, a ticket may list a pixel more than
+    # once so the work unit is told apart by its profile ids as well
+    #
+    def add_comment(self, ticket_key, pixel, profile_ids, comment):
+        unit_result = self.index.get((ticket_key, pixel, profile_ids))
+        if unit_result is not None:
+            unit_result.comments.append(comment)
+        self.result_logger.log(20, '     => Ticket Comment [' + ticket_key + ', ' + pixel + ']: ' + comment)
+        self.write({'event': 'comment', 'ticket_key': ticket_key, 'pixel': pixel, 'profile_ids': profile_ids,
+                    'comment': comment})
+
+    # Reads the work unit results back from a results file, e.g. of a shard run by another worker
+    #
+    @staticmethod
+    def read(path):
+        unit_results = []
+        with open(path) as results_file:
+            for line in results_file:
+                entry = json.loads(line)
+                if entry['event'] == 'result':
+                    record = entry['result']
+                    unit_result = UnitResult(record['ticket_key'], record['pixel'], record['profile_ids'])
+                    for field in UnitResult.__slots__[3:]:
+                        setattr(unit_result, field, record[field])
+                    unit_results.append(unit_result)
+        return unit_results
+
+    # Returns a snapshot of the results recorded so far
+    #
+    def results(self):
+        return list(self.records)
+
+    # Returns the result of a work unit, None if it has not finished
+    #
+    def get(self, ticket_key, pixel, profile_ids):
+        return self.index.get((ticket_key, pixel, profile_ids))
+
+    # Appends a line to the results file
+    #
+    def write(self, entry):
+        with self.write_lock:
+            if self.results_file is None:
+                return
+            self.results_file.write(json.dumps(entry) + "\n")
+            self.results_file.flush()
+
+    # Closes the results file
+    #
+    def close(self):
+        with self.write_lock:
+            if self.results_file is not None:
+                self.results_file.close()
+                self.results_file = None
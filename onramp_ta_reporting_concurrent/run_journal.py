@@ -0,0 +1,111 @@
+# run_journal module
+# Module holds the class => RunJournal - manages the append-only journal of a run
+# Class responsible for recording the progress of every work unit as it happens => the Qubole command it submitted, its
+# result and the comments posted, so a resumed run can re-attach to running commands, reuse finished results and skip
+# comments that were already posted for the reporting window
+#
+from targeting_accuracy_query import TargetingAccuracyQuery
+import threading
+import json
+import os
+import time
+
+
+class RunJournal(object):
+    def __init__(self, path, report_start_date, report_end_date, resume=False):
+        self.path = path
+        self.window = [str(report_start_date), str(report_end_date)]
+        self.lock = threading.Lock()
+        self.command_ids = {}
+        self.results = {}
+        self.posted = set()
+        # Whether the journal of the earlier attempt ends in a line cut short by the crash
+        self.torn = False
+        if resume and os.path.isfile(self.path):
+            self.load()
+        self.journal_file = open(self.path, 'a' if resume else 'w')
+        if self.torn:
+            # Starts the entries of this attempt on a fresh line
+            self.journal_file.write("\n")
+            self.journal_file.flush()
+
+    # Builds the journal key of a (ticket, pixel, profile ids) work unit, the profile ids normalized as in the batch key
+    # so a ticket listing the same pixel with two profile sets journals two units
+    #
+    @staticmethod
+    def unit_key(ticket_key, pixel, profile_ids):
+        pixel, profile_ids = TargetingAccuracyQuery.unit_key(pixel, profile_ids)
+        return ticket_key + "|" + pixel + "|" + ",".join(profile_ids)
+
+    # Replays the journal of an earlier attempt at the same reporting window
+    #
+    def load(self):
+        with open(self.path) as journal_file:
+            for line in journal_file:
+                self.torn = not line.endswith("\n")
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by the crash
+                    continue
+                if entry.get('window') == self.window:
+                    self.apply(entry)
+
+    # Applies a journal entry to the in-memory state
+    #
+    def apply(self, entry):
+        if entry['event'] == 'submitted':
+            self.command_ids[entry['unit']] = entry['command_id']
+        elif entry['event'] == 'result':
+            self.results[entry['unit']] = entry['result']
+        elif entry['event'] == 'posted':
+            self.posted.add((entry['ticket'], entry['comment']))
+
+    # Appends an entry and flushes it to disk before returning
+    #
+    def record(self, event, **fields):
+        entry = dict(fields, event=event, window=self.window, time=time.time())
+        with self.lock:
+            self.apply(entry)
+            self.journal_file.write(json.dumps(entry) + "\n")
+            self.journal_file.flush()
+            os.fsync(self.journal_file.fileno())
+
+    # Records the Qubole command submitted for a work unit
+    #
+    def record_submitted(self, unit, command_id):
+        self.record('submitted', unit=unit, command_id=command_id)
+
+    # Records the result of a work unit
+    #
+    def record_result(self, unit, result):
+        self.record('result', unit=unit, result=result)
+
+    # Records a comment posted to a ticket, comment => report or data_alert
+    #
+    def record_posted(self, ticket_key, comment):
+        self.record('posted', ticket=ticket_key, comment=comment)
+
+    # Returns the command id last submitted for a work unit that has no result yet
+    #
+    def running_command(self, unit):
+        with self.lock:
+            return None if unit in self.results else self.command_ids.get(unit)
+
+    # Returns the journaled result of a work unit
+    #
+    def result(self, unit):
+        with self.lock:
+            return self.results.get(unit)
+
+    # Checks whether the comment was already posted to the ticket
+    #
+    def is_posted(self, ticket_key, comment):
+        with self.lock:
+            return (ticket_key, comment) in self.posted
+
+    # Closes the journal file
+    #
+    def close(self):
+        with self.lock:
+            self.journal_file.close()
@@ -0,0 +1,133 @@
+# run_metrics module
+# Module holds the class => RunMetrics - manages the instrumentation of a run
+# Class responsible for recording per work unit timings, counts and error tallies of every stage of the run, sampling
+# the pool occupancy over time and writing it all out as a JSON summary and a Prometheus textfile
+#
+from contextlib import contextmanager
+import threading
+import logging
+import json
+import time
+
+
+class RunMetrics(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stages = {}
+        self.occupancy = []
+        self.started = time.time()
+        self.sampler = None
+        self.sampling = threading.Event()
+        self.logger = logging.log
+
+    # Records one observation of a stage, optionally tied to a work unit
+    #
+    def observe(self, stage, seconds, unit=None, error=False):
+        with self.lock:
+            record = self.stages.setdefault(stage, {'timings': [], 'errors': 0})
+            record['timings'].append((None if unit is None else str(unit), seconds))
+            if error:
+                record['errors'] += 1
+
+    # Times the enclosed block as one observation of the stage, an exception raised by the block counts as an error
+    #
+    @contextmanager
+    def stage(self, stage, unit=None):
+        start = time.time()
+        try:
+            yield
+        except Exception:
+            self.observe(stage, time.time() - start, unit, error=True)
+            raise
+        else:
+            self.observe(stage, time.time() - start, unit)
+
+    # Samples the named probes, e.g. pool occupancy, every interval seconds from a background thread
+    #
+    def start_sampling(self, probes, interval=5):
+        def sample_loop():
+            while not self.sampling.wait(interval):
+                sample = {'time': round(time.time() - self.started, 1)}
+                for name, probe in probes.items():
+                    try:
+                        sample[name] = probe()
+                    except Exception:
+                        sample[name] = None
+                with self.lock:
+                    self.occupancy.append(sample)
+        self.sampling.clear()
+        self.sampler = threading.Thread(target=sample_loop, name="MetricsSampler", daemon=True)
+        self.sampler.start()
+
+    # Stops the occupancy sampling thread
+    #
+    def stop_sampling(self):
+        self.sampling.set()
+        if self.sampler:
+            self.sampler.join()
+
+    # Returns the per stage summary => counts, errors and timing percentiles along with the per work unit timings
+    #
+    def summary(self):
+        with self.lock:
+            stages = {}
+            for stage, record in self.stages.items():
+                seconds = sorted(timing for unit, timing in record['timings'])
+                stages[stage] = {
+                    'count': len(seconds),
+                    'errors': record['errors'],
+                    'total_seconds': round(sum(seconds), 3),
+                    'mean_seconds': round(sum(seconds) / len(seconds), 3) if seconds else 0,
+                    'p50_seconds': round(self.percentile(seconds, 0.5), 3),
+                    'p95_seconds': round(self.percentile(seconds, 0.95), 3),
+                    'max_seconds': round(seconds[-1], 3) if seconds else 0,
+                    'units': dict((unit, round(timing, 3)) for unit, timing in record['timings'] if unit)
+                }
+            return {'run_seconds': round(time.time() - self.started, 3), 'stages': stages,
+                    'occupancy': list(self.occupancy)}
+
+    # Returns the value at the given fraction of a sorted list
+    #
+    @staticmethod
+    def percentile(values, fraction):
+        if not values:
+            return 0
+        return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+    # Writes the JSON summary and the Prometheus textfile, named from the given path prefix
+    #
+    def write(self, path_prefix):
+        summary = self.summary()
+        try:
+            with open(path_prefix + '.json', 'w') as json_file:
+                json.dump(summary, json_file, indent=2)
+            with open(path_prefix + '.prom', 'w') as prom_file:
+                prom_file.write(self.prometheus_text(summary))
+        except IOError as e:
+            self.logger(40, "Run metrics could not be written => {}".format(e))
+
+    # Formats the summary in the Prometheus text exposition format
+    #
+    @staticmethod
+    def prometheus_text(summary):
+        lines = ["# HELP ta_report_run_seconds Wall clock time of the run.",
+                 "# TYPE ta_report_run_seconds gauge",
+                 "ta_report_run_seconds " + str(summary['run_seconds']),
+                 "# HELP ta_report_stage_seconds Time spent per stage of the run.",
+                 "# TYPE ta_report_stage_seconds summary"]
+        for stage, values in sorted(summary['stages'].items()):
+            lines.append('ta_report_stage_seconds{stage="%s",quantile="0.5"} %s' % (stage, values['p50_seconds']))
+            lines.append('ta_report_stage_seconds{stage="%s",quantile="0.95"} %s' % (stage, values['p95_seconds']))
+            lines.append('ta_report_stage_seconds_sum{stage="%s"} %s' % (stage, values['total_seconds']))
+            lines.append('ta_report_stage_seconds_count{stage="%s"} %s' % (stage, values['count']))
+        lines.extend(["# HELP ta_report_stage_errors_total Errors per stage of the run.",
+                      "# TYPE ta_report_stage_errors_total counter"])
+        for stage, values in sorted(summary['stages'].items()):
+            lines.append('ta_report_stage_errors_total{stage="%s"} %s' % (stage, values['errors']))
+        lines.extend(["# HELP ta_report_peak_occupancy Peak value of each sampled pool occupancy probe.",
+                      "# TYPE ta_report_peak_occupancy gauge"])
+        probes = sorted(set(name for sample in summary['occupancy'] for name in sample if name != 'time'))
+        for probe in probes:
+            peak = max([sample.get(probe) or 0 for sample in summary['occupancy']] or [0])
+            lines.append('ta_report_peak_occupancy{probe="%s"} %s' % (probe, peak))
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,242 @@
+# shard_leases module
+# Module holds the class => ShardLeases - manages the shard leases of a worker in a sharded run
+# Class responsible for splitting the work units of a run into a fixed number of shards by a stable hash of their pixel,
+# and for claiming shards through lease files on the shared ZFS mount, each lease is renewed by a heartbeat while its
+# shard runs, a lease not renewed within the lease period is taken over by another worker, a finished shard is marked by
+# its results file, so identical workers split a run between them without any other coordination
+#
+import threading
+import hashlib
+import logging
+import time
+import os
+
+
+class ShardLeases(object):
+    def __init__(self, lease_dir, worker_id, shards=8, lease_seconds=300):
+        self.lease_dir = lease_dir
+        self.worker_id = worker_id
+        self.shards = max(1, int(shards))
+        self.lease_seconds = float(lease_seconds)
+        # Seconds between the claims of a worker waiting on the shards leased by others
+        self.poll_seconds = min(10.0, self.lease_seconds / 3)
+        # Leases held by this worker, renewed by the heartbeat
+        self.held = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.heartbeat = None
+        # Called with the name of a held lease found taken over by another worker
+        self.on_lost = None
+        self.logger = logging.log
+        os.makedirs(self.lease_dir, exist_ok=True)
+
+    # Returns the shard of a key, the same on every worker
+    #
+    def shard_of(self, key):
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest(), 16) % self.shards
+
+    # Returns the shards in this worker's order of preference, by rendezvous hashing => each worker starts on a
+    # different slice of the shards, and adding a worker only moves the shards it now ranks first
+    #
+    def preference(self):
+        return sorted(range(self.shards), key=lambda shard: hashlib.md5((self.worker_id + "|" +
+                                                                          str(shard)).encode('utf-8')).hexdigest(),
+                      reverse=True)
+
+    # Claims the next shard that is neither finished nor leased by a live worker, returns None if there is none
+    #
+    def claim(self):
+        for shard in self.preference():
+            if not self.is_done(shard) and self.acquire('shard_' + str(shard)):
+                # The shard may have finished between the check and the claim
+                if not self.is_done(shard):
+                    return shard
+                self.release('shard_' + str(shard))
+        return None
+
+    # Returns the shards not finished yet
+    #
+    def pending(self):
+        return [shard for shard in range(self.shards) if not self.is_done(shard)]
+
+    # Checks whether a shard has finished
+    #
+    def is_done(self, shard):
+        return os.path.isfile(self.results_path(shard))
+
+    # Path of a finished shard's results file
+    #
+    def results_path(self, shard):
+        return os.path.join(self.lease_dir, 'shard_' + str(shard) + '_results.jsonl')
+
+    # Path the results of a shard are written to while it runs, unique to the worker
+    #
+    def part_path(self, shard):
+        return self.results_path(shard) + '.' + self.worker_id + '.part'
+
+    # Marks a shard finished by moving its results into place, then releases its lease
+    #
+    def complete(self, shard):
+        os.replace(self.part_path(shard), self.results_path(shard))
+        self.release('shard_' + str(shard))
+
+    # Checks whether the coordinator has merged the finished shards
+    #
+    def is_merged(self):
+        return os.path.isfile(os.path.join(self.lease_dir, 'merged'))
+
+    # Marks the shards merged, so no later worker merges them again
+    #
+    def mark_merged(self):
+        with open(os.path.join(self.lease_dir, 'merged'), 'w') as merged_file:
+            merged_file.write(self.worker_id)
+
+    # Path of a lease file
+    #
+    def lease_path(self, name):
+        return os.path.join(self.lease_dir, name + '.lease')
+
+    # Acquires a lease by creating its file exclusively, a lease left to expire by a dead worker is first taken over,
+    # which only one of the workers racing for it can do, returns True if the lease is now held by this worker
+    #
+    def acquire(self, name):
+        path = self.lease_path(name)
+        for attempt in range(2):
+            try:
+                lease_file = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if attempt or not self.take_over(name):
+                    return False
+                continue
+            os.write(lease_file, self.worker_id.encode('utf-8'))
+            os.close(lease_file)
+            with self.lock:
+                self.held.add(name)
+            return True
+        return False
+
+    # Removes an expired lease => the lease is linked to a shared expired name first, which only one worker can create,
+    # then the linked file is checked to be the very lease found expired, since a worker acting on an older look may
+    # otherwise remove the lease just created by the winner, returns True if the expired lease was removed
+    #
+    def take_over(self, name):
+        path = self.lease_path(name)
+        expired_path = path + '.expired'
+        try:
+            stale = os.stat(path)
+        except FileNotFoundError:
+            return True
+        if time.time() - stale.st_mtime <= self.lease_seconds:
+            return False
+        try:
+            os.link(path, expired_path)
+        except FileExistsError:
+            # Another worker is taking it over, or died doing so
+            self.clear_take_over(expired_path)
+            return False
+        except FileNotFoundError:
+            return True
+        try:
+            linked = os.stat(expired_path)
+            current = os.stat(path)
+            if not (linked.st_ino == current.st_ino == stale.st_ino and linked.st_mtime == stale.st_mtime):
+                # The lease was renewed or replaced since it was found expired
+                return False
+            owner = self.lease_owner(expired_path)
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        finally:
+            self.remove(expired_path)
+        self.logger(30, "Taking over the expired " + name + " lease of worker " + owner + ".")
+        return True
+
+    # Removes the expired name left behind by a worker that died taking a lease over, the link time is its change time
+    #
+    def clear_take_over(self, expired_path):
+        try:
+            if time.time() - os.stat(expired_path).st_ctime > self.lease_seconds:
+                self.remove(expired_path)
+        except FileNotFoundError:
+            pass
+
+    # Removes a file if it still exists
+    #
+    @staticmethod
+    def remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    # Checks whether a lease has gone a lease period without being renewed
+    #
+    def is_expired(self, path):
+        try:
+            return time.time() - os.stat(path).st_mtime > self.lease_seconds
+        except FileNotFoundError:
+            return False
+
+    # Returns the worker named in a lease file
+    #
+    def lease_owner(self, path):
+        try:
+            with open(path) as lease_file:
+                return lease_file.read().strip() or 'unknown'
+        except IOError:
+            return 'unknown'
+
+    # Releases a lease held by this worker
+    #
+    def release(self, name):
+        with self.lock:
+            self.held.discard(name)
+        if self.lease_owner(self.lease_path(name)) == self.worker_id:
+            self.remove(self.lease_path(name))
+
+    # Checks whether a lease is still held by this worker
+    #
+    def holds(self, name):
+        with self.lock:
+            return name in self.held
+
+    # Renews the held leases, a lease taken over by another worker is given up and reported to the lost callback
+    #
+    def renew(self):
+        with self.lock:
+            held = list(self.held)
+        for name in held:
+            if self.lease_owner(self.lease_path(name)) != self.worker_id:
+                self.logger(30, "The " + name + " lease was taken over by another worker.")
+                with self.lock:
+                    self.held.discard(name)
+                if self.on_lost:
+                    self.on_lost(name)
+                continue
+            try:
+                os.utime(self.lease_path(name))
+            except FileNotFoundError:
+                pass
+
+    # Starts the heartbeat renewing the held leases three times per lease period, optionally calling back with the name
+    # of each lease found taken over
+    #
+    def start(self, on_lost=None):
+        self.on_lost = on_lost
+        def heartbeat_loop():
+            while not self.stopped.wait(self.lease_seconds / 3):
+                self.renew()
+        self.stopped.clear()
+        self.heartbeat = threading.Thread(target=heartbeat_loop, name="LeaseHeartbeat", daemon=True)
+        self.heartbeat.start()
+
+    # Stops the heartbeat and releases every lease still held
+    #
+    def stop(self):
+        self.stopped.set()
+        if self.heartbeat:
+            self.heartbeat.join()
+        with self.lock:
+            held = list(self.held)
+        for name in held:
+            self.release(name)
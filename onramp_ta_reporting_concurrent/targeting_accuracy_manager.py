@@ -6,91 +6,331 @@ from datetime import datetime, timedelta, date
 import time
 import logging
 import os
-from multiprocessing.dummy import Pool as ThreadPool
-from multiprocessing import cpu_count
-from copy import deepcopy
+import csv
+import shutil
+import threading
+import itertools
+from concurrent.futures import Future
 # import json
 import jira_manager
 import qubole_manager
+from command_poller import CommandPoller
+from work_scheduler import WorkScheduler
+from result_cache import ResultCache
+from daily_aggregate_store import DailyAggregateStore
+from comment_pipeline import CommentPipeline
+from run_journal import RunJournal
+from run_metrics import RunMetrics
+from result_store import ResultStore
+from result_history import ResultHistory
 from targeting_accuracy_query import TargetingAccuracyQuery
-
-
-today_date = (datetime.now() - timedelta(hours=7)).strftime('%Y%m%d')
+from query_retry_policy import QueryRetryPolicy
+from query_engine import EngineRouter
+from preview_estimator import PreviewEstimator
+from cost_report import CostReport
+from partition_readiness import PartitionReadiness
+from shard_leases import ShardLeases
 
 
 class TargetingAccuracyManager(object):
+    # Reported for the backfill weeks whose query returned no row
+    zero_result = ('0', '0', '0.0', '0', '0.0')
+
     def __init__(self, config_params):
         self.jira_url = config_params['jira_url']
         self.jira_token = config_params['jira_token']
-        self.jira_pars = jira_manager.JiraManager(self.jira_url, self.jira_token)
+        self.jira_pars = jira_manager.JiraManager(self.jira_url, self.jira_token,
+                                                  pool_size=config_params['max_jira_calls'],
+                                                  rate=config_params['jira_rate'][0],
+                                                  burst=config_params['jira_rate'][1])
         self.jql_agencies = config_params['jql_agencies']
         self.jql_status = config_params['jql_status']
         self.jql_issuetype = config_params['jql_issuetype']
         self.qubole_token = config_params['qubole_token']
         self.cluster_label = config_params['cluster_label']
+        # Small work units may run on a low latency engine, everything else on the default engine
+        self.engine_router = EngineRouter(config_params['engine_labels'], *config_params['engine_routing'])
+        qubole_manager.QuboleManager.api_url = config_params['qubole_api_url']
+        self.metrics = RunMetrics()
+        self.metrics_path = config_params['metrics_path']
+        self.poller = CommandPoller(*config_params['poll_intervals'], metrics=self.metrics)
+        # Failed queries are retried by failure class, all of them drawing on one retry budget for the run
+        self.retry_policy = QueryRetryPolicy(*config_params['qubole_retry'])
+        self.max_qubole_commands = config_params['max_qubole_commands']
+        self.scheduler = None
+        self.comment_posters = config_params['comment_posters']
+        self.comment_pipeline = None
+        self.result_cache = ResultCache(config_params['cache_file'], config_params['cache_mode'])
+        self.daily_store = DailyAggregateStore(config_params['cache_file'])
+        # Every reported weekly result is kept for the week over week trends and moving average alerts
+        self.history = ResultHistory(config_params['history_file'], *config_params['trend_alert'])
+        self.post_comments = config_params['post_comments']
+        # A planning run only explains the queries the run would issue and reports their cost
+        self.plan = config_params['plan']
+        # A backfill reports every week bucket of the requested dates, optionally written out to a file
+        self.backfill = config_params['backfill']
+        self.backfill_output = config_params['backfill_output']
         self.ta_pct = config_params['ta_pct']
-        self.log_dict = {}
-        self.issues = []
-        self.issue = None
-        self.tickets = []
+        self.query_mode = config_params['query_mode']
+        self.query_variant = config_params['query_variant']
+        # An unknown variant fails the run here rather than in every work unit's query
+        TargetingAccuracyQuery.weekly_query_variant(self.query_variant)
+        # A preview run reports estimates from a sample of the impressions, with their margins of error
+        self.preview = PreviewEstimator(*config_params['preview']) if config_params['preview'] else None
+        # Work unit results are streamed to the log and a JSONL results file as they finish
+        self.results = ResultStore(config_params['results_file'])
+        self.work_units = []
+        # Job key of the latest scheduled job of each pixel and the count of jobs scheduled for it
+        self.pixel_jobs = {}
+        self.planned_units = 0
+        self.distinct_units = set()
+        # Result future of every work unit queried in the run, later jobs of the same unit wait on it instead of
+        # querying it again
+        self.unit_flights = {}
+        self.flight_lock = threading.Lock()
+        # Queries are held back until the input partitions of their window have landed
+        self.readiness = PartitionReadiness(self.qubole_token, self.engine_router.default.cluster_label, self.poller,
+                                            self.retry_policy, *config_params['readiness']) \
+            if config_params['readiness'] else None
+        self.hold_sequence = itertools.count(1)
+        # A sharded run splits its work units with identical workers through lease files, the worker finishing last
+        # merges the shard results into the master log, results and journal files and posts the comments
+        self.shard_leases = ShardLeases(*config_params['sharding']) if config_params['sharding'] else None
+        self.master_files = config_params['master_files']
+        self.shard = None
+        self.ticket_count = 0
+        self.pixel_count = 0
         self.logger = logging.log
         self.day_adjust = 0
         self.message = ""
-        # Set report start and end dates to be previous Friday through Thursday
-        self.report_start_date = datetime.strftime((datetime.today() - timedelta(days=self.date_adjust() + 6)),
-                                                   "%Y%m%d")
-        self.report_end_date = datetime.strftime((datetime.today() - timedelta(days=self.date_adjust())), "%Y%m%d")
+        if config_params['report_dates']:
+            # An explicitly requested reporting window, e.g. for the daily materialization run
+            self.report_start_date, self.report_end_date = config_params['report_dates']
+        else:
+            # Set report start and end dates to be previous Friday through Thursday
+            self.report_start_date = datetime.strftime((datetime.today() - timedelta(days=self.date_adjust() + 6)),
+                                                       "%Y%m%d")
+            self.report_end_date = datetime.strftime((datetime.today() - timedelta(days=self.date_adjust())),
+                                                     "%Y%m%d")
+        # Progress of the run is journaled as it happens, a resumed run picks up from the journal of its window
+        self.journal = RunJournal(config_params['journal_file'], self.report_start_date, self.report_end_date,
+                                  resume=config_params['resume'])
 
     # Manages the process for finding tickets, launching the subprocess routine to run tickets concurrently
     #
     def process_manager(self):
-        # Pulls desired tickets running jql
-        self.issues = self.jira_pars.find_issues(self.jql_issuetype, self.jql_status, self.jql_agencies)
-
-        # Verifies that issues were found that match the search criteria and logs count and a list of all issues then
-        # pulls issue information, finally creates ticket object to hold a simplified version of the issue data
-        if self.issues:
-            pixel_count = 0
-            for issue in self.issues:
-                # Request the relevant ticket information for query
-                (issue.start_date, issue.end_date, issue.pixels, issue.profile_ids) = \
-                    self.jira_pars.report_information_pull(issue.key)
-                pixel_count = pixel_count + len(issue.pixels)
-                ticket = Ticket(issue)
-                self.tickets.append(ticket)
-            self.logger(20, str(len(self.issues)) + " ticket(s) were found with a total of " + str(pixel_count) +
-                        " pixel(s).")
-            self.logger(20, str([issue.key for issue in self.issues]) + "\n")
-            self.ticket_concurrency_manager(self.tickets)
-        else:
-            self.logger(30, "There were no tickets found with the required criteria to report on.")
+        try:
+            # Tickets stream in from the paged jql search, a backfill needs all of them before its single query
+            if self.backfill:
+                tickets = list(self.ticket_intake())
+                if tickets:
+                    self.backfill_manager(tickets)
+            elif self.plan:
+                self.plan_manager(self.ticket_intake())
+            elif self.shard_leases:
+                # Every worker takes in all tickets, it only runs the work units of the shards it claims
+                self.shard_manager(list(self.ticket_intake()))
+            else:
+                self.ticket_concurrency_manager(self.ticket_intake())
+            if self.ticket_count:
+                self.logger(20, str(self.ticket_count) + " ticket(s) were found with a total of " +
+                            str(self.pixel_count) + " pixel(s).")
+            else:
+                self.logger(30, "There were no tickets found with the required criteria to report on.")
+        except BaseException as e:
+            # An unhandled error or SIGTERM (raised as SystemExit by main.py) leaves nothing running on the cluster
+            self.logger(40, "The run was aborted => {}".format(repr(e)))
+            self.cancel_in_flight()
+            raise
+        finally:
+            self.poller.stop()
+            self.journal.close()
+            self.results.close()
+            self.metrics.write(self.metrics_path)
+            self.jira_pars.kill_session()
 
-        self.jira_pars.kill_session()
+    # Pulls desired tickets running jql, yields a ticket object holding a simplified version of each issue's data as
+    # soon as its search page is read, the issues found are logged page by page and never held as a whole
+    #
+    def ticket_intake(self):
+        pages = self.jira_pars.issue_pages(self.jql_issuetype, self.jql_status, self.jql_agencies)
+        while True:
+            with self.metrics.stage('jira_search'):
+                page = next(pages, None)
+            if page is None:
+                return
+            self.results.result_logger.log(20, str([issue.key for issue in page]))
+            for issue in page:
+                # Request the relevant ticket information for query, served from the fields of the search page
+                with self.metrics.stage('jira_pull', issue.key):
+                    (issue.start_date, issue.end_date, issue.pixels, issue.profile_ids) = \
+                        self.jira_pars.report_information_pull(issue.key)
+                self.ticket_count += 1
+                self.pixel_count += len(issue.pixels)
+                yield Ticket(issue)
 
-    # Manages the process for ticket level concurrency processing, calls report generator function, enters all the info
-    # level log entries to the master log file
+    # Manages the process for ticket level concurrency processing, calls report generator function for each ticket as
+    # it streams in from the intake, which schedules the ticket's work units straight away so queries run while Jira is
+    # still being paged, then waits for them to finish and enters all the info level log entries to the master log file
     #
     def ticket_concurrency_manager(self, tickets):
         self.logger(20, "\nBeginning the ticket level concurrent processing.\n")
         # Reset the logging level to "WARNING" to filter out Qubole logging message deluge.
         logging.getLogger().setLevel(logging.WARNING)
-        # Launches a thread for each of the found tickets
-        ticket_pool = ThreadPool(cpu_count())
+        # A single flat pool runs the (ticket, pixel) work units, sized by the allowed in-flight Qubole commands
+        self.scheduler = WorkScheduler(self.max_qubole_commands)
+        # Finished results are posted per ticket by the comment pipeline, off the query workers
+        self.comment_pipeline = CommentPipeline(self.ticket_comments_manager, self.comment_posters)
+        # Pool occupancy is sampled throughout the concurrent phase, which the log level hides
+        self.metrics.start_sampling({'running_units': lambda: self.scheduler.occupancy()[0],
+                                     'queued_units': lambda: self.scheduler.occupancy()[1],
+                                     'in_flight_commands': self.poller.in_flight})
         try:
-            ticket_pool.map(self.report_generator, tickets)
-            ticket_pool.close()
-            ticket_pool.join()
+            for ticket in tickets:
+                self.report_generator(ticket)
+            # In batched mode the tickets only queued their work units, runs them all as a single query
+            if self.query_mode == 'batched':
+                if self.wait_ready():
+                    self.batch_query_manager(self.work_units)
+                else:
+                    self.report_not_ready(self.work_units)
+            else:
+                self.results.result_logger.log(20, str(self.planned_units) + " work unit(s) planned as " +
+                                               str(len(self.distinct_units)) + " distinct unit(s) over " +
+                                               str(sum(self.pixel_jobs[pixel][1] for pixel in self.pixel_jobs)) +
+                                               " pixel job(s).")
+            self.scheduler.shutdown()
+            self.comment_pipeline.close()
         except Exception as e:
             self.message = ("Ticket Level Concurrency run failed => {}".format(e))
             self.logger(40, self.message)
+            self.cancel_in_flight()
         else:
             # Reset the logging level to "INFO" to allow the addition of ticket and pixel level results
             logging.getLogger().setLevel(logging.INFO)
-            self.logger(20, "\nFinished the ticket level concurrent processing.\n")
-            self.log_write(self.log_dict)
-            # Comment out the json file create/write below for production, used for log file off-line formatting
-            # with open('log.json', 'w') as fp:
-                # json.dump(self.log_dict, fp)
+            self.logger(20, "\nFinished the ticket level concurrent processing => " +
+                        str(len(self.results.results())) + " work unit result(s).\n")
+        finally:
+            self.metrics.stop_sampling()
+
+    # Cancels the queued work units and every Qubole command still in flight, so an aborted run does not leave queries
+    # consuming the cluster
+    #
+    def cancel_in_flight(self):
+        queued = self.scheduler.cancel_pending() if self.scheduler else 0
+        cancelled = self.poller.cancel_all()
+        self.logger(30, "Cancelled " + str(queued) + " queued work unit(s) and " + str(cancelled) +
+                    " in-flight Qubole command(s).")
+
+    # Runs the worker's part of a sharded run => claims shards until none are left unfinished, waiting on the shards
+    # leased by other workers so it takes them over should their worker die, then the first worker to find every shard
+    # finished becomes the coordinator and merges them, the workers never post to Jira themselves
+    #
+    def shard_manager(self, tickets):
+        post_comments, self.post_comments = self.post_comments, False
+        # Each shard streams its results to its own file on the shared mount
+        self.results.close()
+        self.shard_leases.start(self.lease_lost)
+        try:
+            while True:
+                shard = self.shard_leases.claim()
+                if shard is not None:
+                    if not self.shard_run(shard, tickets):
+                        return
+                elif self.shard_leases.pending():
+                    time.sleep(self.shard_leases.poll_seconds)
+                else:
+                    break
+            self.post_comments = post_comments
+            if not self.shard_leases.is_merged() and self.shard_leases.acquire('merge'):
+                # Another coordinator may have finished the merge between the check and the claim
+                if not self.shard_leases.is_merged():
+                    self.merge_shards(tickets)
+                    self.shard_leases.mark_merged()
+                self.shard_leases.release('merge')
+        finally:
+            self.shard_leases.stop()
+
+    # Runs the work units of a claimed shard as a run of their own, the shard is marked finished once they have all
+    # finished, a failed shard is released to be run again by another worker, as is one whose lease was taken over,
+    # returns False if the shard failed
+    #
+    def shard_run(self, shard, tickets):
+        self.logger(20, "\nRunning shard " + str(shard + 1) + " of " + str(self.shard_leases.shards) + " as worker " +
+                    self.shard_leases.worker_id + ".\n")
+        self.shard = shard
+        self.results = ResultStore(self.shard_leases.part_path(shard))
+        self.work_units = []
+        self.pixel_jobs = {}
+        self.planned_units = 0
+        self.distinct_units = set()
+        self.message = ""
+        try:
+            self.ticket_concurrency_manager(tickets)
+        finally:
+            self.results.close()
+            self.shard = None
+        if self.message or not self.shard_leases.holds('shard_' + str(shard)):
+            self.shard_leases.release('shard_' + str(shard))
+            return False
+        self.shard_leases.complete(shard)
+        return True
+
+    # Aborts the running shard once the heartbeat finds its lease taken over by another worker, which runs the shard
+    # again, so the two workers do not both run its queries
+    #
+    def lease_lost(self, name):
+        shard = self.shard
+        if shard is not None and name == 'shard_' + str(shard):
+            self.message = "The lease of shard " + str(shard + 1) + " was taken over by another worker."
+            self.logger(40, self.message)
+            self.cancel_in_flight()
+
+    # Merges the results of every shard into the master log, results and journal files as the coordinator of the run,
+    # then posts the comment of each ticket as the single worker run would, a coordinator taking over from one that
+    # died skips the comments the master journal shows as posted
+    #
+    def merge_shards(self, tickets):
+        master_log, master_results, master_journal = self.master_files
+        handler = logging.FileHandler(master_log)
+        handler.setFormatter(logging.Formatter('%(asctime)s: %(levelname)s: %(message)s', '%m/%d/%Y %H:%M:%S'))
+        logging.getLogger().addHandler(handler)
+        worker_journal = self.journal
+        self.journal = RunJournal(master_journal, self.report_start_date, self.report_end_date, resume=True)
+        self.results = ResultStore(master_results)
+        try:
+            unit_results = {}
+            for shard in range(self.shard_leases.shards):
+                for unit_result in ResultStore.read(self.shard_leases.results_path(shard)):
+                    unit_results[(unit_result.ticket_key, unit_result.pixel,
+                                  ResultCache.normalized_profiles(unit_result.profile_ids))] = unit_result
+            self.logger(20, "\nMerging " + str(len(unit_results)) + " work unit result(s) of " +
+                        str(self.shard_leases.shards) + " shard(s) as the coordinator.\n")
+            self.comment_pipeline = CommentPipeline(self.ticket_comments_manager, self.comment_posters)
+            for ticket in tickets:
+                if not ticket.start_date <= self.report_end_date <= ticket.end_date:
+                    continue
+                if not (ticket.pixels and ticket.profile_ids and len(ticket.pixels) == len(ticket.profile_ids)):
+                    self.comments_manager(ticket, None)
+                    continue
+                sub_tickets = self.split_ticket(ticket)
+                self.comment_pipeline.expect(ticket.key, len(sub_tickets))
+                for sub_ticket in sub_tickets:
+                    unit_result = unit_results.get((ticket.key, "".join(sub_ticket.pixels[0]),
+                                                    ResultCache.normalized_profiles(sub_ticket.profile_ids)))
+                    if unit_result is None:
+                        # The ticket changed after the shard that would hold the pixel took in the tickets
+                        self.logger(30, "No shard holds a result for: " + ticket.key + " pixel " +
+                                    "".join(sub_ticket.pixels[0]))
+                    query_result = unit_result.query_result() if unit_result else None
+                    self.log_query_result(sub_ticket, query_result)
+                    self.comment_pipeline.add(sub_ticket, query_result)
+            self.comment_pipeline.close()
+        finally:
+            self.journal.close()
+            self.journal = worker_journal
+            logging.getLogger().removeHandler(handler)
+            handler.close()
 
     # Checks campaign start and end dates, calls ticket data check
     #
@@ -107,87 +347,674 @@ class TargetingAccuracyManager(object):
             self.logger(30, "This ticket does not match the report-date criteria: " + ticket.key)
 
     # Verifies that ticket data - pixels and profile_ids exist and are proportionate, then creates sub-ticket objects
-    # for each of the pixel numbers on the ticket, these are then progressed to the pixel_concurrency_manager module,
-    # if only one pixel number on ticket, the ticket progresses directly to the query manager, if there is a problem
-    # with ticket data a comment alert is posted to the ticket by calling the comments_manager
+    # for each of the pixel numbers on the ticket, these are scheduled as work units straight away, or queued for the
+    # single query of batched mode, if there is a problem with ticket data a comment alert is posted to the ticket by
+    # calling the comments_manager
     #
     def ticket_data_check(self, ticket):
         if ticket.pixels and ticket.profile_ids and len(ticket.pixels) == len(ticket.profile_ids):
-            if len(ticket.pixels) > 1:
-                tickets = []
-                n = 0
-                for pixel in ticket.pixels:
-                    sub_ticket = deepcopy(ticket)
-                    sub_ticket.pixels = []
-                    sub_ticket.profile_ids = []
-                    sub_ticket.pixels.append(pixel)
-                    sub_ticket.profile_ids.append(ticket.profile_ids[n])
-                    tickets.append(sub_ticket)
-                    n += 1
-                pcm_results = self.pixel_concurrency_manager(tickets)
-                return pcm_results
+            tickets = [sub_ticket for sub_ticket in self.split_ticket(ticket) if self.in_shard(sub_ticket)]
+            if not tickets:
+                return tickets
+            if self.comment_pipeline:
+                self.comment_pipeline.expect(ticket.key, len(tickets))
+            if self.query_mode == 'batched' or self.plan:
+                self.work_units.extend(tickets)
             else:
-                qm_results = self.query_manager(ticket)
-                return qm_results
+                self.plan_work_units(tickets)
+            return tickets
         else:
             self.logger(30, "This ticket is missing data required for report generation: " + ticket.key)
             self.comments_manager(ticket, None)
 
-    # For tickets with multiple pixel numbers, calls the query manager function for each pixel on multi-pixel tickets
+    # Checks whether a sub-ticket belongs to the shard being run, all the sub-tickets of a pixel share a shard so the
+    # pixel is still scanned once
     #
-    def pixel_concurrency_manager(self, tickets):
-        # Launches a thread for each of the pixels
-        pixel_pool = ThreadPool(cpu_count())
-        try:
-            pixel_results = pixel_pool.map(self.query_manager, tickets)
-            pixel_pool.close()
-            pixel_pool.join()
-        except Exception as e:
-            self.message = ("Pixel Level Concurrency run failed => {}".format(e))
-            self.logger(40, self.message)
-        else:
-            return pixel_results
+    def in_shard(self, ticket):
+        return self.shard is None or self.shard_leases.shard_of("".join(ticket.pixels[0])) == self.shard
+
+    # Creates a sub-ticket object for each of the pixel numbers on the ticket, paired with its profile_ids
+    #
+    @staticmethod
+    def split_ticket(ticket):
+        tickets = []
+        for pixel, profile_ids in zip(ticket.pixels, ticket.profile_ids):
+            sub_ticket = Ticket(ticket)
+            sub_ticket.pixels = [pixel]
+            sub_ticket.profile_ids = [profile_ids]
+            tickets.append(sub_ticket)
+        return tickets
+
+    # Plans sub-tickets as they arrive => a sub-ticket joins the job of its pixel while that job is still queued,
+    # otherwise a new job is queued for the pixel, so a pixel is scanned once unless its tickets arrive after its query
+    # started, in which case the result cache serves the profile sets that query already covered, the search is ordered
+    # by end date so the jobs of the campaigns closest to their end date are queued first
+    #
+    def plan_work_units(self, tickets):
+        for ticket in tickets:
+            self.planned_units += 1
+            self.distinct_units.add(TargetingAccuracyQuery.unit_key(ticket.pixels, ticket.profile_ids))
+            pixel = "".join(ticket.pixels[0])
+            job_key, job_count = self.pixel_jobs.get(pixel, (None, 0))
+            if job_key is None or not self.scheduler.update_queued(job_key, lambda unit: unit.append(ticket)):
+                job_key = pixel if not job_count else pixel + "#" + str(job_count + 1)
+                self.pixel_jobs[pixel] = (job_key, job_count + 1)
+                self.scheduler.submit(job_key, self.pixel_query_manager, [ticket], priority=(ticket.end_date,
+                                                                                            ticket.key))
+
+    # Runs the work of a single pixel => sub-tickets sharing the pixel and profile set share one query, a pixel with
+    # several profile sets runs a single batched query, so its impression scan and the pixel-only aggregates
+    # TOTAL_IMPRESSIONS and ELIGIBLE_INDIVIDUALS are computed once, only MATCHED_INDIVIDUALS per profile set, in the
+    # incremental mode the missing days of all its profile sets are likewise materialized by one query
+    #
+    def pixel_query_manager(self, tickets):
+        if not self.readiness_gate(tickets):
+            return None
+        units = {}
+        for ticket in tickets:
+            units.setdefault(TargetingAccuracyQuery.unit_key(ticket.pixels, ticket.profile_ids), []).append(ticket)
+        if self.query_mode in ('per_pixel', 'incremental') and len(units) > 1:
+            return self.batch_query_manager(tickets)
+        return [self.query_manager(unit_tickets) for unit_tickets in units.values()]
+
+    # Holds back the job of a pixel while the input partitions of the reporting window have not landed => the job is
+    # requeued for the next readiness check without holding a worker, so the jobs of the rest of the run go ahead,
+    # returns True when the job may run its queries, jobs whose results are all journaled or cached need no input data
+    #
+    def readiness_gate(self, tickets):
+        status = 'ready' if self.readiness is None or self.settled(tickets) else \
+            self.readiness.status(self.report_start_date, self.report_end_date)
+        if status == 'waiting':
+            self.scheduler.submit_later(self.readiness.retry_in(self.report_start_date, self.report_end_date),
+                                        "".join(tickets[0].pixels[0]) + " held " + str(next(self.hold_sequence)),
+                                        self.pixel_query_manager, tickets,
+                                        priority=min((ticket.end_date, ticket.key) for ticket in tickets))
+        elif status == 'expired':
+            self.report_not_ready(tickets)
+        return status == 'ready'
+
+    # Returns True if every sub-ticket's result is journaled by an earlier attempt or held in the weekly result cache
+    #
+    def settled(self, tickets):
+        return all(self.journal.result(RunJournal.unit_key(ticket.key, ticket.pixels, ticket.profile_ids)) or
+                   self.query_mode not in ('incremental', 'preview') and
+                   self.result_cache.get(self.weekly_cache_key(ticket)) is not None for ticket in tickets)
+
+    # Waits out the readiness checks of the reporting window for the runs issuing a single query, returns True once the
+    # input partitions are ready, False if the maximum wait passed
+    #
+    def wait_ready(self):
+        if not self.readiness:
+            return True
+        while self.readiness.status(self.report_start_date, self.report_end_date) == 'waiting':
+            time.sleep(self.readiness.retry_in(self.report_start_date, self.report_end_date))
+        return self.readiness.status(self.report_start_date, self.report_end_date) == 'ready'
 
-    # Runs a weekly report and returns results
+    # Reports the sub-tickets whose input data never became ready as having no results, so no understated targeting
+    # accuracy is reported or alerted on
     #
-    def query_manager(self, ticket):
-        # Checks that the required ticket information exists, else bypasses Qubole
-        if ticket.pixels and ticket.profile_ids:
+    def report_not_ready(self, tickets):
+        for ticket in tickets:
+            self.logger(40, "The input data was not ready, no report for: " + ticket.key + " pixel " +
+                        "".join(ticket.pixels[0]))
+            self.log_query_result(ticket, None)
+            self.comment_pipeline.add(ticket, None)
+
+    # Runs a weekly report once for sub-tickets sharing a pixel and profile set and fans the results out to each of
+    # them, results journaled by an earlier attempt at this reporting window are reused, every new result is journaled
+    # as soon as it is returned
+    #
+    def query_manager(self, tickets):
+        units = [RunJournal.unit_key(ticket.key, ticket.pixels, ticket.profile_ids) for ticket in tickets]
+        query_result = next((result for result in map(self.journal.result, units) if result), None)
+        if query_result is None:
+            unit_key = TargetingAccuracyQuery.unit_key(tickets[0].pixels, tickets[0].profile_ids)
+            claimed, flights = self.claim_units([unit_key])
+            if claimed:
+                try:
+                    if self.query_mode == 'incremental':
+                        query_result = self.incremental_query_manager(tickets[0])
+                    elif self.query_mode == 'preview':
+                        query_result = self.preview_query_manager(tickets[0])
+                    else:
+                        query_result = self.weekly_query_manager(tickets[0], units)
+                finally:
+                    self.land_units({unit_key: query_result})
+            else:
+                query_result = flights[unit_key].result()
+        for ticket, unit in zip(tickets, units):
+            if query_result and self.journal.result(unit) is None:
+                self.journal.record_result(unit, query_result)
+            self.log_query_result(ticket, query_result)
+            self.comment_pipeline.add(ticket, query_result)
+        return query_result
+
+    # Returns the weekly report results from the result cache or runs the weekly query, re-attaching to the command of
+    # an earlier attempt when the journal shows it was still running, the command is journaled for each of the units
+    #
+    def weekly_query_manager(self, ticket, units):
+        # Previously completed results for the same pixel, profile ids and reporting window skip Qubole
+        cache_key = self.weekly_cache_key(ticket)
+        query_result = self.result_cache.get(cache_key)
+        if query_result is None:
             ticket.query = TargetingAccuracyQuery()
-            qubole = qubole_manager.QuboleManager((ticket.key, "".join(ticket.pixels[0])), self.qubole_token,
-                                                  self.cluster_label, ticket.query.weekly_query(ticket.pixels,
-                                                  ticket.profile_ids, self.report_start_date, self.report_end_date))
-            query_result = qubole.get_results()
-            self.log_dict.setdefault(str((ticket.key, ticket.pixels[0])), []).append(ticket.pixels)
-            self.log_dict.setdefault(str((ticket.key, ticket.pixels[0])), []).append(ticket.profile_ids)
-            self.log_dict.setdefault(str((ticket.key, ticket.pixels[0])), []).append(query_result)
-            self.comments_manager(ticket, query_result)
-            return query_result
+            weekly_query = ticket.query.weekly_query_variant(self.query_variant)
+            running_command = next((command_id for command_id in map(self.journal.running_command, units)
+                                    if command_id), None)
+            for engine in self.route_engines(ticket.pixels):
+                qubole = qubole_manager.QuboleManager((ticket.key, "".join(ticket.pixels[0])), self.qubole_token,
+                                                      engine.cluster_label, weekly_query(ticket.pixels,
+                                                      ticket.profile_ids, self.report_start_date,
+                                                      self.report_end_date, engine=engine), poller=self.poller,
+                                                      metrics=self.metrics, retry_policy=self.retry_policy,
+                                                      engine=engine, on_submit=lambda command_id:
+                                                      [self.journal.record_submitted(unit, command_id)
+                                                       for unit in units])
+                query_result = qubole.get_results(running_command)
+                running_command = None
+                if query_result is not None:
+                    break
+            self.result_cache.put(cache_key, query_result, qubole.command_id)
+        return query_result
+
+    # Materializes the per-day partial counts of the reporting window that are not stored yet, then sums the stored days
+    # locally into the weekly results, days that have not ended yet are never materialized, nor are days without
+    # impressions unless the readiness check confirmed their partitions complete
+    #
+    def incremental_query_manager(self, ticket):
+        unit_key = TargetingAccuracyQuery.unit_key(ticket.pixels, ticket.profile_ids)
+        missing_days = self.unit_missing_days(unit_key)
+        if missing_days:
+            query = TargetingAccuracyQuery()
+            for engine in self.route_engines([unit_key[0]]):
+                qubole = qubole_manager.QuboleManager((ticket.key, "".join(ticket.pixels[0]), "Daily"),
+                                                      self.qubole_token, engine.cluster_label,
+                                                      query.daily_partial_query([unit_key[0]], list(unit_key[1]),
+                                                                                missing_days, engine=engine),
+                                                      poller=self.poller, metrics=self.metrics,
+                                                      retry_policy=self.retry_policy, engine=engine)
+                rows = qubole.get_result_rows()
+                if rows is not None:
+                    break
+            if rows is None:
+                return None
+            self.daily_store.put_days(unit_key, missing_days, rows, qubole.command_id,
+                                      self.readiness.confirmed_days(self.report_start_date, self.report_end_date)
+                                      if self.readiness else ())
+        return self.daily_store.window_result(unit_key, self.report_start_date, self.report_end_date)
+
+    # Returns the days of the reporting window not materialized yet for a work unit, days that have not ended yet are
+    # left out
+    #
+    def unit_missing_days(self, unit_key):
+        return [day for day in self.daily_store.missing_days(unit_key, self.report_start_date, self.report_end_date)
+                if day < datetime.today().strftime("%Y%m%d")]
+
+    # Returns the preview estimates from the result cache or runs the sampled preview query and estimates the weekly
+    # report columns and their margins of error from its per-bucket counts
+    #
+    def preview_query_manager(self, ticket):
+        cache_key = self.preview_cache_key(ticket)
+        query_result = self.result_cache.get(cache_key)
+        if query_result is None:
+            query = TargetingAccuracyQuery()
+            for engine in self.route_engines(ticket.pixels):
+                qubole = qubole_manager.QuboleManager((ticket.key, "".join(ticket.pixels[0]), "Preview"),
+                                                      self.qubole_token, engine.cluster_label,
+                                                      query.preview_query(ticket.pixels, ticket.profile_ids,
+                                                                          self.report_start_date, self.report_end_date,
+                                                                          self.preview.sampled_buckets,
+                                                                          self.preview.buckets, engine=engine),
+                                                      poller=self.poller, metrics=self.metrics,
+                                                      retry_policy=self.retry_policy, engine=engine)
+                rows = qubole.get_result_rows()
+                if rows is not None:
+                    break
+            query_result = self.preview.estimate(rows)
+            self.result_cache.put(cache_key, query_result, qubole.command_id)
+        return query_result
+
+    # Runs a single weekly report for all queued work units, sub-tickets sharing a pixel and profile set share a row of
+    # the results, which are then fanned back out to each sub-ticket's comments, units found in the run journal or the
+    # result cache are left out of the query, in the incremental mode the units' missing days are materialized by a
+    # single query instead
+    #
+    def batch_query_manager(self, tickets):
+        if tickets:
+            units = {}
+            for ticket in tickets:
+                units.setdefault(TargetingAccuracyQuery.unit_key(ticket.pixels, ticket.profile_ids), []).append(ticket)
+            results = {}
+            for unit_key in units:
+                journaled = [self.journal.result(RunJournal.unit_key(ticket.key, ticket.pixels, ticket.profile_ids))
+                             for ticket in units[unit_key]]
+                # Incremental results are summed from the stored days rather than cached
+                results[unit_key] = next((result for result in journaled if result), None) or \
+                    (None if self.query_mode == 'incremental' else
+                     self.result_cache.get(self.batch_cache_key(unit_key)))
+            unit_keys, flights = self.claim_units([unit_key for unit_key in units if results[unit_key] is None])
+            try:
+                if self.query_mode == 'incremental':
+                    self.batch_daily_query(unit_keys, results)
+                else:
+                    self.batch_query(unit_keys, results)
+            finally:
+                self.land_units(dict((unit_key, results.get(unit_key)) for unit_key in unit_keys))
+            for unit_key, flight in flights.items():
+                results[unit_key] = flight.result()
+            batch_results = []
+            for unit_key in units:
+                query_result = results.get(unit_key)
+                for ticket in units[unit_key]:
+                    if query_result:
+                        self.journal.record_result(RunJournal.unit_key(ticket.key, ticket.pixels, ticket.profile_ids),
+                                                   query_result)
+                    self.log_query_result(ticket, query_result)
+                    self.comment_pipeline.add(ticket, query_result)
+                    batch_results.append(query_result)
+            return batch_results
+
+    # Runs the batched weekly query for the given work units, the result of each unit is set in results as its row
+    # streams in
+    #
+    def batch_query(self, unit_keys, results):
+        if unit_keys:
+            query = TargetingAccuracyQuery()
+            for engine in self.route_engines([pixel for pixel, profile_ids in unit_keys]):
+                qubole = qubole_manager.QuboleManager(("Batched", str(len(unit_keys)) + " units"),
+                                                      self.qubole_token, engine.cluster_label,
+                                                      query.batched_weekly_query(unit_keys, self.report_start_date,
+                                                                                 self.report_end_date,
+                                                                                 engine=engine),
+                                                      poller=self.poller, metrics=self.metrics,
+                                                      retry_policy=self.retry_policy, engine=engine)
+                # Rows are read one at a time as they stream in, one row per work unit
+                for row in qubole.stream_results():
+                    unit_key = unit_keys[int(row[0])]
+                    results[unit_key] = row[1:]
+                    self.result_cache.put(self.batch_cache_key(unit_key), row[1:], qubole.command_id)
+                if qubole.command_id is not None:
+                    break
+
+    # Materializes the days of the reporting window missing for any of the given work units with a single daily partial
+    # query, then sums the stored days of each unit into its weekly results, set in results, units whose days could
+    # not be materialized are left without a result
+    #
+    def batch_daily_query(self, unit_keys, results):
+        missing_days = dict((unit_key, self.unit_missing_days(unit_key)) for unit_key in unit_keys)
+        queried = [unit_key for unit_key in unit_keys if missing_days[unit_key]]
+        if queried:
+            query = TargetingAccuracyQuery()
+            days = sorted(set(day for unit_key in queried for day in missing_days[unit_key]))
+            for engine in self.route_engines([pixel for pixel, profile_ids in queried]):
+                qubole = qubole_manager.QuboleManager(("Batched", str(len(queried)) + " units", "Daily"),
+                                                      self.qubole_token, engine.cluster_label,
+                                                      query.batched_daily_partial_query(queried, days, engine=engine),
+                                                      poller=self.poller, metrics=self.metrics,
+                                                      retry_policy=self.retry_policy, engine=engine)
+                rows = qubole.get_result_rows()
+                if rows is not None:
+                    break
+            if rows is None:
+                unit_keys = [unit_key for unit_key in unit_keys if unit_key not in queried]
+            else:
+                confirmed_days = self.readiness.confirmed_days(self.report_start_date, self.report_end_date) \
+                    if self.readiness else ()
+                for n, unit_key in enumerate(queried):
+                    self.daily_store.put_days(unit_key, missing_days[unit_key],
+                                              [row[1:] for row in rows if int(row[0]) == n], qubole.command_id,
+                                              confirmed_days)
+        for unit_key in unit_keys:
+            results[unit_key] = self.daily_store.window_result(unit_key, self.report_start_date, self.report_end_date)
+
+    # Claims the work units no other job of the run has queried, returns the claimed unit keys and the result futures of
+    # the units claimed before, which the caller waits on
+    #
+    def claim_units(self, unit_keys):
+        with self.flight_lock:
+            claimed = [unit_key for unit_key in unit_keys if unit_key not in self.unit_flights]
+            flights = dict((unit_key, self.unit_flights[unit_key]) for unit_key in unit_keys
+                           if unit_key not in claimed)
+            for unit_key in claimed:
+                self.unit_flights[unit_key] = Future()
+        return claimed, flights
+
+    # Sets the results of claimed work units, releasing the jobs waiting on them
+    #
+    def land_units(self, results):
+        with self.flight_lock:
+            for unit_key, result in results.items():
+                self.unit_flights[unit_key].set_result(result)
+
+    # Returns the engines to run a work unit on in order, routed by the summed latest cached TOTAL_IMPRESSIONS of its
+    # pixels, units with a pixel never reported before are of unknown size and run on the default engine
+    #
+    def route_engines(self, pixels):
+        pixels = sorted(set(",".join(pixels).replace(' ', '').split(',')))
+        estimates = [self.result_cache.latest_total_impressions(pixel) for pixel in pixels]
+        engines = self.engine_router.route_with_fallback(None if None in estimates else sum(estimates))
+        if len(engines) > 1:
+            self.logger(20, "Pixel(s) " + ", ".join(pixels) + " of " + str(sum(estimates)) + " impressions routed to " +
+                        engines[0].name + ".")
+        return engines
+
+    # Builds the result cache key of a single work unit's weekly report
+    #
+    def weekly_cache_key(self, ticket):
+        return ResultCache.cache_key(ticket.pixels, ticket.profile_ids, self.report_start_date, self.report_end_date,
+                                     self.query_variant)
+
+    # Builds the result cache key of a single work unit's preview estimates, apart from the exact results
+    #
+    def preview_cache_key(self, ticket):
+        return ResultCache.cache_key(ticket.pixels, ticket.profile_ids, self.report_start_date, self.report_end_date,
+                                     'preview_' + str(self.preview.sampled_buckets) + '_of_' +
+                                     str(self.preview.buckets))
+
+    # Plans the run without launching any report query => the tickets are taken in and validated as in a real run,
+    # every query the run would issue is built and only its EXPLAIN is run on the engine it is routed to, concurrently
+    # up to the in-flight command cap, then the cost report ranking the queries by the data they would scan is printed
+    # and logged, the scans are read from Hive plans only, so queries routed elsewhere are flagged as having no plan
+    #
+    def plan_manager(self, tickets):
+        self.logger(20, "\nPlanning the run, no report queries will be launched.\n")
+        for ticket in tickets:
+            self.report_generator(ticket)
+        self.scheduler = WorkScheduler(self.max_qubole_commands)
+        planned = [(label, keys, self.scheduler.submit(n, self.explain_query, (query, engine)) if query else None)
+                   for n, (label, keys, query, engine) in enumerate(self.planned_queries(self.work_units))]
+        self.scheduler.shutdown()
+        report = CostReport(self.max_qubole_commands)
+        for label, keys, future in planned:
+            if future is None:
+                report.add(label, keys, cached=True)
+            else:
+                report.add(label, keys, None if future.exception() else future.result())
+        report.write()
+
+    # Returns every query the run would issue for the sub-tickets, grouped the way the query mode groups them and in
+    # the dialect of the engine the run would route them to => a list of (label, ticket keys, query, engine), the query
+    # is None for work units the result cache would serve
+    #
+    def planned_queries(self, tickets):
+        query = TargetingAccuracyQuery()
+        units = {}
+        for ticket in tickets:
+            units.setdefault(TargetingAccuracyQuery.unit_key(ticket.pixels, ticket.profile_ids), []).append(ticket)
+        if self.query_mode == 'batched':
+            pixel_units = {'all pixels': list(units)}
+        else:
+            pixel_units = {}
+            for unit_key in units:
+                pixel_units.setdefault(unit_key[0], []).append(unit_key)
+        planned = []
+        for pixel, unit_keys in pixel_units.items():
+            if self.query_mode == 'batched' or self.query_mode == 'per_pixel' and len(unit_keys) > 1:
+                uncached = [unit_key for unit_key in unit_keys
+                            if self.result_cache.get(self.batch_cache_key(unit_key)) is None]
+                engine = self.route_engines([unit_key[0] for unit_key in uncached])[0] if uncached else None
+                planned.append(("Batched " + pixel + " (" + str(len(uncached)) + " units)",
+                                [ticket.key for unit_key in unit_keys for ticket in units[unit_key]],
+                                query.batched_weekly_query(uncached, self.report_start_date, self.report_end_date,
+                                                           engine=engine) if uncached else None, engine))
+                continue
+            if self.query_mode == 'incremental' and len(unit_keys) > 1:
+                missing_days = dict((unit_key, self.unit_missing_days(unit_key)) for unit_key in unit_keys)
+                queried = [unit_key for unit_key in unit_keys if missing_days[unit_key]]
+                days = sorted(set(day for unit_key in queried for day in missing_days[unit_key]))
+                engine = self.route_engines([pixel])[0] if queried else None
+                planned.append(("Batched " + pixel + " (" + str(len(queried)) + " units, daily)",
+                                [ticket.key for unit_key in unit_keys for ticket in units[unit_key]],
+                                query.batched_daily_partial_query(queried, days, engine=engine) if queried else None,
+                                engine))
+                continue
+            for unit_key in unit_keys:
+                ticket = units[unit_key][0]
+                label = "Pixel " + pixel + " [" + ",".join(unit_key[1]) + "]"
+                engine = self.route_engines(ticket.pixels)[0]
+                if self.query_mode == 'incremental':
+                    days = self.unit_missing_days(unit_key)
+                    unit_query = query.daily_partial_query([pixel], list(unit_key[1]), days, engine=engine) \
+                        if days else None
+                elif self.query_mode == 'preview':
+                    unit_query = None if self.result_cache.get(self.preview_cache_key(ticket)) is not None else \
+                        query.preview_query(ticket.pixels, ticket.profile_ids, self.report_start_date,
+                                            self.report_end_date, self.preview.sampled_buckets, self.preview.buckets,
+                                            engine=engine)
+                else:
+                    unit_query = None if self.result_cache.get(self.weekly_cache_key(ticket)) is not None else \
+                        query.weekly_query_variant(self.query_variant)(ticket.pixels, ticket.profile_ids,
+                                                                       self.report_start_date, self.report_end_date,
+                                                                       engine=engine)
+                planned.append((label, [sub_ticket.key for sub_ticket in units[unit_key]], unit_query, engine))
+        return planned
+
+    # Runs the EXPLAIN of a planned query on the engine it was built for, given as (query, engine), returns the plan
+    # text or None if it failed
+    #
+    def explain_query(self, planned_query):
+        query, engine = planned_query
+        qubole = qubole_manager.QuboleManager(("Plan",), self.qubole_token, engine.cluster_label,
+                                              engine.explain(query), poller=self.poller, metrics=self.metrics,
+                                              retry_policy=self.retry_policy, engine=engine)
+        rows = qubole.get_result_rows()
+        return "\n".join("\t".join(row) for row in rows) if rows else None
+
+    # Builds the result cache key of a batched work unit
+    #
+    def batch_cache_key(self, unit_key, week=None):
+        pixel, profile_ids = unit_key
+        report_start_date, report_end_date = week or (self.report_start_date, self.report_end_date)
+        return ResultCache.cache_key([pixel], [",".join(profile_ids)], report_start_date, report_end_date, 'batched')
+
+    # Reports every week bucket of the backfill dates for every pixel of the tickets live during them, all work units
+    # and weeks not in the result cache are run as a single query grouped per unit and week, finished weeks are cached
+    # where the weekly batched runs find them, the results are written to the output file and posted when requested
+    #
+    def backfill_manager(self, tickets):
+        weeks = TargetingAccuracyQuery.week_buckets(self.report_start_date, self.report_end_date)
+        self.logger(20, "\nBeginning the backfill of " + str(len(weeks)) + " week(s), " + self.report_start_date +
+                    " through " + self.report_end_date + ".\n")
+        units = {}
+        for ticket in tickets:
+            if not (ticket.start_date <= self.report_end_date and ticket.end_date >= self.report_start_date):
+                self.logger(30, "This ticket does not match the report-date criteria: " + ticket.key)
+            elif not (ticket.pixels and ticket.profile_ids and len(ticket.pixels) == len(ticket.profile_ids)):
+                self.logger(30, "This ticket is missing data required for report generation: " + ticket.key)
+            else:
+                for sub_ticket in self.split_ticket(ticket):
+                    units.setdefault(TargetingAccuracyQuery.unit_key(sub_ticket.pixels, sub_ticket.profile_ids),
+                                     []).append(sub_ticket)
+        results = {}
+        for unit_key in units:
+            for n, week in enumerate(weeks):
+                results[(unit_key, n)] = self.result_cache.get(self.batch_cache_key(unit_key, week))
+        unit_keys = [unit_key for unit_key in units if any(results[(unit_key, n)] is None for n in range(len(weeks)))]
+        if unit_keys and self.wait_ready():
+            query = TargetingAccuracyQuery()
+            # Backfills scan many weeks at once and always run on the default engine
+            engine = self.engine_router.default
+            qubole = qubole_manager.QuboleManager(("Backfill", str(len(unit_keys)) + " units",
+                                                   str(len(weeks)) + " weeks"), self.qubole_token, engine.cluster_label,
+                                                  query.backfill_weekly_query(unit_keys, weeks, engine=engine),
+                                                  poller=self.poller, metrics=self.metrics,
+                                                  retry_policy=self.retry_policy, engine=engine)
+            for row in qubole.stream_results():
+                results[(unit_keys[int(row[0])], int(row[1]))] = row[2:]
+            if qubole.command_id is not None:
+                for unit_key in unit_keys:
+                    for n, week in enumerate(weeks):
+                        # Weeks without impressions return no row, they are reported as zeros but never cached, as
+                        # their partitions may not have landed yet
+                        if results[(unit_key, n)] is None:
+                            results[(unit_key, n)] = self.zero_result
+                        elif week[1] < datetime.today().strftime("%Y%m%d"):
+                            self.result_cache.put(self.batch_cache_key(unit_key, week), results[(unit_key, n)],
+                                                  qubole.command_id)
+        # Each ticket gets the weeks its campaign was live during
+        ticket_weeks = {}
+        for unit_key, unit_tickets in units.items():
+            for ticket in unit_tickets:
+                for n, week in enumerate(weeks):
+                    if ticket.start_date <= week[1] and ticket.end_date >= week[0]:
+                        ticket_weeks.setdefault(ticket.key, []).append((ticket, week, results[(unit_key, n)]))
+        # The complete weeks that returned rows join the result history, seeding the trends of the weekly runs, the
+        # weeks not lined up with the weekly reporting window would skew them and are left out
+        for entries in ticket_weeks.values():
+            for ticket, week, result in entries:
+                if result is not self.zero_result and self.is_weekly_window(week) and \
+                        week[1] < datetime.today().strftime("%Y%m%d"):
+                    pixel, profile_ids = self.trend_key(ticket)
+                    self.history.record(ticket.key, pixel, profile_ids, week[0], week[1], result)
+        if self.backfill_output:
+            self.backfill_write(ticket_weeks)
+        if self.post_comments:
+            for ticket_key, entries in ticket_weeks.items():
+                if self.journal.is_posted(ticket_key, 'backfill'):
+                    continue
+                with self.metrics.stage('comment_post', ticket_key):
+                    self.jira_pars.add_backfill_comment(ticket_key, [(ticket.pixels, week, result)
+                                                                     for ticket, week, result in entries],
+                                                        self.report_start_date, self.report_end_date)
+                self.journal.record_posted(ticket_key, 'backfill')
+        self.logger(20, "\nFinished the backfill => " + str(sum(len(entries) for entries in ticket_weeks.values())) +
+                    " pixel week(s) over " + str(len(ticket_weeks)) + " ticket(s).\n")
+        return ticket_weeks
+
+    # Checks whether a backfill week lines up with the reporting window of the weekly runs => Friday through Thursday
+    #
+    @staticmethod
+    def is_weekly_window(week):
+        start = datetime.strptime(week[0], "%Y%m%d")
+        return start.weekday() == 4 and datetime.strptime(week[1], "%Y%m%d") - start == timedelta(days=6)
+
+    # Writes the backfill results to the output file, one row per ticket, pixel and week
+    #
+    def backfill_write(self, ticket_weeks):
+        try:
+            with open(self.backfill_output, 'w', newline='') as output_file:
+                writer = csv.writer(output_file)
+                writer.writerow(['TICKET', 'PIXEL', 'PROFILE_IDS', 'WEEK_START', 'WEEK_END', 'TOTAL_IMPRESSIONS',
+                                 'ELIGIBLE_INDIVIDUALS', 'IND_MATCH_PERCENT', 'MATCHED_INDIVIDUALS',
+                                 'TARGETING_ACCURACY'])
+                for ticket_key, entries in sorted(ticket_weeks.items()):
+                    for ticket, week, result in entries:
+                        writer.writerow([ticket_key, "".join(ticket.pixels[0]), "".join(ticket.profile_ids),
+                                         week[0], week[1]] + list(result or []))
+            self.logger(20, "The backfill results have been written to " + self.backfill_output)
+        except IOError as e:
+            self.logger(40, "The backfill results could not be written => {}".format(e))
+
+    # Adds the pixel, profile_ids and query results of a sub-ticket to the result store
+    #
+    def log_query_result(self, ticket, query_result):
+        self.results.record(ticket.key, "".join(ticket.pixels[0]), "".join(ticket.profile_ids), query_result)
 
     # Confirms output of query, posts results to Jira ticket, if required => post alerts for low TA% or no results
     #
     def comments_manager(self, ticket, result):
+        # Runs that only materialize results do not post to Jira
+        if not self.post_comments:
+            return
+        pixel = "".join(ticket.pixels[0]) if ticket.pixels else ""
+        profile_ids = "".join(ticket.profile_ids) if ticket.profile_ids else ""
         if result:
-            self.log_dict.setdefault(str((ticket.key, ticket.pixels[0])), []).append("The reporting period is " +
-                                                                                     self.report_start_date +
-                                                                                     " through "
-                                                                                     + self.report_end_date)
+            self.results.add_comment(ticket.key, pixel, profile_ids, "The reporting period is " +
+                                     self.report_start_date + " through " + self.report_end_date)
             self.jira_pars.add_report_comment(ticket.key, ticket.pixels, result, self.report_start_date,
                                               self.report_end_date)
-            self.log_dict.setdefault(str((ticket.key, ticket.pixels[0])), []).append("The query results have been "
-                                                                                     "added as a comment to Jira "
-                                                                                     "Ticket: " + str(ticket.key))
+            self.results.add_comment(ticket.key, pixel, profile_ids, "The query results have been added as a comment "
+                                                                     "to Jira Ticket: " + str(ticket.key))
             if float(result[4]) < self.ta_pct:
                 self.jira_pars.add_ta_alert_comment(ticket.key, ticket.pixels, str(self.ta_pct))
-                self.log_dict.setdefault(str((ticket.key, ticket.pixels[0])), []).append("A targeting accuracy alert "
-                                                                                         "has been added as a comment "
-                                                                                         "to Jira Ticket: "
-                                                                                         + str(ticket.key))
-        else:
-            self.jira_pars.add_ticket_data_alert_comment(ticket.key)
-            self.log_dict.setdefault(str((ticket.key, ticket.pixels[0])), []).append("A ticket alert has been added "
-                                                                                     "as a comment to Jira Ticket: "
-                                                                                     + str(ticket.key))
+                self.results.add_comment(ticket.key, pixel, profile_ids, "A targeting accuracy alert has been added "
+                                                                         "as a comment to Jira Ticket: " +
+                                         str(ticket.key))
+        elif not self.journal.is_posted(ticket.key, 'data_alert'):
+            with self.metrics.stage('comment_post', ticket.key):
+                self.jira_pars.add_ticket_data_alert_comment(ticket.key)
+            self.journal.record_posted(ticket.key, 'data_alert')
+            self.results.add_comment(ticket.key, pixel, profile_ids, "A ticket alert has been added as a comment to "
+                                                                     "Jira Ticket: " + str(ticket.key))
+
+    # Posts the results of all pixels on a ticket as a single comment with any low TA% alerts inline, called by the
+    # comment pipeline once every pixel of the ticket has finished
+    #
+    def ticket_comments_manager(self, ticket_key, entries):
+        if not self.post_comments:
+            return
+        # A resumed run does not post the report of this reporting window a second time
+        if self.journal.is_posted(ticket_key, 'report'):
+            self.logger(30, "The report was already posted to Jira Ticket: " + ticket_key)
+            return
+        entries = sorted(entries, key=lambda entry: entry[0].pixels[0])
+        if self.preview:
+            # Estimates are labeled as such and never raise a targeting accuracy alert
+            with self.metrics.stage('comment_post', ticket_key):
+                self.jira_pars.add_preview_comment(ticket_key, [(ticket.pixels, result) for ticket, result in entries],
+                                                   self.report_start_date, self.report_end_date,
+                                                   self.preview.sampling_fraction())
+            self.journal_report(ticket_key, entries)
+            for ticket, result in entries:
+                self.results.add_comment(ticket.key, "".join(ticket.pixels[0]), "".join(ticket.profile_ids),
+                                         "The preview estimates have been added as a comment to Jira Ticket: " +
+                                         str(ticket.key))
+            return
+        trends = self.result_trends(entries)
+        with self.metrics.stage('comment_post', ticket_key):
+            alert_pixels = self.jira_pars.add_ticket_report_comment(ticket_key, [(ticket.pixels, result)
+                                                                                 for ticket, result in entries],
+                                                                    self.report_start_date, self.report_end_date,
+                                                                    str(self.ta_pct),
+                                                                    [trends.get(self.trend_key(ticket))
+                                                                     for ticket, result in entries],
+                                                                    self.history.average_weeks)
+        self.journal_report(ticket_key, entries)
+        for ticket, result in entries:
+            pixel = "".join(ticket.pixels[0])
+            profile_ids = "".join(ticket.profile_ids)
+            self.results.add_comment(ticket.key, pixel, profile_ids, "The reporting period is " +
+                                     self.report_start_date + " through " + self.report_end_date)
+            self.results.add_comment(ticket.key, pixel, profile_ids, "The query results have been added as a comment "
+                                                                     "to Jira Ticket: " + str(ticket.key))
+            if ticket.pixels[0] in alert_pixels:
+                self.results.add_comment(ticket.key, pixel, profile_ids, "A targeting accuracy alert has been added "
+                                                                         "as a comment to Jira Ticket: " +
+                                         str(ticket.key))
+            if trends.get(self.trend_key(ticket), (None, None, False))[2]:
+                self.results.add_comment(ticket.key, pixel, profile_ids, "A targeting accuracy trend alert has been "
+                                                                         "added as a comment to Jira Ticket: " +
+                                         str(ticket.key))
+
+    # Journals the report of a ticket as posted once every pixel on it had a result, a report missing some is posted
+    # again by a resumed run, which recovers the results of the pixels that had none
+    #
+    def journal_report(self, ticket_key, entries):
+        if all(result for ticket, result in entries):
+            self.journal.record_posted(ticket_key, 'report')
+
+    # Looks up the trend of each pixel's targeting accuracy in the result history, then adds this window's results to
+    # it, returns the trends by pixel and profile ids => (change from the previous week, moving average, trend alert)
+    #
+    def result_trends(self, entries):
+        trends = {}
+        for ticket, result in entries:
+            if not result:
+                continue
+            pixel, profile_ids = self.trend_key(ticket)
+            trend = trends[(pixel, profile_ids)] = self.history.assess(pixel, profile_ids, self.report_end_date,
+                                                                      result[4])
+            if trend[2]:
+                self.logger(30, "The targeting accuracy of " + ticket.key + " pixel " + pixel + " fell to " +
+                            str(result[4]) + "%, well below its moving average of " + str(trend[1]) + "%.")
+            self.history.record(ticket.key, pixel, profile_ids, self.report_start_date, self.report_end_date, result)
+        return trends
+
+    # Builds the key of a sub-ticket's trend => (pixel, normalized profile ids)
+    #
+    @staticmethod
+    def trend_key(ticket):
+        return "".join(ticket.pixels[0]), ResultCache.normalized_profiles(ticket.profile_ids)
 
     # Returns a number enabling day of week adjustment for query run based on which weekend day the program is executed,
     # throws exception if execution is attempted on a non-weekend day (Monday - Thursday), exits program
@@ -208,35 +1035,27 @@ class TargetingAccuracyManager(object):
         self.logger(40, self.message)
         exit()
 
-    # Writes the contents of a log dictionary to the master log file in an easy-to-read ordered fashion
-    #
-    def log_write(self, obj):
-        if isinstance(obj, dict):
-            for k, v in obj.items():
-                self.logger(20, '\n\t\t\t\t\tTicket Number => ' + eval(k)[0])
-                self.logger(20, '     => Pixel: ' + "".join(v[0]))
-                if len(v[1]) is 1:
-                    self.logger(20, '     => Profile IDs: ' + "".join(v[1]))
-                else:
-                    self.logger(20, '     => Profile IDs: ' + ", ".join(v[1]))
-                self.logger(20, '     => Query Results: ' + ", ".join(v[2]))
-                self.logger(20, '     => Ticket Comments: ')
-                for i in range(3, len(v)):
-                    self.logger(20, '        ' + str(v[i]))
-
     # Checks the log directory for all files and removes those after a specified number of days
     #
     def purge_files(self, purge_days, purge_dir):
         try:
+            self.result_cache.purge(purge_days)
+            self.daily_store.purge(purge_days)
             self.logger(20, "\n\t\t\tPurge [" + str(purge_days) + "] days old files from [" + purge_dir + "] directory")
             now = time.time()
             for file_purge in os.listdir(purge_dir):
                 f_obs_path = os.path.join(purge_dir, file_purge)
-                if os.stat(f_obs_path).st_mtime < now - int(purge_days) * 86400 and f_obs_path.split(".")[-1] == "log":
+                if os.stat(f_obs_path).st_mtime < now - int(purge_days) * 86400 and \
+                        f_obs_path.split(".")[-1] in ["log", "jsonl", "json", "prom"]:
                     self.logger(20, "Purging File [" + f_obs_path + "] with timestamp [" +
                                 str(time.strptime(time.strftime('%Y-%m-%d %H:%M:%S',
                                     time.localtime(os.stat(f_obs_path).st_mtime)), "%Y-%m-%d %H:%M:%S")) + "]")
                     os.remove(f_obs_path)
+                # The lease directories of sharded runs
+                elif os.stat(f_obs_path).st_mtime < now - int(purge_days) * 86400 and \
+                        file_purge.endswith('_shards') and os.path.isdir(f_obs_path):
+                    self.logger(20, "Purging Shard Directory [" + f_obs_path + "]")
+                    shutil.rmtree(f_obs_path)
 
         except Exception as e:
             self.logger(40, str(e))
@@ -245,9 +1064,12 @@ class TargetingAccuracyManager(object):
 # Small class to hold a simplified version of the Jira issues for less program overhead
 #
 class Ticket(object):
+    __slots__ = ('key', 'pixels', 'profile_ids', 'start_date', 'end_date', 'query')
+
     def __init__(self, issue):
         self.key = issue.key
         self.pixels = issue.pixels
         self.profile_ids = issue.profile_ids
         self.start_date = issue.start_date
         self.end_date = issue.end_date
+        self.query = None
@@ -1,25 +1,36 @@
 # targeting_accuracy_query module
 # Module holds the class => TargetingAccuracyQuery - manages Hive query template
-# Class responsible to populate the query with Jira ticket sourced variables
+# Class responsible to populate the query with Jira ticket sourced variables, in the dialect of the engine it runs on
 #
+from query_engine import HiveEngine
+from datetime import datetime, timedelta
 
 
 class TargetingAccuracyQuery(object):
+    # Hive on Tez, the dialect of every query unless an engine is given
+    default_engine = HiveEngine(None)
 
-    @staticmethod
-    def weekly_query(pixel, profile_ids, report_start_date, report_end_date):
-        query = """
-        set hive.execution.engine = tez;
-        set fs.s3n.block.size=128000000;
-        set fs.s3a.block.size=128000000;
-        set hive.exec.reducers.max = 60;
+    # Returns the engine specific fragments of the query templates => the settings block, the null function and the
+    # two ratio expressions of the given counts
+    #
+    @classmethod
+    def dialect(cls, engine, total=None, eligible=None, matched=None):
+        engine = engine or cls.default_engine
+        fragments = {'settings': engine.header(), 'nvl': engine.null_function}
+        if total:
+            fragments.update({'ind_match_ratio': engine.ratio(eligible, total),
+                              'target_acc_ratio': engine.ratio(matched, total)})
+        return fragments
 
-        select 
+    @classmethod
+    def weekly_query(cls, pixel, profile_ids, report_start_date, report_end_date, engine=None):
+        query = """
+        {settings}select 
         x.TOTAL_IMPRESSIONS, 
         y.ELIGIBLE_INDIVIDUALS,
-        nvl((round((y.ELIGIBLE_INDIVIDUALS / x.TOTAL_IMPRESSIONS), 4) * 100), 0) as IND_MATCH_PERCENT,
+        {nvl}((round({ind_match_ratio}, 4) * 100), 0) as IND_MATCH_PERCENT,
         z.MATCHED_INDIVIDUALS, 
-        nvl((round((z.MATCHED_INDIVIDUALS / x.TOTAL_IMPRESSIONS), 4) * 100), 0) as TARGETING_ACCURACY
+        {nvl}((round({target_acc_ratio}, 4) * 100), 0) as TARGETING_ACCURACY
         from
         (select 1 as link, count(*) as TOTAL_IMPRESSIONS from core_digital.unified_impression
         where data_source_id_part = 6
@@ -59,5 +70,352 @@ class TargetingAccuracyQuery(object):
         on c.individual_id = b.individual_id
         ) z on x.link = z.link
         """.format(start_date=report_start_date, end_date=report_end_date,
-                   pixel=",".join(pixel), profile_ids=",".join(profile_ids))
+                   pixel=",".join(pixel), profile_ids=",".join(profile_ids),
+                   **cls.dialect(engine, "x.TOTAL_IMPRESSIONS", "y.ELIGIBLE_INDIVIDUALS", "z.MATCHED_INDIVIDUALS"))
+        return query
+
+    # Populates the weekly query in a single pass => one impression scan and one cookie join, the segment view is left
+    # joined and the three counts are conditionally aggregated, produces the same five columns as the weekly query
+    #
+    @classmethod
+    def single_pass_weekly_query(cls, pixel, profile_ids, report_start_date, report_end_date, engine=None):
+        query = """
+        {settings}select
+        {nvl}(sum(g.imps), 0) as TOTAL_IMPRESSIONS,
+        {nvl}(sum(g.imps * g.elig), 0) as ELIGIBLE_INDIVIDUALS,
+        {nvl}((round({ind_match_ratio}, 4) * 100), 0) as IND_MATCH_PERCENT,
+        {nvl}(sum(g.imps * g.segs), 0) as MATCHED_INDIVIDUALS,
+        {nvl}((round({target_acc_ratio}, 4) * 100), 0) as TARGETING_ACCURACY
+        from
+        (
+        select a.na_guid_id, a.imps, count(b.individual_id) as elig, sum({nvl}(c.segs, 0)) as segs
+        from
+        (select na_guid_id, count(*) as imps from core_digital.unified_impression
+        where data_source_id_part = 6
+        and source = 'save'
+        and pixel_id in ({pixel})
+        and data_date between {start_date} and {end_date}
+        group by na_guid_id
+        ) a
+        left join core_digital.best_matched_cookies_history_ind b
+        on a.na_guid_id = b.guid
+        left join
+        (select individual_id, count(*) as segs from core_shared.individual_segment_values_vw
+        where segment_id in ({profile_ids})
+        group by individual_id
+        ) c
+        on c.individual_id = b.individual_id
+        group by a.na_guid_id, a.imps
+        ) g
+        """.format(start_date=report_start_date, end_date=report_end_date,
+                   pixel=",".join(pixel), profile_ids=",".join(profile_ids),
+                   **cls.dialect(engine, "sum(g.imps)", "sum(g.imps * g.elig)", "sum(g.imps * g.segs)"))
+        return query
+
+    # Populates the daily partial query => the additive weekly counts broken out per data_date for the given days,
+    # returns one row per day with impressions => DATA_DATE and the TOTAL_IMPRESSIONS, ELIGIBLE_INDIVIDUALS and
+    # MATCHED_INDIVIDUALS counts of that day
+    #
+    @classmethod
+    def daily_partial_query(cls, pixel, profile_ids, data_dates, engine=None):
+        query = """
+        {settings}select
+        g.data_date as DATA_DATE,
+        {nvl}(sum(g.imps), 0) as TOTAL_IMPRESSIONS,
+        {nvl}(sum(g.imps * g.elig), 0) as ELIGIBLE_INDIVIDUALS,
+        {nvl}(sum(g.imps * g.segs), 0) as MATCHED_INDIVIDUALS
+        from
+        (
+        select a.data_date, a.na_guid_id, a.imps, count(b.individual_id) as elig, sum({nvl}(c.segs, 0)) as segs
+        from
+        (select data_date, na_guid_id, count(*) as imps from core_digital.unified_impression
+        where data_source_id_part = 6
+        and source = 'save'
+        and pixel_id in ({pixel})
+        and data_date in ({data_dates})
+        group by data_date, na_guid_id
+        ) a
+        left join core_digital.best_matched_cookies_history_ind b
+        on a.na_guid_id = b.guid
+        left join
+        (select individual_id, count(*) as segs from core_shared.individual_segment_values_vw
+        where segment_id in ({profile_ids})
+        group by individual_id
+        ) c
+        on c.individual_id = b.individual_id
+        group by a.data_date, a.na_guid_id, a.imps
+        ) g
+        group by g.data_date
+        """.format(data_dates=",".join(data_dates), pixel=",".join(pixel), profile_ids=",".join(profile_ids),
+                   **cls.dialect(engine))
+        return query
+
+    # Populates the daily partial query of several work units at once, the union of their days is scanned once and the
+    # counts are grouped per unit and day, returns one row per unit and day with impressions => unit index, DATA_DATE
+    # and the TOTAL_IMPRESSIONS, ELIGIBLE_INDIVIDUALS and MATCHED_INDIVIDUALS counts of that day
+    #
+    @classmethod
+    def batched_daily_partial_query(cls, units, data_dates, engine=None):
+        unit_values = [(n, pixel, profile_id) for n, (pixel, profile_ids) in enumerate(units)
+                       for profile_id in profile_ids]
+        pixels = sorted(set(pixel for pixel, profile_ids in units))
+        profile_ids = sorted(set(profile_id for pixel, segments in units for profile_id in segments))
+        query = """
+        {settings}with units as (
+        {units_table}
+        ),
+        imp as (
+        select pixel_id, data_date, na_guid_id, count(*) as imps from core_digital.unified_impression
+        where data_source_id_part = 6
+        and source = 'save'
+        and pixel_id in ({pixel})
+        and data_date in ({data_dates})
+        group by pixel_id, data_date, na_guid_id
+        ),
+        ib as (
+        select a.pixel_id, a.data_date, a.na_guid_id, a.imps, b.individual_id
+        from imp a
+        left join core_digital.best_matched_cookies_history_ind b
+        on a.na_guid_id = b.guid
+        ),
+        seg as (
+        select u.unit_id, c.individual_id, count(*) as segs
+        from units u
+        inner join
+        (select segment_id, individual_id from core_shared.individual_segment_values_vw
+        where segment_id in ({profile_ids})
+        ) c
+        on c.segment_id = u.segment_id
+        group by u.unit_id, c.individual_id
+        ),
+        g as (
+        select p.unit_id, ib.data_date, ib.na_guid_id, ib.imps, count(ib.individual_id) as elig,
+        sum({nvl}(s.segs, 0)) as segs
+        from (select distinct unit_id, pixel_id from units) p
+        inner join ib on ib.pixel_id = p.pixel_id
+        left join seg s on s.unit_id = p.unit_id and s.individual_id = ib.individual_id
+        group by p.unit_id, ib.data_date, ib.pixel_id, ib.na_guid_id, ib.imps
+        )
+        select
+        g.unit_id,
+        g.data_date as DATA_DATE,
+        {nvl}(sum(g.imps), 0) as TOTAL_IMPRESSIONS,
+        {nvl}(sum(g.imps * g.elig), 0) as ELIGIBLE_INDIVIDUALS,
+        {nvl}(sum(g.imps * g.segs), 0) as MATCHED_INDIVIDUALS
+        from g
+        group by g.unit_id, g.data_date
+        """.format(data_dates=",".join(data_dates),
+                   units_table=(engine or cls.default_engine).inline_table(unit_values,
+                                                                           ('unit_id', 'pixel_id', 'segment_id')),
+                   pixel=",".join(pixels), profile_ids=",".join(profile_ids), **cls.dialect(engine))
+        return query
+
+    # Populates the preview query => the additive weekly counts of a sample of the impressions, sampled by hashing the
+    # na_guid_id into buckets and keeping the first sampled_buckets of them, so the cookie join and segment lookup only
+    # touch the sampled cookies, returns one row per sampled bucket with impressions => BUCKET and the
+    # TOTAL_IMPRESSIONS, ELIGIBLE_INDIVIDUALS and MATCHED_INDIVIDUALS counts of that bucket
+    #
+    @classmethod
+    def preview_query(cls, pixel, profile_ids, report_start_date, report_end_date, sampled_buckets, buckets,
+                      engine=None):
+        query = """
+        {settings}select
+        g.bucket as BUCKET,
+        {nvl}(sum(g.imps), 0) as TOTAL_IMPRESSIONS,
+        {nvl}(sum(g.imps * g.elig), 0) as ELIGIBLE_INDIVIDUALS,
+        {nvl}(sum(g.imps * g.segs), 0) as MATCHED_INDIVIDUALS
+        from
+        (
+        select a.bucket, a.na_guid_id, a.imps, count(b.individual_id) as elig, sum({nvl}(c.segs, 0)) as segs
+        from
+        (select na_guid_id, {bucket} as bucket, count(*) as imps from core_digital.unified_impression
+        where data_source_id_part = 6
+        and source = 'save'
+        and pixel_id in ({pixel})
+        and data_date between {start_date} and {end_date}
+        and {bucket} < {sampled_buckets}
+        group by na_guid_id, {bucket}
+        ) a
+        left join core_digital.best_matched_cookies_history_ind b
+        on a.na_guid_id = b.guid
+        left join
+        (select individual_id, count(*) as segs from core_shared.individual_segment_values_vw
+        where segment_id in ({profile_ids})
+        group by individual_id
+        ) c
+        on c.individual_id = b.individual_id
+        group by a.bucket, a.na_guid_id, a.imps
+        ) g
+        group by g.bucket
+        """.format(start_date=report_start_date, end_date=report_end_date, sampled_buckets=sampled_buckets,
+                   bucket=(engine or cls.default_engine).bucket("na_guid_id", buckets),
+                   pixel=",".join(pixel), profile_ids=",".join(profile_ids), **cls.dialect(engine))
+        return query
+
+    # Returns the weekly query generator for the selected query variant => standard or single_pass, raises ValueError
+    # for any other
+    #
+    @classmethod
+    def weekly_query_variant(cls, variant):
+        variants = {'standard': cls.weekly_query, 'single_pass': cls.single_pass_weekly_query}
+        if variant not in variants:
+            raise ValueError("unknown query variant '" + str(variant) + "', expected one of " +
+                             ", ".join(sorted(variants)))
+        return variants[variant]
+
+    # Normalizes a single-pixel work unit into its batch key => (pixel, sorted tuple of unique profile ids), work units
+    # sharing a key share a single row of the batched query output
+    #
+    @staticmethod
+    def unit_key(pixel, profile_ids):
+        segments = ",".join(profile_ids).replace(' ', '').split(',')
+        return "".join(pixel), tuple(sorted(set(segment for segment in segments if segment)))
+
+    # Populates a single query covering every work unit of the run, the week of impressions is scanned once and the
+    # counts are grouped per unit, returns one row per unit => unit index followed by the five weekly report columns
+    #
+    @classmethod
+    def batched_weekly_query(cls, units, report_start_date, report_end_date, engine=None):
+        unit_values = [(n, pixel, profile_id) for n, (pixel, profile_ids) in enumerate(units)
+                       for profile_id in profile_ids]
+        pixels = sorted(set(pixel for pixel, profile_ids in units))
+        profile_ids = sorted(set(profile_id for pixel, segments in units for profile_id in segments))
+        query = """
+        {settings}with units as (
+        {units_table}
+        ),
+        imp as (
+        select pixel_id, na_guid_id, count(*) as imps from core_digital.unified_impression
+        where data_source_id_part = 6
+        and source = 'save'
+        and pixel_id in ({pixel})
+        and data_date between {start_date} and {end_date}
+        group by pixel_id, na_guid_id
+        ),
+        ib as (
+        select a.pixel_id, a.na_guid_id, a.imps, b.individual_id
+        from imp a
+        left join core_digital.best_matched_cookies_history_ind b
+        on a.na_guid_id = b.guid
+        ),
+        seg as (
+        select u.unit_id, c.individual_id, count(*) as segs
+        from units u
+        inner join
+        (select segment_id, individual_id from core_shared.individual_segment_values_vw
+        where segment_id in ({profile_ids})
+        ) c
+        on c.segment_id = u.segment_id
+        group by u.unit_id, c.individual_id
+        ),
+        g as (
+        select p.unit_id, ib.na_guid_id, ib.imps, count(ib.individual_id) as elig, sum({nvl}(s.segs, 0)) as segs
+        from (select distinct unit_id, pixel_id from units) p
+        left join ib on ib.pixel_id = p.pixel_id
+        left join seg s on s.unit_id = p.unit_id and s.individual_id = ib.individual_id
+        group by p.unit_id, ib.pixel_id, ib.na_guid_id, ib.imps
+        )
+        select
+        g.unit_id,
+        {nvl}(sum(g.imps), 0) as TOTAL_IMPRESSIONS,
+        {nvl}(sum(g.imps * g.elig), 0) as ELIGIBLE_INDIVIDUALS,
+        {nvl}((round({ind_match_ratio}, 4) * 100), 0) as IND_MATCH_PERCENT,
+        {nvl}(sum(g.imps * g.segs), 0) as MATCHED_INDIVIDUALS,
+        {nvl}((round({target_acc_ratio}, 4) * 100), 0) as TARGETING_ACCURACY
+        from g
+        group by g.unit_id
+        """.format(start_date=report_start_date, end_date=report_end_date,
+                   units_table=(engine or cls.default_engine).inline_table(unit_values,
+                                                                           ('unit_id', 'pixel_id', 'segment_id')),
+                   pixel=",".join(pixels), profile_ids=",".join(profile_ids),
+                   **cls.dialect(engine, "sum(g.imps)", "sum(g.imps * g.elig)", "sum(g.imps * g.segs)"))
+        return query
+
+    # Splits a backfill date range into consecutive seven-day week buckets starting on its first day, the last bucket
+    # is cut short at the end of the range, returns a list of (week start date, week end date) in the format of %Y%m%d
+    #
+    @staticmethod
+    def week_buckets(start_date, end_date):
+        start = datetime.strptime(start_date, "%Y%m%d")
+        end = datetime.strptime(end_date, "%Y%m%d")
+        weeks = []
+        while start <= end:
+            week_end = min(start + timedelta(days=6), end)
+            weeks.append((start.strftime("%Y%m%d"), week_end.strftime("%Y%m%d")))
+            start = week_end + timedelta(days=1)
+        return weeks
+
+    # Populates a single query covering every work unit over every week bucket of a backfill, the whole date range of
+    # impressions is scanned once and the counts are grouped per unit and week, returns one row per unit and week with
+    # impressions => unit index, week index and the five weekly report columns
+    #
+    @classmethod
+    def backfill_weekly_query(cls, units, weeks, engine=None):
+        engine = engine or cls.default_engine
+        unit_values = [(n, pixel, profile_id) for n, (pixel, profile_ids) in enumerate(units)
+                       for profile_id in profile_ids]
+        week_values = []
+        for n, (week_start, week_end) in enumerate(weeks):
+            day = datetime.strptime(week_start, "%Y%m%d")
+            while day <= datetime.strptime(week_end, "%Y%m%d"):
+                week_values.append((day.strftime("%Y%m%d"), n))
+                day += timedelta(days=1)
+        pixels = sorted(set(pixel for pixel, profile_ids in units))
+        profile_ids = sorted(set(profile_id for pixel, segments in units for profile_id in segments))
+        query = """
+        {settings}with units as (
+        {units_table}
+        ),
+        weeks as (
+        {weeks_table}
+        ),
+        imp as (
+        select i.pixel_id, w.week_id, i.na_guid_id, count(*) as imps from core_digital.unified_impression i
+        inner join weeks w
+        on i.data_date = w.data_date
+        where i.data_source_id_part = 6
+        and i.source = 'save'
+        and i.pixel_id in ({pixel})
+        and i.data_date between {start_date} and {end_date}
+        group by i.pixel_id, w.week_id, i.na_guid_id
+        ),
+        ib as (
+        select a.pixel_id, a.week_id, a.na_guid_id, a.imps, b.individual_id
+        from imp a
+        left join core_digital.best_matched_cookies_history_ind b
+        on a.na_guid_id = b.guid
+        ),
+        seg as (
+        select u.unit_id, c.individual_id, count(*) as segs
+        from units u
+        inner join
+        (select segment_id, individual_id from core_shared.individual_segment_values_vw
+        where segment_id in ({profile_ids})
+        ) c
+        on c.segment_id = u.segment_id
+        group by u.unit_id, c.individual_id
+        ),
+        g as (
+        select p.unit_id, ib.week_id, ib.na_guid_id, ib.imps, count(ib.individual_id) as elig,
+        sum({nvl}(s.segs, 0)) as segs
+        from (select distinct unit_id, pixel_id from units) p
+        inner join ib on ib.pixel_id = p.pixel_id
+        left join seg s on s.unit_id = p.unit_id and s.individual_id = ib.individual_id
+        group by p.unit_id, ib.week_id, ib.pixel_id, ib.na_guid_id, ib.imps
+        )
+        select
+        g.unit_id,
+        g.week_id,
+        {nvl}(sum(g.imps), 0) as TOTAL_IMPRESSIONS,
+        {nvl}(sum(g.imps * g.elig), 0) as ELIGIBLE_INDIVIDUALS,
+        {nvl}((round({ind_match_ratio}, 4) * 100), 0) as IND_MATCH_PERCENT,
+        {nvl}(sum(g.imps * g.segs), 0) as MATCHED_INDIVIDUALS,
+        {nvl}((round({target_acc_ratio}, 4) * 100), 0) as TARGETING_ACCURACY
+        from g
+        group by g.unit_id, g.week_id
+        """.format(start_date=weeks[0][0], end_date=weeks[-1][1],
+                   units_table=engine.inline_table(unit_values, ('unit_id', 'pixel_id', 'segment_id')),
+                   weeks_table=engine.inline_table(week_values, ('data_date', 'week_id')),
+                   pixel=",".join(pixels), profile_ids=",".join(profile_ids),
+                   **cls.dialect(engine, "sum(g.imps)", "sum(g.imps * g.elig)", "sum(g.imps * g.segs)"))
         return query
@@ -0,0 +1,55 @@
+# conftest module
+# Puts the application modules, which import each other by module name as main.py runs them, on the path of the tests,
+# and provides the small SQLite copy of the source tables the queries are run against, whose SQL the Presto dialect of
+# the query templates stays within
+#
+import os
+import sys
+import sqlite3
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from query_engine import PrestoEngine
+
+# Impressions => (data_source_id_part, source, pixel_id, data_date, na_guid_id)
+IMPRESSIONS = [(6, 'save', 100, 20200101, 'g1'), (6, 'save', 100, 20200101, 'g1'), (6, 'save', 100, 20200102, 'g2'),
+               (6, 'save', 100, 20200103, 'g3'), (6, 'save', 100, 20200107, 'g4'), (6, 'save', 100, 20200105, 'g5'),
+               (6, 'save', 200, 20200102, 'g1'), (6, 'view', 100, 20200102, 'g1'), (7, 'save', 100, 20200102, 'g1'),
+               (6, 'save', 100, 20200108, 'g1'), (6, 'save', 100, 20191231, 'g2')]
+# Cookie matches => (guid, individual_id), g3 matches two individuals and g4 none
+COOKIES = [('g1', 1), ('g2', 2), ('g3', 3), ('g3', 4), ('g5', 5)]
+# Segments => (individual_id, segment_id)
+SEGMENTS = [(1, 11), (1, 12), (2, 11), (3, 12), (4, 13), (5, 14), (9, 11)]
+
+
+class SqliteEngine(PrestoEngine):
+    # SQLite takes no column list on a values table alias
+    #
+    @staticmethod
+    def inline_table(rows, columns):
+        return " union all ".join("select " + ", ".join(str(value) + " as " + column
+                                                        for value, column in zip(row, columns)) for row in rows)
+
+
+@pytest.fixture
+def sqlite_engine():
+    return SqliteEngine
+
+
+@pytest.fixture
+def connection():
+    # Shared by the worker threads of the manager tests, which serialize their queries
+    connection = sqlite3.connect(':memory:', check_same_thread=False)
+    connection.execute("attach database ':memory:' as core_digital")
+    connection.execute("attach database ':memory:' as core_shared")
+    connection.execute("create table core_digital.unified_impression (data_source_id_part integer, source text, "
+                       "pixel_id integer, data_date integer, na_guid_id text)")
+    connection.execute("create table core_digital.best_matched_cookies_history_ind (guid text, individual_id integer)")
+    connection.execute("create table core_shared.individual_segment_values_vw (individual_id integer, "
+                       "segment_id integer)")
+    connection.executemany("insert into core_digital.unified_impression values (?, ?, ?, ?, ?)", IMPRESSIONS)
+    connection.executemany("insert into core_digital.best_matched_cookies_history_ind values (?, ?)", COOKIES)
+    connection.executemany("insert into core_shared.individual_segment_values_vw values (?, ?)", SEGMENTS)
+    yield connection
+    connection.close()
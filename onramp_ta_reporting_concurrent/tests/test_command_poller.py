@@ -0,0 +1,72 @@
+# test_command_poller module
+# Tests of CommandPoller => commands are resolved once seen finished, and stop and cancel_all leave no future unresolved
+# even for the command the polling thread is checking at the time
+#
+import threading
+from command_poller import CommandPoller
+
+
+class FakeCommand(object):
+    # Status of every command id, a command whose id is in blocked waits in find until released
+    statuses = {}
+    blocked = {}
+    cancelled = []
+
+    def __init__(self, command_id, status):
+        self.id = command_id
+        self.status = status
+
+    @classmethod
+    def find(cls, command_id):
+        if command_id in cls.blocked:
+            cls.blocked[command_id][0].set()
+            cls.blocked[command_id][1].wait(5)
+        return cls(command_id, cls.statuses[command_id])
+
+    @staticmethod
+    def is_done(status):
+        return status in ('done', 'error', 'cancelled')
+
+    @staticmethod
+    def is_success(status):
+        return status == 'done'
+
+    @classmethod
+    def cancel_id(cls, command_id):
+        cls.cancelled.append(command_id)
+
+
+def test_finished_command_resolves_its_future():
+    poller = CommandPoller(0.01, 0.05)
+    FakeCommand.statuses['c1'] = 'running'
+    future = poller.watch('c1', FakeCommand)
+    FakeCommand.statuses['c1'] = 'done'
+    assert future.result(timeout=5).status == 'done'
+    assert poller.in_flight() == 0
+    poller.stop()
+
+
+def test_stop_cancels_the_command_being_checked():
+    poller = CommandPoller(0.01, 0.05)
+    FakeCommand.statuses['c2'] = 'running'
+    polled, release = threading.Event(), threading.Event()
+    FakeCommand.blocked['c2'] = (polled, release)
+    future = poller.watch('c2', FakeCommand)
+    assert polled.wait(5)
+    stopper = threading.Thread(target=poller.stop)
+    stopper.start()
+    release.set()
+    stopper.join(5)
+    assert future.cancelled()
+    assert poller.in_flight() == 0
+
+
+def test_cancel_all_cancels_tracked_commands_and_later_ones():
+    poller = CommandPoller(10, 10)
+    FakeCommand.statuses['c3'] = 'running'
+    future = poller.watch('c3', FakeCommand)
+    assert poller.cancel_all() == 1
+    assert future.cancelled() and 'c3' in FakeCommand.cancelled
+    assert poller.watch('c4', FakeCommand).cancelled()
+    assert 'c4' in FakeCommand.cancelled
+    poller.stop()
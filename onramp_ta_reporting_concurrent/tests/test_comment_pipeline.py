@@ -0,0 +1,55 @@
+# test_comment_pipeline module
+# Tests of CommentPipeline => a ticket is posted once all of its pixel results have arrived, incomplete tickets are
+# posted on close, and a failed post does not stop the posters
+#
+import threading
+from comment_pipeline import CommentPipeline
+
+
+class SubTicket(object):
+    def __init__(self, key, pixel):
+        self.key = key
+        self.pixels = [pixel]
+
+
+class Recorder(object):
+    def __init__(self, fail=()):
+        self.posted = {}
+        self.fail = set(fail)
+        self.lock = threading.Lock()
+
+    def post(self, ticket_key, entries):
+        if ticket_key in self.fail:
+            raise RuntimeError("Jira is down")
+        with self.lock:
+            self.posted[ticket_key] = sorted((ticket.pixels[0], result) for ticket, result in entries)
+
+
+def test_ticket_is_posted_once_complete():
+    recorder = Recorder()
+    pipeline = CommentPipeline(recorder.post, posters=2)
+    pipeline.expect('CAM-1', 2)
+    pipeline.add(SubTicket('CAM-1', '100'), 'r100')
+    pipeline.add(SubTicket('CAM-2', '300'), 'r300')
+    pipeline.add(SubTicket('CAM-1', '200'), 'r200')
+    pipeline.close()
+    assert recorder.posted == {'CAM-1': [('100', 'r100'), ('200', 'r200')], 'CAM-2': [('300', 'r300')]}
+
+
+def test_incomplete_ticket_is_posted_on_close():
+    recorder = Recorder()
+    pipeline = CommentPipeline(recorder.post, posters=1)
+    pipeline.expect('CAM-1', 3)
+    pipeline.add(SubTicket('CAM-1', '100'), None)
+    assert recorder.posted == {}
+    pipeline.close()
+    assert recorder.posted == {'CAM-1': [('100', None)]}
+
+
+def test_failed_post_does_not_stop_the_posters():
+    recorder = Recorder(fail=['CAM-1'])
+    pipeline = CommentPipeline(recorder.post, posters=1)
+    pipeline.add(SubTicket('CAM-1', '100'), 'r100')
+    pipeline.add(SubTicket('CAM-2', '200'), 'r200')
+    pipeline.close()
+    assert recorder.posted == {'CAM-2': [('200', 'r200')]}
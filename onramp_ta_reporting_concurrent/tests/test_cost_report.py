@@ -0,0 +1,80 @@
+# test_cost_report module
+# Tests of CostReport => the table scans are read out of Hive EXPLAIN plans, and the planned queries are ranked with
+# the outliers flagged
+#
+from cost_report import CostReport
+
+PLAN = """STAGE DEPENDENCIES:
+  Stage-1 is a root stage
+  Stage-0 depends on stages: Stage-1
+
+STAGE PLANS:
+  Stage: Stage-1
+    Map Reduce
+      Map Operator Tree:
+          TableScan
+            alias: i
+            filterExpr: ((data_source_id_part = 6) and (source = 'save')) (type: boolean)
+            Statistics: Num rows: 120000 Data size: 4800000 Basic stats: COMPLETE Column stats: NONE
+            Filter Operator
+              predicate: (pixel_id) IN (100, 200) (type: boolean)
+              Statistics: Num rows: 60000 Data size: 2400000 Basic stats: COMPLETE Column stats: NONE
+          TableScan
+            alias: c
+            Statistics: Num rows: 5000 Data size: 150000 Basic stats: PARTIAL Column stats: NONE
+      Reduce Operator Tree:
+        Join Operator
+          Statistics: Num rows: 66000 Data size: 2640000 Basic stats: COMPLETE Column stats: NONE
+"""
+
+
+def plan(rows, size):
+    return "TableScan\n  alias: i\n  Statistics: Num rows: {} Data size: {} Basic stats: COMPLETE".format(rows, size)
+
+
+def test_table_scans():
+    assert CostReport.table_scans(PLAN) == [('i', 120000, 4800000, True), ('c', 5000, 150000, False)]
+    assert CostReport.table_scans("") == []
+    # Statistics outside a table scan are not scans
+    assert CostReport.table_scans("Join Operator\n  Statistics: Num rows: 5 Data size: 50 Basic stats: COMPLETE") == []
+
+
+def test_add_sums_the_scans():
+    report = CostReport(4)
+    report.add('weekly 100,200', ['CAM-2', 'CAM-1', 'CAM-2'], PLAN)
+    entry = report.entries[0]
+    assert entry['tickets'] == ['CAM-1', 'CAM-2']
+    assert (entry['rows'], entry['bytes'], entry['complete']) == (125000, 4950000, False)
+    assert entry['tables'] == ['c', 'i']
+
+
+def test_lines_rank_and_flag():
+    report = CostReport(2, top=2)
+    report.add('small', ['CAM-1'], plan(10, 1000000000))
+    report.add('medium', ['CAM-2'], plan(20, 2000000000))
+    report.add('huge', ['CAM-3'], plan(500, 50000000000))
+    report.add('unexplained', ['CAM-4'])
+    report.add('cached', ['CAM-5'], cached=True)
+    lines = report.lines()
+    assert lines[1].split()[:2] == ['1', '50.00']
+    assert 'huge => CAM-3 [OUTLIER 25.0x median]' in lines[1]
+    assert 'medium => CAM-2' in lines[2] and 'small => CAM-1' in lines[3]
+    assert lines[4].endswith('unexplained => CAM-4 [no plan]')
+    assert lines[5].startswith('Total => 4 queries scanning 53.00 GB and 530 rows, 1 served from the result cache, '
+                               'at most 2 running at once')
+    assert lines[6] == 'Top offenders => huge, medium'
+
+
+def test_plan_without_table_scans_is_flagged():
+    presto_plan = "Fragment 0 [SINGLE]\n    Output layout: [count]\n" \
+                  "    - ScanFilterProject[table = hive:core_digital:unified_impression]\n" \
+                  "            Estimates: {rows: 120000 (4.8MB)}"
+    assert CostReport.table_scans(presto_plan) == []
+    report = CostReport(4)
+    report.add('hive', ['CAM-1'], plan(10, 1000000000))
+    report.add('presto', ['CAM-2'], presto_plan)
+    entry = report.entries[1]
+    assert not entry['explained'] and not entry['complete']
+    lines = report.lines()
+    assert lines[2].endswith('presto => CAM-2 [no plan]')
+    assert lines[3].startswith('Total => 2 queries scanning 1.00 GB and 10 rows')
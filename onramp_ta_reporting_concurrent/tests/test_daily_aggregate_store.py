@@ -0,0 +1,31 @@
+# test_daily_aggregate_store module
+# Tests of DailyAggregateStore => which days are stored or still missing, and the weekly columns summed from them
+#
+from daily_aggregate_store import DailyAggregateStore
+
+UNIT = ('100', ('11', '12'))
+
+
+def test_returned_and_confirmed_days_are_stored(tmp_path):
+    store = DailyAggregateStore(str(tmp_path / 'cache.db'))
+    days = store.window_days('20200101', '20200107')
+    assert len(days) == 7 and days[0] == '20200101' and days[-1] == '20200107'
+    store.put_days(UNIT, days[:4], [('20200101', 10, 8, 4), ('20200102', 20, 10, 5)], 42,
+                   confirmed_days={'20200103'})
+    # 20200104 returned no row and its partition was not confirmed complete, so it is queried again
+    assert store.missing_days(UNIT, '20200101', '20200107') == ['20200104', '20200105', '20200106', '20200107']
+    assert store.missing_days(('100', ('11',)), '20200101', '20200102') == ['20200101', '20200102']
+    store.close()
+
+
+def test_window_result_sums_the_stored_days(tmp_path):
+    store = DailyAggregateStore(str(tmp_path / 'cache.db'))
+    store.put_days(UNIT, ['20200101', '20200102', '20200108'], [('20200101', 10, 8, 4), ('20200102', 20, 10, 5),
+                                                                ('20200108', 99, 99, 99)])
+    assert store.window_result(UNIT, '20200101', '20200107') == ['30', '18', '60.0', '9', '30.0']
+    assert store.window_result(('200', ('11',)), '20200101', '20200107') == ['0', '0', '0.0', '0', '0.0']
+
+
+def test_report_columns_round_half_up_like_hive():
+    # 1 / 3 => 0.3333 and 2 / 3 => 0.6667
+    assert DailyAggregateStore.report_columns(3, 1, 2) == ['3', '1', '33.33', '2', '66.67']
@@ -0,0 +1,88 @@
+# test_jira_client_pool module
+# Tests of JiraClientPool => which failed reads and writes are retried, a write Jira may have applied never is
+#
+import pytest
+
+pytest.importorskip('jira')
+import requests
+from urllib3.exceptions import MaxRetryError, NewConnectionError, ProtocolError
+from jira import JIRAError
+import jira_client_pool
+from jira_client_pool import JiraClientPool
+
+
+class FakeClient(object):
+    def __init__(self, failures):
+        self.failures = list(failures)
+        self.calls = 0
+
+    def add_comment(self, issue=None, body=None):
+        self.calls += 1
+        if self.failures:
+            raise self.failures.pop(0)
+        return issue
+
+    def search_issues(self, jql, **kwargs):
+        return self.add_comment(issue=jql)
+
+
+def client_pool(monkeypatch, failures):
+    client = FakeClient(failures)
+    monkeypatch.setattr(JiraClientPool, 'new_client', lambda self: client)
+    return JiraClientPool('https://jira.example.com', ('user', 'token'), rate=1000, burst=10, max_retries=2,
+                          backoff=0.001), client
+
+
+def refused():
+    return requests.exceptions.ConnectionError(MaxRetryError(None, '/rest/api/2/issue/CAM-1/comment',
+                                                             NewConnectionError(None, 'Connection refused')))
+
+
+def dropped():
+    return requests.exceptions.ConnectionError(ProtocolError('Connection aborted.'))
+
+
+def test_reads_are_retried_on_any_retryable_failure(monkeypatch):
+    pool, client = client_pool(monkeypatch, [JIRAError(status_code=503), dropped()])
+    assert pool.call('search_issues', 'project = CAM') == 'project = CAM'
+    assert client.calls == 3
+
+
+def test_timeouts_are_retried_up_to_max_retries(monkeypatch):
+    pool, client = client_pool(monkeypatch, [requests.exceptions.ReadTimeout('slow')] * 3)
+    with pytest.raises(requests.exceptions.Timeout):
+        pool.call('search_issues', 'project = CAM')
+    assert client.calls == 3
+
+
+def test_writes_are_retried_when_throttled_or_never_sent(monkeypatch):
+    pool, client = client_pool(monkeypatch, [JIRAError(status_code=429), refused()])
+    assert pool.call('add_comment', issue='CAM-1', body='report') == 'CAM-1'
+    assert client.calls == 3
+    pool, client = client_pool(monkeypatch, [requests.exceptions.ConnectTimeout('no connection')])
+    assert pool.call('add_comment', issue='CAM-1', body='report') == 'CAM-1'
+    assert client.calls == 2
+
+
+@pytest.mark.parametrize('failure', [lambda: JIRAError(status_code=502), dropped,
+                                     lambda: requests.exceptions.ReadTimeout('slow')],
+                         ids=['server error', 'dropped', 'read timeout'])
+def test_writes_jira_may_have_applied_are_not_retried(monkeypatch, failure):
+    pool, client = client_pool(monkeypatch, [failure()])
+    with pytest.raises((JIRAError, requests.exceptions.RequestException)):
+        pool.call('add_comment', issue='CAM-1', body='report')
+    assert client.calls == 1
+
+
+def test_client_errors_are_not_retried(monkeypatch):
+    pool, client = client_pool(monkeypatch, [JIRAError(status_code=400)])
+    with pytest.raises(JIRAError):
+        pool.call('search_issues', 'project = CAM')
+    assert client.calls == 1
+
+
+def test_session_retries_are_turned_off(monkeypatch):
+    opened = []
+    monkeypatch.setattr(jira_client_pool, 'JIRA', lambda url, **kwargs: opened.append(kwargs) or FakeClient([]))
+    JiraClientPool('https://jira.example.com', ('user', 'token'))
+    assert opened == [{'basic_auth': ('user', 'token'), 'max_retries': 0}]
@@ -0,0 +1,106 @@
+# test_partition_readiness module
+# Tests of PartitionReadiness => the checks of the window's partitions, row counts and cookie snapshot against a canned
+# metastore, and the backoff of a window held back
+#
+import re
+from datetime import datetime, timedelta
+from partition_readiness import PartitionReadiness
+
+
+def dates(start_date, count):
+    start = datetime.strptime(start_date, "%Y%m%d")
+    return [(start + timedelta(days=n)).strftime("%Y%m%d") for n in range(count)]
+
+
+class FakeReadiness(PartitionReadiness):
+    # Answers the metastore commands from the partitions, numRows statistics and cookie snapshots it is given, a
+    # metastore that is down answers None
+    #
+    def __init__(self, partitions, row_counts=None, snapshots=None, down=False, **kwargs):
+        PartitionReadiness.__init__(self, 'token', 'cluster', **kwargs)
+        self.partitions = partitions
+        self.counts = row_counts or {}
+        self.snapshots = snapshots if snapshots is not None else ['20200107']
+        self.down = down
+        self.commands = 0
+
+    def metastore(self, statements):
+        self.commands += 1
+        if self.down:
+            return None
+        if statements.startswith("show partitions " + self.impression_table):
+            return [("data_source_id_part=6/data_date=" + day,) for day in sorted(self.partitions)]
+        if statements.startswith("show partitions " + self.cookie_table):
+            return [("snapshot_date=" + day,) for day in self.snapshots]
+        return [("", "numRows", " " + str(self.counts[day]) + " ")
+                for day in re.findall(r'data_date=(\d{8})', statements) if day in self.counts]
+
+
+WEEK = dates('20200101', 7)
+BASELINE = dates('20191225', 7)
+
+
+def test_ready_window_is_confirmed():
+    readiness = FakeReadiness(set(BASELINE + WEEK), dict((day, 1000) for day in BASELINE + WEEK))
+    assert readiness.check('20200101', '20200107') is None
+    assert readiness.confirmed_days('20200101', '20200107') == set(WEEK)
+
+
+def test_missing_partition():
+    readiness = FakeReadiness(set(BASELINE + WEEK) - {'20200103'})
+    assert readiness.check('20200101', '20200107') == "missing core_digital.unified_impression partition(s) 20200103"
+
+
+def test_day_still_loading():
+    counts = dict((day, 1000) for day in BASELINE + WEEK)
+    counts['20200107'] = 400
+    readiness = FakeReadiness(set(BASELINE + WEEK), counts)
+    assert readiness.check('20200101', '20200107') == \
+        "core_digital.unified_impression partition(s) 20200107 (400 rows) below 500 rows, still loading"
+
+
+def test_missing_statistics_skip_the_row_counts():
+    counts = dict((day, 1000) for day in BASELINE + WEEK)
+    del counts['20200104']
+    readiness = FakeReadiness(set(BASELINE + WEEK), counts)
+    assert readiness.check('20200101', '20200107') is None
+    # Days whose row counts were not checked are not confirmed
+    assert readiness.confirmed_days('20200101', '20200107') == set()
+
+
+def test_stale_cookie_snapshot():
+    readiness = FakeReadiness(set(WEEK), snapshots=['20200104', '20200105'])
+    assert readiness.check('20200101', '20200107') == \
+        "latest core_digital.best_matched_cookies_history_ind snapshot is 20200105"
+    assert FakeReadiness(set(WEEK), snapshots=['20200106']).check('20200101', '20200107') is None
+
+
+def test_metastore_down_fails_open():
+    readiness = FakeReadiness(set(), down=True)
+    assert readiness.check('20200101', '20200107') is None
+    assert readiness.confirmed_days('20200101', '20200107') == set()
+
+
+def test_status_holds_back_until_the_recheck():
+    readiness = FakeReadiness(set(WEEK[:-1]), recheck_delay=600, recheck_delay_max=3600)
+    assert readiness.status('20200101', '20200107') == 'waiting'
+    commands = readiness.commands
+    # The metastore is not asked again before the backoff delay has passed
+    readiness.partitions.add('20200107')
+    assert readiness.status('20200101', '20200107') == 'waiting'
+    assert readiness.commands == commands
+    assert 0 < readiness.retry_in('20200101', '20200107') <= 600
+    assert [readiness.delay(checks) for checks in range(4)] == [600, 1200, 2400, 3600]
+
+
+def test_status_rechecks_and_expires():
+    readiness = FakeReadiness(set(WEEK[:-1]), recheck_delay=0)
+    assert readiness.status('20200101', '20200107') == 'waiting'
+    readiness.partitions.add('20200107')
+    assert readiness.status('20200101', '20200107') == 'ready'
+    # The outcome of a window is kept once ready
+    readiness.partitions.clear()
+    assert readiness.status('20200101', '20200107') == 'ready'
+    expiring = FakeReadiness(set(), recheck_delay=0, max_wait=0)
+    assert expiring.status('20200101', '20200107') == 'waiting'
+    assert expiring.status('20200101', '20200107') == 'expired'
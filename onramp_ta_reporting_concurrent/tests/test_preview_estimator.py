@@ -0,0 +1,50 @@
+# test_preview_estimator module
+# Tests of PreviewEstimator => the sampled bucket counts are scaled up to the report columns, and the margins of error
+# follow the spread of the counts between the sampled buckets
+#
+import pytest
+from preview_estimator import PreviewEstimator
+
+
+def test_sampled_buckets():
+    assert PreviewEstimator(0.1, 1000).sampled_buckets == 100
+    assert PreviewEstimator(0.1, 1000).sampling_fraction() == 0.1
+    # At least one and at most every bucket is sampled
+    assert PreviewEstimator(0.0001, 1000).sampled_buckets == 1
+    assert PreviewEstimator(2, 1000).sampled_buckets == 1000
+
+
+def test_nothing_sampled():
+    assert PreviewEstimator(0.1).estimate([]) is None
+    assert PreviewEstimator(0.1).estimate(None) is None
+
+
+def test_estimate_scales_the_counts():
+    estimate = PreviewEstimator(0.2, 10).estimate([(0, 100, 50, 20), (1, 300, 150, 60)])
+    assert estimate[:5] == [2000, 1000, 50.0, 400, 20.0]
+    # sqrt(10 ** 2 * (1 - 0.2) * 20000 / 2) * 1.96 for the impressions of the two buckets
+    assert estimate[5] == 1753
+    assert estimate[6] == 877
+    assert estimate[8] == 351
+    # Both buckets match at the same ratios, so the ratio estimates have no spread
+    assert estimate[7] == 0.0
+    assert estimate[9] == 0.0
+
+
+def test_sampled_buckets_without_impressions_count():
+    estimate = PreviewEstimator(0.5, 4).estimate([('0', '100', '50', '25'), ('3', '900', '900', '900')])
+    # Bucket 1 was sampled but had no impressions, bucket 3 was not sampled
+    assert estimate[:5] == [200, 100, 50.0, 50, 25.0]
+    assert estimate[5] > 0
+
+
+def test_full_sample_has_no_margin():
+    estimate = PreviewEstimator(1, 3).estimate([(0, 10, 5, 1), (1, 30, 20, 9), (2, 60, 30, 20)])
+    assert estimate[:5] == [100, 55, 55.0, 30, 30.0]
+    assert estimate[5:] == [0, 0, 0.0, 0, 0.0]
+
+
+def test_ratio_margin():
+    estimator = PreviewEstimator(0.5, 8)
+    # Residuals of 10 - 0.5 * 10 and 10 - 0.5 * 30 => 5 and -5, with a mean denominator of 20
+    assert estimator.ratio_margin([10, 10], [10, 30], 0.5) == pytest.approx(1.96 * (0.5 * 50 / 2) ** 0.5 / 20)
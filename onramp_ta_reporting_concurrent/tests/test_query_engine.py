@@ -0,0 +1,37 @@
+# test_query_engine module
+# Tests of EngineRouter => work units are routed by their estimated size, and small units fall back to the default
+# engine
+#
+from query_engine import EngineRouter, HiveEngine, PrestoEngine
+
+CLUSTER_LABELS = {'hive': 'hive_cluster', 'presto': 'presto_cluster', 'unknown': 'other_cluster'}
+
+
+def test_route_without_small_engine():
+    router = EngineRouter(CLUSTER_LABELS)
+    assert isinstance(router.route(10), HiveEngine)
+    assert router.route(None) is router.default
+    assert router.route_with_fallback(10) == [router.default]
+    # Engines the router does not know are left out
+    assert sorted(router.engines) == ['hive', 'presto']
+
+
+def test_route_by_estimated_impressions():
+    router = EngineRouter(CLUSTER_LABELS, default_engine='hive', small_engine='presto', small_impressions=1000)
+    assert isinstance(router.route(1000), PrestoEngine)
+    assert router.route(1000).cluster_label == 'presto_cluster'
+    assert router.route(1001) is router.default
+    # Units of unknown size run on the default engine
+    assert router.route(None) is router.default
+
+
+def test_route_with_fallback():
+    router = EngineRouter(CLUSTER_LABELS, default_engine='hive', small_engine='presto', small_impressions=1000)
+    assert router.route_with_fallback(0) == [router.small, router.default]
+    assert router.route_with_fallback(5000) == [router.default]
+
+
+def test_small_engine_without_cluster_label_is_ignored():
+    router = EngineRouter({'hive': 'hive_cluster'}, small_engine='presto', small_impressions=1000)
+    assert router.small is None
+    assert router.route(0) is router.default
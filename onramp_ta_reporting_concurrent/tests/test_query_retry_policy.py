@@ -0,0 +1,73 @@
+# test_query_retry_policy module
+# Tests of QueryRetryPolicy => failures are classified from the command log and the API error, and retries are capped
+# per query and by the run's shared budget
+#
+import pytest
+
+pytest.importorskip('qds_sdk')
+from qds_sdk.exception import ServerError, RetryWithDelay, BadRequest, ForbiddenAccess
+from query_retry_policy import QueryRetryPolicy
+
+
+class FakeCommand(object):
+    def __init__(self, command_id, status):
+        self.id = command_id
+        self.status = status
+
+
+class FakeCommandClass(object):
+    # Log of every command id, a missing log raises as the API does
+    logs = {}
+
+    @classmethod
+    def get_log_id(cls, command_id):
+        return cls.logs[command_id]
+
+
+class FakeRequest(object):
+    text = ""
+
+
+def test_classify_command_from_log():
+    policy = QueryRetryPolicy()
+    FakeCommandClass.logs = {1: "FAILED: ParseException line 3:14 cannot recognize input near 'from'",
+                             2: "Error: java.lang.OutOfMemoryError: Java heap space",
+                             3: "Container killed on request. Exit code is 143",
+                             4: None}
+    assert policy.classify_command(FakeCommandClass, FakeCommand(1, 'error')) == 'fatal'
+    assert policy.classify_command(FakeCommandClass, FakeCommand(2, 'error')) == 'fatal'
+    assert policy.classify_command(FakeCommandClass, FakeCommand(3, 'error')) == 'retryable'
+    assert policy.classify_command(FakeCommandClass, FakeCommand(4, 'error')) == 'retryable'
+    # An unreadable log is not taken as a reason to give up
+    assert policy.classify_command(FakeCommandClass, FakeCommand(5, 'error')) == 'retryable'
+    # A cancelled command was cancelled on purpose
+    assert policy.classify_command(FakeCommandClass, FakeCommand(3, 'cancelled')) == 'fatal'
+
+
+def test_classify_exception():
+    request = FakeRequest()
+    assert QueryRetryPolicy.classify_exception(ServerError(request, "502")) == 'retryable'
+    assert QueryRetryPolicy.classify_exception(RetryWithDelay(request, "449")) == 'retryable'
+    assert QueryRetryPolicy.classify_exception(BadRequest(request, "400")) == 'fatal'
+    assert QueryRetryPolicy.classify_exception(ForbiddenAccess(request, "403")) == 'fatal'
+    assert QueryRetryPolicy.classify_exception(IOError("connection reset")) == 'retryable'
+
+
+def test_retry_delay_caps_attempts_and_delay():
+    policy = QueryRetryPolicy(max_attempts=3, retry_budget=10, base_delay=30, max_delay=45)
+    assert policy.retry_delay('fatal', 1) is None
+    assert 0 <= policy.retry_delay('retryable', 1) <= 30
+    assert 0 <= policy.retry_delay('retryable', 2) <= 45
+    assert policy.retry_delay('retryable', 3) is None
+    assert policy.retries_used == 2
+
+
+def test_retry_budget_is_shared_by_the_run():
+    policy = QueryRetryPolicy(max_attempts=5, retry_budget=2)
+    # Fatal failures and spent attempts take nothing from the budget
+    assert policy.retry_delay('fatal', 1) is None
+    assert policy.retry_delay('retryable', 5) is None
+    assert policy.retry_delay('retryable', 1) is not None
+    assert policy.retry_delay('retryable', 1) is not None
+    assert policy.retry_delay('retryable', 1) is None
+    assert policy.retries_used == 2
@@ -0,0 +1,57 @@
+# test_result_cache module
+# Tests of ResultCache => normalized keys, the cache modes, and the impression lookup used to route work units
+#
+from result_cache import ResultCache
+
+RESULT = ['1000', '800', '80.0', '400', '40.0']
+
+
+def cache_key(pixels, profile_ids, variant='standard'):
+    return ResultCache.cache_key(pixels, profile_ids, '20200101', '20200107', variant)
+
+
+def test_cache_key_is_normalized():
+    assert cache_key(['100'], ['12, 11,11']) == cache_key(['100'], ['11,12'])
+    assert cache_key(['100'], ['11,12']) != cache_key(['100'], ['11,13'])
+    assert cache_key(['100'], ['11,12']) != cache_key(['100'], ['11,12'], 'single_pass')
+    assert ResultCache.normalized_profiles(' 3 ,1,,3') == ResultCache.normalized_profiles(['1', '3']) == '1,3'
+
+
+def test_use_mode_reads_and_writes(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache.db'))
+    key = cache_key(['100'], ['11,12'])
+    assert cache.get(key) is None
+    cache.put(key, RESULT, 42)
+    assert cache.get(key) == RESULT
+    cache.close()
+
+
+def test_refresh_mode_only_writes_and_bypass_mode_neither(tmp_path):
+    key = cache_key(['100'], ['11,12'])
+    refresh = ResultCache(str(tmp_path / 'cache.db'), 'refresh')
+    refresh.put(key, RESULT)
+    assert refresh.get(key) is None
+    refresh.close()
+    bypass = ResultCache(str(tmp_path / 'cache.db'), 'bypass')
+    bypass.put(key, ['1', '1', '1', '1', '1'])
+    bypass.close()
+    assert ResultCache(str(tmp_path / 'cache.db')).get(key) == RESULT
+
+
+def test_empty_results_are_not_cached(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache.db'))
+    for result in (None, [], ['1000', None, '80.0', '400', '40.0']):
+        cache.put(cache_key(['100'], ['11']), result)
+    assert cache.get(cache_key(['100'], ['11'])) is None
+
+
+def test_latest_total_impressions_and_invalidate(tmp_path):
+    cache = ResultCache(str(tmp_path / 'cache.db'))
+    cache.put(ResultCache.cache_key(['100'], ['11'], '20191225', '20191231', 'standard'), ['500'] + RESULT[1:])
+    cache.put(cache_key(['100'], ['11']), RESULT)
+    cache.put(cache_key(['1001'], ['11']), ['7'] + RESULT[1:])
+    assert cache.latest_total_impressions('100') == 1000
+    assert cache.latest_total_impressions('200') is None
+    cache.invalidate('20200101', '20200107')
+    assert cache.latest_total_impressions('100') == 500
+    assert cache.latest_total_impressions('1001') is None
@@ -0,0 +1,75 @@
+# test_result_history module
+# Tests of ResultHistory => a window is compared with the earlier windows of the same pixel and profile set, and a
+# drop well below the moving average is alerted on
+#
+import pytest
+from result_history import ResultHistory
+
+
+def result(targeting_accuracy):
+    return ['1000', '800', '80.0', '400', str(targeting_accuracy)]
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = ResultHistory(str(tmp_path / 'history.db'), average_weeks=3, drop_points=10)
+    yield history
+    history.close()
+
+
+def test_first_window_has_no_trend(history):
+    assert history.assess('100', '11,12', '20200107', 40.0) == (None, None, False)
+    history.record('CAM-1', '100', '11,12', '20200101', '20200107', result(40.0))
+    # Windows ending on or after the assessed one are not earlier windows
+    assert history.assess('100', '11,12', '20200107', 40.0) == (None, None, False)
+
+
+def test_change_and_moving_average(history):
+    for end_date, targeting_accuracy in (('20200107', 40.0), ('20200114', 44.0), ('20200121', 48.0),
+                                         ('20200128', 52.0)):
+        history.record('CAM-1', '100', '11,12', end_date[:6] + '01', end_date, result(targeting_accuracy))
+    change, moving_average, alert = history.assess('100', '11,12', '20200204', 50.0)
+    # Only the latest three windows make up the moving average
+    assert (change, moving_average, alert) == (-2.0, 48.0, False)
+    assert history.assess('100', '11,12', '20200204', 37.5) == (-14.5, 48.0, True)
+    # A drop needs more than the drop points below the moving average
+    assert history.assess('100', '11,12', '20200204', 38.0)[2] is False
+
+
+def test_one_earlier_window_is_not_alerted_on(history):
+    history.record('CAM-1', '100', '11,12', '20200101', '20200107', result(50.0))
+    assert history.assess('100', '11,12', '20200114', 10.0) == (-40.0, 50.0, False)
+
+
+def test_profile_sets_are_kept_apart_and_normalized(history):
+    history.record('CAM-1', '100', '11,12', '20200101', '20200107', result(40.0))
+    history.record('CAM-2', '100', '13', '20200101', '20200107', result(90.0))
+    history.record('CAM-3', '200', '11,12', '20200101', '20200107', result(90.0))
+    assert history.assess('100', ' 12, 11', '20200114', 40.0) == (0.0, 40.0, False)
+    assert history.assess('100', ['13'], '20200114', 40.0) == (-50.0, 90.0, False)
+
+
+def test_tickets_sharing_a_window_count_once(history):
+    history.record('CAM-1', '100', '11,12', '20200101', '20200107', result(40.0))
+    history.record('CAM-2', '100', '12,11', '20200101', '20200107', result(44.0))
+    history.record('CAM-1', '100', '11,12', '20200108', '20200114', result(60.0))
+    assert history.windows('100', '11,12', '20200121', 3) == [('20200114', 60.0), ('20200107', 42.0)]
+    assert history.assess('100', '11,12', '20200121', 51.0) == (-9.0, 51.0, False)
+
+
+def test_rerun_replaces_the_window(history):
+    history.record('CAM-1', '100', '11,12', '20200101', '20200107', result(40.0))
+    history.record('CAM-1', '100', '12,11', '20200101', '20200107', result(45.0))
+    history.record('CAM-1', '100', '11,12', '20200101', '20200107', None)
+    rows = history.history('100')
+    assert len(rows) == 1
+    assert rows[0][3] == '11,12' and rows[0][8] == 45.0
+
+
+def test_trend_lines(history):
+    for end_date, targeting_accuracy in (('20200107', 50.0), ('20200114', 50.0), ('20200121', 30.0)):
+        history.record('CAM-1', '100', '11,12', end_date[:6] + '01', end_date, result(targeting_accuracy))
+    lines = history.trend_lines('100')
+    assert len(lines) == 4
+    assert lines[1].endswith('n/a        n/a  11,12')
+    assert lines[3].endswith('-20.00      50.00  11,12 [TREND ALERT]')
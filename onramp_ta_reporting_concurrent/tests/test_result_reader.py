@@ -0,0 +1,128 @@
+# test_result_reader module
+# Tests of ResultReader => inline results, result files streamed from S3 in chunks, and the fallback to the command's
+# own result download when boto3 is not installed
+#
+import sys
+import pytest
+
+pytest.importorskip('qds_sdk')
+import result_reader
+from result_reader import ResultReader
+
+
+class FakeAgent(object):
+    def __init__(self, response):
+        self.response = response
+        self.requests = []
+
+    def get(self, resource, params):
+        self.requests.append((resource, params))
+        return self.response
+
+
+class FakeBody(object):
+    def __init__(self, data):
+        self.data = data
+
+    def iter_chunks(self, chunk_size):
+        return (self.data[start:start + chunk_size] for start in range(0, len(self.data), chunk_size))
+
+
+class FakePaginator(object):
+    def __init__(self, pages):
+        self.pages = pages
+
+    def paginate(self, Bucket, Prefix):
+        return [dict(page, Contents=[content for content in page['Contents'] if content['Key'].startswith(Prefix)])
+                for page in self.pages]
+
+
+class FakeS3Client(object):
+    # Result objects of each bucket, listed in two pages
+    def __init__(self, objects):
+        self.objects = objects
+        self.reads = []
+
+    def get_paginator(self, operation):
+        contents = [{'Key': key, 'Size': len(data)} for key, data in sorted(self.objects.items(), reverse=True)]
+        return FakePaginator([{'Contents': contents[:2]}, {'Contents': contents[2:]}])
+
+    def get_object(self, Bucket, Key):
+        self.reads.append((Bucket, Key))
+        return {'Body': FakeBody(self.objects[Key])}
+
+
+class FakeAccount(object):
+    storage_access_key = 'access'
+    storage_secret_key = 'secret'
+
+
+class FakeCommand(object):
+    id = 7
+    meta_data = {'results_resource': 'commands/7/results'}
+
+    def __init__(self, data=b''):
+        self.data = data
+        self.downloads = []
+
+    def get_results(self, fp, inline=True, delim=None):
+        self.downloads.append((inline, delim))
+        fp.write(self.data)
+
+
+RESULT_OBJECTS = {'results/7/000000_0': 'CAM-1\t100\t1,000\n'.encode('utf-8'),
+                  'results/7/000001_0': 'CAM-2\tcafé\t2\nCAM-3\t300\t3'.encode('utf-8'),
+                  'results/7/': b'',
+                  'results/8/000000_0': b'other\tcommand\t0\n'}
+
+
+@pytest.fixture
+def agent(monkeypatch):
+    agent = FakeAgent({})
+    monkeypatch.setattr(result_reader.Qubole, 'agent', staticmethod(lambda: agent))
+    return agent
+
+
+def test_inline_results(agent):
+    agent.response = {'inline': True, 'results': 'CAM-1\t100\t5\r\n\nCAM-2\x01200\x016\n'}
+    rows = list(ResultReader().rows(FakeCommand(), [str, str, int]))
+    assert rows == [['CAM-1', '100', 5], ['CAM-2', '200', 6]]
+    assert agent.requests == [('commands/7/results', {'inline': True})]
+
+
+def test_parse_keeps_untyped_columns():
+    assert ResultReader().parse('CAM-1\t100\t5\textra', [str, int]) == ['CAM-1', 100, '5', 'extra']
+    assert ResultReader(delimiter=',').parse('a,b', None) == ['a', 'b']
+
+
+def test_s3_lines_stream_every_result_file_in_order():
+    client = FakeS3Client(RESULT_OBJECTS)
+    # A chunk size of three splits lines and the two bytes of the accented character across chunks
+    lines = list(ResultReader(chunk_size=3).s3_lines(client, 's3://bucket/results/7/'))
+    assert lines == ['CAM-1\t100\t1,000', 'CAM-2\tcafé\t2', 'CAM-3\t300\t3']
+    # Folder markers and empty objects are not read
+    assert client.reads == [('bucket', 'results/7/000000_0'), ('bucket', 'results/7/000001_0')]
+
+
+def test_rows_read_from_s3_through_boto3(agent, monkeypatch):
+    boto3 = pytest.importorskip('boto3')
+    client = FakeS3Client(RESULT_OBJECTS)
+    clients = []
+    monkeypatch.setattr(boto3, 'client', lambda *args, **kwargs: clients.append((args, kwargs)) or client)
+    monkeypatch.setattr(result_reader.Account, 'find', staticmethod(lambda: FakeAccount()))
+    agent.response = {'inline': False, 'result_location': ['s3n://bucket/results/7/']}
+    command = FakeCommand()
+    rows = list(ResultReader().rows(command, [str, str, str]))
+    assert rows == [['CAM-1', '100', '1,000'], ['CAM-2', 'café', '2'], ['CAM-3', '300', '3']]
+    assert clients == [(('s3',), {'aws_access_key_id': 'access', 'aws_secret_access_key': 'secret'})]
+    assert command.downloads == []
+
+
+def test_rows_fall_back_to_the_command_download(agent, monkeypatch):
+    # A None entry makes the import of boto3 fail as if it were not installed
+    monkeypatch.setitem(sys.modules, 'boto3', None)
+    agent.response = {'inline': False, 'result_location': ['s3://bucket/results/7/']}
+    command = FakeCommand('CAM-1\t100\t5\nCAM-2\tcafé\t6\n'.encode('utf-8'))
+    rows = list(ResultReader(chunk_size=4).rows(command, [str, str, int]))
+    assert rows == [['CAM-1', '100', 5], ['CAM-2', 'café', 6]]
+    assert command.downloads == [(False, '\t')]
@@ -0,0 +1,98 @@
+# test_result_store module
+# Tests of ResultStore => work unit results and their comments recorded from many threads at once are all kept and
+# streamed whole to the JSONL results file and the results log, which the results are read back from
+#
+import json
+import logging
+import threading
+from result_store import ResultStore, UnitResult
+
+RESULT = ['6', '6', '100.0', '3', '50.0']
+
+
+def entries(path):
+    with open(path) as results_file:
+        return [json.loads(line) for line in results_file]
+
+
+def test_unit_result_is_typed():
+    unit_result = UnitResult('CAM-1', '100', '11', RESULT)
+    assert unit_result.query_result() == [6, 6, 100.0, 3, 50.0] and unit_result.margins is None
+    estimated = UnitResult('CAM-1', '100', '11', RESULT + ['1', '1', '0.5', '1', '2.5'])
+    assert estimated.query_result() == [6, 6, 100.0, 3, 50.0, 1.0, 1.0, 0.5, 1.0, 2.5]
+    assert not UnitResult('CAM-1', '100', '11').has_result() and UnitResult('CAM-1', '100', '11').query_result() is None
+
+
+def test_concurrent_results_and_comments_are_all_streamed(tmp_path):
+    path = str(tmp_path / 'results.jsonl')
+    store = ResultStore(path)
+    start = threading.Event()
+
+    def post(n):
+        start.wait(5)
+        for pixel in range(25):
+            store.record('CAM-' + str(n), str(pixel), '11', RESULT)
+            store.add_comment('CAM-' + str(n), str(pixel), '11', 'posted ' + str(pixel))
+    threads = [threading.Thread(target=post, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    start.set()
+    for thread in threads:
+        thread.join()
+    store.close()
+    assert len(store.results()) == 200
+    assert all(store.get('CAM-' + str(n), str(pixel), '11').comments == ['posted ' + str(pixel)]
+               for n in range(8) for pixel in range(25))
+    # Every line is a whole entry, a unit's comment follows its result
+    lines = entries(path)
+    assert len(lines) == 400
+    events = [(line['event'], line['result']['ticket_key'] if line['event'] == 'result' else line['ticket_key'],
+               line['result']['pixel'] if line['event'] == 'result' else line['pixel']) for line in lines]
+    for event, ticket_key, pixel in events:
+        if event == 'comment':
+            assert events.index(('result', ticket_key, pixel)) < events.index(('comment', ticket_key, pixel))
+
+
+def test_comments_tell_the_profile_sets_of_a_pixel_apart(tmp_path):
+    store = ResultStore(str(tmp_path / 'results.jsonl'))
+    store.record('CAM-1', '100', '11', RESULT)
+    store.record('CAM-1', '100', '13', None)
+    store.add_comment('CAM-1', '100', '13', 'no results')
+    store.add_comment('CAM-2', '100', '11', 'unknown unit')
+    store.close()
+    assert store.get('CAM-1', '100', '11').comments == []
+    assert store.get('CAM-1', '100', '13').comments == ['no results']
+    # The comment of a unit with no result is still streamed
+    assert entries(str(tmp_path / 'results.jsonl'))[-1] == {'event': 'comment', 'ticket_key': 'CAM-2', 'pixel': '100',
+                                                            'profile_ids': '11', 'comment': 'unknown unit'}
+
+
+def test_results_are_logged(caplog):
+    store = ResultStore()
+    with caplog.at_level(logging.INFO, logger='results'):
+        store.record('CAM-1', '100', '11', RESULT)
+        store.record('CAM-1', '200', '11', RESULT + ['1', '1', '0.5', '1', '2.5'])
+        store.record('CAM-1', '300', '11', None)
+        store.add_comment('CAM-1', '100', '11', 'posted')
+    messages = [record.getMessage() for record in caplog.records]
+    assert '     => Query Results: 6, 6, 100.0, 3, 50.0' in messages
+    assert '     => Estimated Results: 6 +/- 1.0, 6 +/- 1.0, 100.0 +/- 0.5, 3 +/- 1.0, 50.0 +/- 2.5' in messages
+    assert '     => Query Results: none' in messages
+    assert '     => Ticket Comment [CAM-1, 100]: posted' in messages
+    # Without a results file the results are still kept
+    store.close()
+    assert len(store.results()) == 3
+
+
+def test_read_back_the_streamed_results(tmp_path):
+    path = str(tmp_path / 'results.jsonl')
+    store = ResultStore(path)
+    store.record('CAM-1', '100', '11', RESULT)
+    store.record('CAM-1', '200', '11', RESULT + ['1', '1', '0.5', '1', '2.5'])
+    store.record('CAM-2', '300', '11', None)
+    store.close()
+    unit_results = ResultStore.read(path)
+    assert [unit_result.as_dict() for unit_result in unit_results] == \
+        [unit_result.as_dict() for unit_result in store.results()]
+    assert [unit_result.has_result() for unit_result in unit_results] == [True, True, False]
+    assert unit_results[1].margins == [1.0, 1.0, 0.5, 1.0, 2.5]
@@ -0,0 +1,64 @@
+# test_run_journal module
+# Tests of RunJournal => a resumed run replays the journal of its own reporting window only, survives a line cut short
+# by a crash, keeps the profile sets of a pixel apart, and a fresh run starts over
+#
+from run_journal import RunJournal
+
+UNIT = RunJournal.unit_key('CAM-1', ['100'], ['11'])
+
+
+def first_attempt(path):
+    journal = RunJournal(path, '20200101', '20200107')
+    journal.record_submitted(UNIT, 11)
+    journal.record_submitted(RunJournal.unit_key('CAM-1', ['200'], ['11']), 12)
+    journal.record_result(UNIT, ['1', '2', '3', '4', '5'])
+    journal.record_posted('CAM-2', 'report')
+    journal.close()
+
+
+def test_resume_replays_the_window(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    first_attempt(path)
+    with open(path, 'a') as journal_file:
+        journal_file.write('{"event": "posted", "tick')
+    journal = RunJournal(path, '20200101', '20200107', resume=True)
+    assert journal.result(UNIT) == ['1', '2', '3', '4', '5']
+    # A unit with a result is not re-attached, one still running is
+    assert journal.running_command(UNIT) is None
+    assert journal.running_command(RunJournal.unit_key('CAM-1', ['200'], ['11'])) == 12
+    assert journal.is_posted('CAM-2', 'report') and not journal.is_posted('CAM-1', 'report')
+    # The entries of the resumed run start on a line of their own
+    journal.record_posted('CAM-1', 'report')
+    journal.close()
+    assert RunJournal(path, '20200101', '20200107', resume=True).is_posted('CAM-1', 'report')
+
+
+def test_resume_ignores_other_windows(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    first_attempt(path)
+    journal = RunJournal(path, '20200108', '20200114', resume=True)
+    assert journal.result(UNIT) is None and not journal.is_posted('CAM-2', 'report')
+    journal.close()
+
+
+def test_fresh_run_starts_over(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    first_attempt(path)
+    RunJournal(path, '20200101', '20200107').close()
+    journal = RunJournal(path, '20200101', '20200107', resume=True)
+    assert journal.result(UNIT) is None
+    journal.close()
+
+
+def test_profile_sets_of_a_pixel_are_separate_units(tmp_path):
+    path = str(tmp_path / 'journal.jsonl')
+    journal = RunJournal(path, '20200101', '20200107')
+    journal.record_result(RunJournal.unit_key('CAM-1', ['100'], ['11, 12']), ['1', '2', '3', '4', '5'])
+    journal.record_result(RunJournal.unit_key('CAM-1', ['100'], ['13']), ['6', '7', '8', '9', '10'])
+    journal.close()
+    journal = RunJournal(path, '20200101', '20200107', resume=True)
+    # The profile ids are normalized as in the batch key
+    assert journal.result(RunJournal.unit_key('CAM-1', ['100'], ['12,11'])) == ['1', '2', '3', '4', '5']
+    assert journal.result(RunJournal.unit_key('CAM-1', ['100'], ['13'])) == ['6', '7', '8', '9', '10']
+    assert journal.result(RunJournal.unit_key('CAM-1', ['100'], ['11'])) is None
+    journal.close()
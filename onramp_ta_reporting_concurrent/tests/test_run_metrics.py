@@ -0,0 +1,84 @@
+# test_run_metrics module
+# Tests of RunMetrics => stage observations are summed per stage and per work unit with their errors, the probes are
+# sampled from the background thread until stopped, and the summary is written as JSON and a Prometheus textfile
+#
+import json
+import time
+import pytest
+from run_metrics import RunMetrics
+
+
+def test_stage_totals_and_errors():
+    metrics = RunMetrics()
+    for unit, seconds in (('CAM-1|100', 1.0), ('CAM-2|200', 3.0), (None, 2.0)):
+        metrics.observe('query', seconds, unit)
+    metrics.observe('comment', 0.5, 'CAM-1', error=True)
+    with metrics.stage('plan', 'CAM-3'):
+        pass
+    with pytest.raises(ValueError):
+        with metrics.stage('plan', 'CAM-4'):
+            raise ValueError('bad ticket')
+    stages = metrics.summary()['stages']
+    query = stages['query']
+    assert (query['count'], query['errors'], query['total_seconds'], query['mean_seconds']) == (3, 0, 6.0, 2.0)
+    assert (query['p50_seconds'], query['p95_seconds'], query['max_seconds']) == (2.0, 3.0, 3.0)
+    # Observations without a work unit count in the totals only
+    assert query['units'] == {'CAM-1|100': 1.0, 'CAM-2|200': 3.0}
+    assert (stages['comment']['count'], stages['comment']['errors']) == (1, 1)
+    # A block raising is timed as an error of the stage
+    assert (stages['plan']['count'], stages['plan']['errors'], sorted(stages['plan']['units'])) == \
+        (2, 1, ['CAM-3', 'CAM-4'])
+
+
+def test_percentile():
+    assert RunMetrics.percentile([], 0.5) == 0
+    assert RunMetrics.percentile([4], 0.95) == 4
+    assert RunMetrics.percentile([1, 2, 3, 4, 5], 0.5) == 3
+
+
+def test_sampling_until_stopped():
+    metrics = RunMetrics()
+    queued = [3]
+
+    def failing():
+        raise RuntimeError('pool gone')
+    metrics.start_sampling({'queued_units': lambda: queued[0], 'running_units': failing}, interval=0.01)
+    deadline = time.time() + 5
+    while len(metrics.summary()['occupancy']) < 2 and time.time() < deadline:
+        time.sleep(0.01)
+    metrics.stop_sampling()
+    samples = metrics.summary()['occupancy']
+    assert len(samples) >= 2
+    # A failing probe is recorded as missing rather than stopping the sampling
+    assert all(sample['queued_units'] == 3 and sample['running_units'] is None for sample in samples)
+    assert not metrics.sampler.is_alive()
+    time.sleep(0.05)
+    assert len(metrics.summary()['occupancy']) == len(samples)
+
+
+def test_write_json_and_prometheus(tmp_path):
+    metrics = RunMetrics()
+    metrics.observe('query', 2.0, 'CAM-1|100')
+    metrics.observe('query', 4.0, 'CAM-2|100', error=True)
+    metrics.occupancy.extend([{'time': 0.1, 'running_units': 1}, {'time': 0.2, 'running_units': 2},
+                              {'time': 0.3, 'running_units': None}])
+    path_prefix = str(tmp_path / 'metrics')
+    metrics.write(path_prefix)
+    with open(path_prefix + '.json') as json_file:
+        summary = json.load(json_file)
+    assert summary['stages']['query']['total_seconds'] == 6.0
+    assert summary['stages']['query']['units'] == {'CAM-1|100': 2.0, 'CAM-2|100': 4.0}
+    with open(path_prefix + '.prom') as prom_file:
+        lines = prom_file.read().splitlines()
+    assert 'ta_report_stage_seconds_sum{stage="query"} 6.0' in lines
+    assert 'ta_report_stage_seconds_count{stage="query"} 2' in lines
+    assert 'ta_report_stage_errors_total{stage="query"} 1' in lines
+    assert 'ta_report_peak_occupancy{probe="running_units"} 2' in lines
+
+
+def test_write_failure_is_logged(tmp_path):
+    metrics = RunMetrics()
+    logged = []
+    metrics.logger = lambda level, message: logged.append(level)
+    metrics.write(str(tmp_path / 'missing' / 'metrics'))
+    assert logged == [40]
@@ -0,0 +1,114 @@
+# test_shard_leases module
+# Tests of ShardLeases => leases are held by one worker at a time, an expired lease is taken over by exactly one of the
+# workers racing for it, and a worker whose lease was taken over gives it up
+#
+import os
+import threading
+import time
+from shard_leases import ShardLeases
+
+
+def age(path, seconds):
+    past = time.time() - seconds
+    os.utime(path, (past, past))
+
+
+def test_acquire_is_exclusive(tmp_path):
+    first = ShardLeases(str(tmp_path), 'worker-a', lease_seconds=60)
+    second = ShardLeases(str(tmp_path), 'worker-b', lease_seconds=60)
+    assert first.acquire('shard_0')
+    assert not second.acquire('shard_0')
+    assert first.holds('shard_0') and not second.holds('shard_0')
+    assert first.lease_owner(first.lease_path('shard_0')) == 'worker-a'
+    # Only the owner removes the lease file
+    second.release('shard_0')
+    assert os.path.isfile(first.lease_path('shard_0'))
+    first.release('shard_0')
+    assert not first.holds('shard_0')
+    assert second.acquire('shard_0')
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    first = ShardLeases(str(tmp_path), 'worker-a', lease_seconds=60)
+    second = ShardLeases(str(tmp_path), 'worker-b', lease_seconds=60)
+    assert first.acquire('shard_0')
+    age(first.lease_path('shard_0'), 30)
+    assert not second.acquire('shard_0')
+    age(first.lease_path('shard_0'), 90)
+    assert first.is_expired(first.lease_path('shard_0'))
+    assert second.acquire('shard_0')
+    assert second.lease_owner(second.lease_path('shard_0')) == 'worker-b'
+    assert not os.path.exists(second.lease_path('shard_0') + '.expired')
+
+
+def test_expired_lease_race_has_one_winner(tmp_path):
+    for trial in range(20):
+        owner = ShardLeases(str(tmp_path), 'dead', lease_seconds=60)
+        name = 'shard_' + str(trial)
+        assert owner.acquire(name)
+        age(owner.lease_path(name), 90)
+        workers = [ShardLeases(str(tmp_path), 'worker-' + str(n), lease_seconds=60) for n in range(6)]
+        start = threading.Barrier(len(workers))
+        won = []
+
+        def race(worker):
+            start.wait()
+            if worker.acquire(name):
+                won.append(worker.worker_id)
+        threads = [threading.Thread(target=race, args=(worker,)) for worker in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(won) == 1
+        assert owner.lease_owner(owner.lease_path(name)) == won[0]
+
+
+def test_abandoned_take_over_is_cleared(tmp_path):
+    first = ShardLeases(str(tmp_path), 'worker-a', lease_seconds=60)
+    second = ShardLeases(str(tmp_path), 'worker-b', lease_seconds=60)
+    assert first.acquire('shard_0')
+    age(first.lease_path('shard_0'), 90)
+    # A worker died between linking the expired name and removing the lease
+    os.link(first.lease_path('shard_0'), first.lease_path('shard_0') + '.expired')
+    assert not second.acquire('shard_0')
+    assert os.path.exists(first.lease_path('shard_0') + '.expired')
+    # The expired name is cleared once it is itself a lease period old, the link time being its change time
+    time.sleep(0.01)
+    second.lease_seconds = 0.005
+    assert not second.acquire('shard_0')
+    assert not os.path.exists(first.lease_path('shard_0') + '.expired')
+    assert second.acquire('shard_0')
+
+
+def test_lost_lease_is_reported(tmp_path):
+    first = ShardLeases(str(tmp_path), 'worker-a', lease_seconds=60)
+    second = ShardLeases(str(tmp_path), 'worker-b', lease_seconds=60)
+    lost = []
+    first.on_lost = lost.append
+    assert first.acquire('shard_0') and first.acquire('shard_1')
+    age(first.lease_path('shard_0'), 90)
+    age(first.lease_path('shard_1'), 30)
+    assert second.acquire('shard_0')
+    first.renew()
+    assert lost == ['shard_0']
+    assert not first.holds('shard_0') and first.holds('shard_1')
+    # The lease still held is renewed
+    assert not first.is_expired(first.lease_path('shard_1'))
+    assert time.time() - os.stat(first.lease_path('shard_1')).st_mtime < 5
+    first.stop()
+    assert second.lease_owner(second.lease_path('shard_0')) == 'worker-b'
+    assert not os.path.exists(first.lease_path('shard_1'))
+
+
+def test_claim_and_complete(tmp_path):
+    first = ShardLeases(str(tmp_path), 'worker-a', shards=2, lease_seconds=60)
+    second = ShardLeases(str(tmp_path), 'worker-b', shards=2, lease_seconds=60)
+    assert first.shard_of('CAM-1|100') == second.shard_of('CAM-1|100')
+    claimed = [first.claim(), second.claim()]
+    assert sorted(claimed) == [0, 1]
+    assert first.claim() is None
+    open(first.part_path(claimed[0]), 'w').close()
+    first.complete(claimed[0])
+    assert first.is_done(claimed[0]) and not first.holds('shard_' + str(claimed[0]))
+    assert second.pending() == [claimed[1]]
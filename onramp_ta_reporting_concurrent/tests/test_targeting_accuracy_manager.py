@@ -0,0 +1,167 @@
+# test_targeting_accuracy_manager module
+# Tests of TargetingAccuracyManager => tickets run end to end through the scheduler and comment pipeline with Jira
+# stood in for and the Qubole queries run against the SQLite copy of the source tables, checking the results each
+# sub-ticket is reported with
+#
+import threading
+import pytest
+
+pytest.importorskip('jira')
+import jira_manager
+import qubole_manager
+from query_engine import EngineRouter
+from targeting_accuracy_manager import TargetingAccuracyManager, Ticket
+
+
+class FakeJiraManager(object):
+    # Records the report comments by ticket => [(pixel, result)] in the order posted
+    def __init__(self, *args, **kwargs):
+        self.reports = {}
+        self.alerts = []
+        self.lock = threading.Lock()
+
+    def add_ticket_report_comment(self, cam_id, pixel_results, report_start_date, report_end_date, ta_pct,
+                                  trends=None, trend_weeks=4):
+        with self.lock:
+            self.reports[cam_id] = [("".join(pixel), result and list(result)) for pixel, result in pixel_results]
+        return []
+
+    def add_ticket_data_alert_comment(self, cam_id):
+        with self.lock:
+            self.alerts.append(cam_id)
+
+    def kill_session(self):
+        pass
+
+
+class FakeQubole(object):
+    # Queries launched, each run on the connection
+    launched = []
+    connection = None
+    lock = threading.Lock()
+
+    def __init__(self, name, qubole_token, cluster_label, query, poller=None, on_submit=None, metrics=None,
+                 retry_policy=None, engine=None):
+        self.name = name
+        self.cluster_label = cluster_label
+        self.query = query
+        self.engine = engine
+        self.on_submit = on_submit
+        self.command_id = None
+        self.message = ""
+
+    def stream_results(self, column_types=None, command_id=None):
+        with self.lock:
+            self.launched.append(self)
+            self.command_id = len(self.launched)
+            rows = [[str(value) for value in row] for row in self.connection.execute(self.query).fetchall()]
+        if self.on_submit:
+            self.on_submit(self.command_id)
+        for row in rows:
+            yield row
+
+    def get_result_rows(self):
+        return list(self.stream_results())
+
+    def get_results(self, command_id=None):
+        rows = self.get_result_rows()
+        return rows[0] if rows else []
+
+
+class FakeIssue(object):
+    def __init__(self, key, pixels, profile_ids):
+        self.key = key
+        self.pixels = pixels
+        self.profile_ids = profile_ids
+        self.start_date = '20191201'
+        self.end_date = '20200301'
+
+
+@pytest.fixture
+def fakes(monkeypatch, connection, sqlite_engine):
+    monkeypatch.setattr(jira_manager, 'JiraManager', FakeJiraManager)
+    monkeypatch.setattr(qubole_manager, 'QuboleManager', FakeQubole)
+    monkeypatch.setattr(FakeQubole, 'launched', [])
+    monkeypatch.setattr(FakeQubole, 'connection', connection)
+    # Every query is generated in the SQL the SQLite copy runs
+    monkeypatch.setitem(EngineRouter.engine_classes, 'hive', sqlite_engine)
+    return FakeQubole
+
+
+def config(tmp_path, **overrides):
+    config_params = {
+        "jira_url": 'https://jira', "jira_token": ('user', 'token'), "jql_agencies": "('A')",
+        "jql_status": "('Live')", "jql_issuetype": "('Campaign')", "qubole_token": 'token',
+        "qubole_api_url": 'https://qubole/api/', "cluster_label": 'hive_cluster',
+        "engine_labels": {'hive': 'hive_cluster', 'presto': 'presto_cluster'}, "engine_routing": ('hive', '', 0),
+        "max_qubole_commands": 2, "max_jira_calls": 1, "comment_posters": 1, "jira_rate": (100, 100),
+        "qubole_retry": (1, 0, 0, 0), "poll_intervals": (0.01, 0.01, 1), "ta_pct": 10.0, "query_mode": 'per_pixel',
+        "query_variant": 'standard', "cache_file": str(tmp_path / 'results.db'), "cache_mode": 'bypass',
+        "history_file": str(tmp_path / 'history.db'), "trend_alert": (4, 10), "post_comments": True,
+        "report_dates": ('20200101', '20200107'), "preview": None, "readiness": None, "backfill": False,
+        "plan": False, "sharding": None, "master_files": None, "backfill_output": None, "resume": False,
+        "journal_file": str(tmp_path / 'journal.jsonl'), "metrics_path": str(tmp_path / 'metrics'),
+        "results_file": str(tmp_path / 'results.jsonl')}
+    config_params.update(overrides)
+    return config_params
+
+
+def run(config_params, issues):
+    manager = TargetingAccuracyManager(config_params)
+    try:
+        manager.ticket_concurrency_manager(Ticket(issue) for issue in issues)
+    finally:
+        manager.poller.stop()
+        manager.journal.close()
+        manager.results.close()
+    return manager
+
+
+def reported(manager, ticket_key):
+    # The reported results of a ticket as numbers rounded as in the comment, sorted by pixel and targeting accuracy
+    return sorted((pixel, result and [round(float(value), 2) for value in result])
+                  for pixel, result in manager.jira_pars.reports[ticket_key])
+
+
+def test_resume_keeps_the_profile_sets_of_a_pixel_apart(tmp_path, fakes):
+    # The ticket lists pixel 100 with two profile sets, whose targeting accuracy differs
+    issue = FakeIssue('CAM-1', ['100', '100'], ['11', '13'])
+    first = run(config(tmp_path, post_comments=False), [issue])
+    assert fakes.launched and first.jira_pars.reports == {}
+    launched = len(fakes.launched)
+
+    # The resumed run posts the journaled result of each profile set without querying again
+    resumed = run(config(tmp_path, resume=True), [issue])
+    assert len(fakes.launched) == launched
+    assert reported(resumed, 'CAM-1') == [('100', [6, 6, 100.0, 1, 16.67]), ('100', [6, 6, 100.0, 3, 50.0])]
+    assert sorted(round(result.targeting_accuracy, 2) for result in resumed.results.results()) == [16.67, 50.0]
+
+
+def test_backfill_runs_on_the_default_engine(tmp_path, fakes, monkeypatch, sqlite_engine):
+    monkeypatch.setitem(EngineRouter.engine_classes, 'presto', sqlite_engine)
+    manager = TargetingAccuracyManager(config(tmp_path, engine_routing=('presto', '', 0), backfill=True,
+                                              post_comments=False, report_dates=('20200101', '20200107')))
+    try:
+        ticket_weeks = manager.backfill_manager([Ticket(FakeIssue('CAM-1', ['100'], ['11']))])
+    finally:
+        manager.poller.stop()
+        manager.journal.close()
+        manager.results.close()
+    assert [(qubole.cluster_label, qubole.engine) for qubole in fakes.launched] == \
+        [('presto_cluster', manager.engine_router.default)]
+    assert [[round(float(value), 2) for value in result] for ticket, week, result in ticket_weeks['CAM-1']] == \
+        [[6, 6, 100.0, 3, 50.0]]
+
+
+@pytest.mark.parametrize('query_mode', ['batched', 'per_pixel'])
+def test_batched_results_fan_out_to_every_ticket(tmp_path, fakes, query_mode):
+    # CAM-1 and CAM-2 share the unit of pixel 100 and profile 11, CAM-3 asks for another profile set of the pixel
+    issues = [FakeIssue('CAM-1', ['100', '200'], ['11', '11']), FakeIssue('CAM-2', ['100'], ['11']),
+              FakeIssue('CAM-3', ['100'], ['13'])]
+    manager = run(config(tmp_path, query_mode=query_mode), issues)
+    if query_mode == 'batched':
+        # The three distinct units of the run are a single query
+        assert len(fakes.launched) == 1 and fakes.launched[0].name[0] == 'Batched'
+    assert reported(manager, 'CAM-1') == [('100', [6, 6, 100.0, 3, 50.0]), ('200', [1, 1, 100.0, 1, 100.0])]
+    assert reported(manager, 'CAM-2') == [('100', [6, 6, 100.0, 3, 50.0])]
+    assert reported(manager, 'CAM-3') == [('100', [6, 6, 100.0, 1, 16.67])]
@@ -0,0 +1,98 @@
+# test_targeting_accuracy_query module
+# Tests of the query templates => every template is rendered for every engine, and the weekly, daily and batched
+# queries are run against a small SQLite copy of the source tables, whose SQL the Presto dialect of the templates
+# stays within
+#
+import pytest
+from query_engine import HiveEngine, PrestoEngine, SparkEngine
+from targeting_accuracy_query import TargetingAccuracyQuery
+
+
+@pytest.mark.parametrize('pixel, profile_ids', [(['100'], ['11,12']), (['100'], ['13']), (['100'], ['99']),
+                                                (['200'], ['11, 12']), (['300'], ['11'])])
+def test_weekly_variants_return_the_same_columns(connection, pixel, profile_ids):
+    engine = PrestoEngine(None)
+    rows = [connection.execute(TargetingAccuracyQuery.weekly_query_variant(variant)(
+        pixel, profile_ids, '20200101', '20200107', engine=engine)).fetchall()
+        for variant in ('standard', 'single_pass')]
+    assert len(rows[0]) == len(rows[1]) == 1
+    assert [float(value) for value in rows[0][0]] == [float(value) for value in rows[1][0]]
+
+
+def test_weekly_query_counts(connection):
+    row = connection.execute(TargetingAccuracyQuery.weekly_query(['100'], ['11'], '20200101', '20200107',
+                                                                 engine=PrestoEngine(None))).fetchone()
+    # Six impressions in the window => g1 twice and g2 matched into the segment, g3 matched to two individuals outside
+    # it, g4 unmatched and g5 matched outside it
+    assert row == (6, 6, 100.0, 3, 50.0)
+
+
+def test_batched_weekly_query_matches_the_weekly_query_of_each_unit(connection, sqlite_engine):
+    engine = sqlite_engine(None)
+    units = [('100', ('11', '12')), ('100', ('13',)), ('100', ('99',)), ('200', ('11',)), ('300', ('11',))]
+    batched = connection.execute(TargetingAccuracyQuery.batched_weekly_query(units, '20200101', '20200107',
+                                                                             engine=engine)).fetchall()
+    assert sorted(row[0] for row in batched) == list(range(len(units)))
+    for n, (pixel, profile_ids) in enumerate(units):
+        weekly = connection.execute(TargetingAccuracyQuery.weekly_query([pixel], list(profile_ids), '20200101',
+                                                                        '20200107', engine=engine)).fetchone()
+        assert [float(value) for row in batched if row[0] == n for value in row[1:]] == \
+            [float(value) for value in weekly]
+
+
+def test_batched_daily_partial_query_matches_the_daily_query_of_each_unit(connection, sqlite_engine):
+    engine = sqlite_engine(None)
+    units = [('100', ('11', '12')), ('100', ('13',)), ('100', ('99',)), ('200', ('11',))]
+    data_dates = ['20200101', '20200102', '20200103', '20200105', '20200108']
+    batched = connection.execute(TargetingAccuracyQuery.batched_daily_partial_query(units, data_dates,
+                                                                                    engine=engine)).fetchall()
+    for n, (pixel, profile_ids) in enumerate(units):
+        daily = connection.execute(TargetingAccuracyQuery.daily_partial_query([pixel], list(profile_ids), data_dates,
+                                                                              engine=engine)).fetchall()
+        assert sorted(row[1:] for row in batched if row[0] == n) == sorted(daily)
+
+
+UNITS = [('100', ('11', '12')), ('200', ('13',))]
+WEEKS = [('20200101', '20200107'), ('20200108', '20200110')]
+TEMPLATES = {
+    'weekly_query': lambda engine: TargetingAccuracyQuery.weekly_query(['100'], ['11,12'], '20200101', '20200107',
+                                                                       engine=engine),
+    'single_pass_weekly_query': lambda engine: TargetingAccuracyQuery.single_pass_weekly_query(
+        ['100'], ['11,12'], '20200101', '20200107', engine=engine),
+    'daily_partial_query': lambda engine: TargetingAccuracyQuery.daily_partial_query(
+        ['100'], ['11,12'], ['20200101', '20200102'], engine=engine),
+    'batched_daily_partial_query': lambda engine: TargetingAccuracyQuery.batched_daily_partial_query(
+        UNITS, ['20200101', '20200102'], engine=engine),
+    'preview_query': lambda engine: TargetingAccuracyQuery.preview_query(['100'], ['11,12'], '20200101', '20200107',
+                                                                         50, 1000, engine=engine),
+    'batched_weekly_query': lambda engine: TargetingAccuracyQuery.batched_weekly_query(UNITS, '20200101', '20200107',
+                                                                                       engine=engine),
+    'backfill_weekly_query': lambda engine: TargetingAccuracyQuery.backfill_weekly_query(UNITS, WEEKS,
+                                                                                         engine=engine)}
+
+
+@pytest.mark.parametrize('template', sorted(TEMPLATES))
+@pytest.mark.parametrize('engine', [HiveEngine('hive'), PrestoEngine('presto'), SparkEngine('spark')],
+                         ids=lambda engine: engine.name)
+def test_template_renders_in_the_engine_dialect(template, engine):
+    query = TEMPLATES[template](engine)
+    assert '{' not in query and '}' not in query
+    first_keyword = 'with' if template.startswith(('batched', 'backfill')) else 'select'
+    assert query.strip().startswith((engine.header() + first_keyword).strip())
+    assert (engine.null_function + '(') in query
+    assert ('nvl(' in query) == (engine.null_function == 'nvl')
+    if engine.name == 'presto':
+        assert 'stack(' not in query and 'pmod(hash(' not in query
+    if engine.name != 'hive':
+        assert 'set hive' not in query
+
+
+@pytest.mark.parametrize('template', sorted(TEMPLATES))
+def test_presto_template_parses(template):
+    sqlglot = pytest.importorskip('sqlglot')
+    assert sqlglot.parse_one(TEMPLATES[template](PrestoEngine('presto')), read='presto') is not None
+
+
+def test_unknown_weekly_query_variant_is_rejected():
+    with pytest.raises(ValueError):
+        TargetingAccuracyQuery.weekly_query_variant('two_pass')
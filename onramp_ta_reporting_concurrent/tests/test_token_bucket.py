@@ -0,0 +1,16 @@
+# test_token_bucket module
+# Tests of TokenBucket => the shared Jira rate limit allows the burst, then paces the requests at the rate
+#
+import time
+from token_bucket import TokenBucket
+
+
+def test_token_bucket_allows_the_burst_then_paces_at_the_rate():
+    bucket = TokenBucket(rate=50, capacity=3)
+    start = time.time()
+    for n in range(3):
+        bucket.acquire()
+    assert time.time() - start < 0.05
+    for n in range(5):
+        bucket.acquire()
+    assert time.time() - start >= 0.08
@@ -0,0 +1,106 @@
+# test_work_scheduler module
+# Tests of WorkScheduler => work units run in priority order, delayed units are queued once their delay has passed
+# without holding a worker, and queued or delayed units can be cancelled before they start
+#
+import threading
+import time
+import pytest
+from work_scheduler import WorkScheduler
+
+
+def busy_scheduler():
+    # A single worker held by a running unit until released, so the units submitted meanwhile queue up
+    scheduler = WorkScheduler(1)
+    started, release = threading.Event(), threading.Event()
+
+    def hold(unit):
+        started.set()
+        release.wait(5)
+        return unit
+    running = scheduler.submit('running', hold, 'running')
+    assert started.wait(5)
+    return scheduler, running, release
+
+
+def test_units_run_in_priority_order():
+    scheduler, running, release = busy_scheduler()
+    order = []
+    for key, priority in (('c', ('20200301', 'CAM-3')), ('a', ('20200101', 'CAM-1')), ('b', ('20200201', 'CAM-2')),
+                          ('a2', ('20200101', 'CAM-1'))):
+        scheduler.submit(key, order.append, key, priority=priority)
+    assert scheduler.occupancy() == (1, 4)
+    release.set()
+    scheduler.shutdown()
+    # Units of equal priority run in the order submitted
+    assert order == ['a', 'a2', 'b', 'c']
+    assert running.result() == 'running'
+
+
+def test_failed_unit_does_not_stop_the_pool():
+    scheduler = WorkScheduler(2)
+    failed = scheduler.submit('failed', lambda unit: 1 / unit, 0)
+    ok = scheduler.submit('ok', lambda unit: unit * 2, 21)
+    scheduler.shutdown()
+    with pytest.raises(ZeroDivisionError):
+        failed.result()
+    assert ok.result() == 42
+    with pytest.raises(RuntimeError):
+        scheduler.submit('late', lambda unit: unit, 1)
+
+
+def test_delayed_unit_is_queued_after_its_delay():
+    scheduler, running, release = busy_scheduler()
+    order = []
+    start = time.time()
+    delayed = scheduler.submit_later(0.2, 'held', lambda unit: order.append(unit) or time.time(), 'held',
+                                     priority=('20200101',))
+    scheduler.submit('queued', order.append, 'queued', priority=('20200301',))
+    assert scheduler.occupancy() == (1, 2)
+    release.set()
+    scheduler.shutdown()
+    # The delayed unit waited out its delay without holding the worker, shutdown waited for it
+    assert order == ['queued', 'held']
+    assert delayed.result() - start >= 0.2
+
+
+def test_delayed_unit_starts_the_first_worker():
+    scheduler = WorkScheduler(2)
+    delayed = scheduler.submit_later(0.05, 'held', lambda unit: unit, 'held')
+    scheduler.shutdown()
+    assert delayed.result() == 'held'
+
+
+def test_queued_units_can_be_cancelled():
+    scheduler, running, release = busy_scheduler()
+    ran = []
+    cancelled = scheduler.submit('cancelled', ran.append, 'cancelled')
+    kept = scheduler.submit('kept', ran.append, 'kept')
+    assert scheduler.cancel('cancelled')
+    # Running and unknown units cannot be
+    assert not scheduler.cancel('running') and not scheduler.cancel('unknown')
+    release.set()
+    scheduler.shutdown()
+    assert ran == ['kept'] and cancelled.cancelled() and kept.done()
+
+
+def test_cancel_pending_cancels_queued_and_delayed_units():
+    scheduler, running, release = busy_scheduler()
+    ran = []
+    scheduler.submit('queued', ran.append, 'queued')
+    delayed = scheduler.submit_later(0.05, 'held', ran.append, 'held')
+    assert scheduler.cancel_pending() == 2
+    release.set()
+    scheduler.shutdown()
+    assert ran == [] and delayed.cancelled()
+    assert running.result() == 'running'
+
+
+def test_update_queued_only_while_queued():
+    scheduler, running, release = busy_scheduler()
+    queued = scheduler.submit('100', list, ['CAM-1'])
+    assert scheduler.update_queued('100', lambda unit: unit.append('CAM-2'))
+    assert not scheduler.update_queued('running', lambda unit: None)
+    release.set()
+    scheduler.shutdown()
+    assert queued.result() == ['CAM-1', 'CAM-2']
+    assert not scheduler.update_queued('100', lambda unit: unit.append('CAM-3'))
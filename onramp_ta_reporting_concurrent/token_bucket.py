@@ -0,0 +1,29 @@
+# token_bucket module
+# Module holds the class => TokenBucket - manages the shared Jira request rate limit
+# Class responsible for pacing the requests of all threads to a steady rate while allowing short bursts
+#
+import threading
+import time
+
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    # Blocks until a token is available and takes it
+    #
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
@@ -0,0 +1,135 @@
+# work_scheduler module
+# Module holds the class => WorkScheduler - manages the execution of the (ticket, pixel) work units
+# Class responsible for running every work unit of the run from one flat pool of worker threads, ordered by priority,
+# with a handle per unit that allows it to be cancelled before it starts, units may be queued after a delay without
+# holding a worker while they wait
+#
+from concurrent.futures import Future
+import threading
+import heapq
+import itertools
+import logging
+
+
+class WorkScheduler(object):
+    def __init__(self, max_workers):
+        self.max_workers = max(1, int(max_workers))
+        self.queue = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.workers = []
+        self.futures = {}
+        self.active = 0
+        # Futures of the work units waiting out their delay before being queued
+        self.delayed = []
+        self.closed = False
+        self.logger = logging.log
+
+    # Queues a work unit, lower priority values run first, returns a future holding the result of fn(unit)
+    #
+    def submit(self, key, fn, unit, priority=()):
+        future = Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Work scheduler has been shut down")
+            self.push((priority, next(self.sequence), key, fn, unit, future))
+        return future
+
+    # Queues a work unit once the delay in seconds has passed, shutdown waits for it, returns its future
+    #
+    def submit_later(self, delay, key, fn, unit, priority=()):
+        future = Future()
+        with self.condition:
+            self.delayed.append(future)
+            self.futures[key] = future
+
+        def release():
+            with self.condition:
+                self.delayed.remove(future)
+                if not future.done():
+                    self.push((priority, next(self.sequence), key, fn, unit, future))
+                self.condition.notify_all()
+        timer = threading.Timer(max(0, delay), release)
+        timer.daemon = True
+        timer.start()
+        return future
+
+    # Pushes a work unit on the queue and starts a worker if the pool is not full yet, called holding the condition
+    #
+    def push(self, entry):
+        heapq.heappush(self.queue, entry)
+        self.futures[entry[2]] = entry[5]
+        if len(self.workers) < self.max_workers:
+            worker = threading.Thread(target=self.worker_loop, name="Worker-" + str(len(self.workers) + 1),
+                                      daemon=True)
+            self.workers.append(worker)
+            worker.start()
+        self.condition.notify()
+
+    # Cancels a queued work unit, returns False if the unit is unknown, already running or finished
+    #
+    def cancel(self, key):
+        with self.condition:
+            future = self.futures.get(key)
+        return future.cancel() if future else False
+
+    # Applies update to the unit of a queued work unit, atomically with respect to the unit being started, returns False
+    # if the unit is unknown, cancelled or already started
+    #
+    def update_queued(self, key, update):
+        with self.condition:
+            for entry in self.queue:
+                if entry[2] == key and not entry[5].done():
+                    update(entry[4])
+                    return True
+        return False
+
+    # Cancels every work unit still waiting in the queue or out its delay, returns the number cancelled
+    #
+    def cancel_pending(self):
+        with self.condition:
+            pending = [entry[5] for entry in self.queue] + list(self.delayed)
+        return sum(1 for future in pending if future.cancel())
+
+    # Number of work units currently running and waiting, including those waiting out a delay
+    #
+    def occupancy(self):
+        with self.condition:
+            return self.active, len(self.queue) + len(self.delayed)
+
+    # Waits for every queued and delayed work unit to finish and stops the worker threads
+    #
+    def shutdown(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+            # Delayed units may start the first workers when they are released
+            while self.delayed and not self.workers:
+                self.condition.wait()
+        # A running unit may delay more work, whose release may add workers, until every worker is done
+        joined = 0
+        while joined < len(self.workers):
+            self.workers[joined].join()
+            joined += 1
+
+    # Takes the highest priority work unit off the queue and runs it, until the queue is empty and closed
+    #
+    def worker_loop(self):
+        while True:
+            with self.condition:
+                while not self.queue and (not self.closed or self.delayed):
+                    self.condition.wait()
+                if not self.queue:
+                    return
+                priority, seq, key, fn, unit, future = heapq.heappop(self.queue)
+                if not future.set_running_or_notify_cancel():
+                    continue
+                self.active += 1
+            try:
+                future.set_result(fn(unit))
+            except Exception as e:
+                self.logger(40, "Work unit " + str(key) + " failed => {}".format(e))
+                future.set_exception(e)
+            finally:
+                with self.condition:
+                    self.active -= 1